@@ -1,50 +1,95 @@
-from flask import Flask
-from config import Config
+from flask import Flask, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_mail import Mail
-from config import Config
-from celery import Celery
-import logging
+from config import Config, config_for_env
+from celery import Celery, Task
+from sqlalchemy.orm import configure_mappers
+from app.dedupe import EventDeduplicator
+from app.strava import StravaClient
+from app.tokencache import TokenCache
+from app.athletecache import AthleteCache
+from app.mailer import MailDispatcher
+from app.eventqueue import EventQueue
+from app.eventlog import EventLog
+from app.admission import Admission
+from app.gearchecks import PendingChecks
+from app.gearcache import GearCache
+from app.metrics import Metrics
+from app.stores import MemoryStore
 
 db = SQLAlchemy()
 login_manager = LoginManager()
 mail = Mail()
-celery = Celery(__name__, broker=Config.CELERY_BROKER_URL)
+dedupe = EventDeduplicator()
+strava = StravaClient()
+token_cache = TokenCache()
+athlete_cache = AthleteCache()
+mail_dispatcher = MailDispatcher(mail)
+activity_cache = MemoryStore()
+event_queue = EventQueue()
+event_log = EventLog()
+admission = Admission()
+pending_checks = PendingChecks()
+gear_cache = GearCache()
+metrics = Metrics()
 
-def create_app(config_class=Config):
+class ContextTask(Task):
+    """A Celery task that runs inside an application context so it can use the database."""
+
+    def __call__(self, *args, **kwargs):
+        if has_app_context():
+            return self.run(*args, **kwargs)
+        with self.app.flask_app.app_context():
+            return self.run(*args, **kwargs)
+
+celery = Celery(__name__, broker=Config.CELERY_BROKER_URL, task_cls=ContextTask)
+
+def create_app(config_class=None, role='web'):
+    """Create the app with a config profile, by default the one APP_ENV names.
+
+    role is 'web' or 'worker' and picks the database pool sized for that kind of
+    process. Worker apps skip logins, webhook deduplication and the views, and
+    get their tasks and models ready up front.
+    """
     app = Flask(__name__)
-    app.config.from_object(config_class)
+    app.config.from_object(config_class or config_for_env())
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', app.config[f'{role.upper()}_ENGINE_OPTIONS'])
+    app.logger.setLevel(app.config['LOG_LEVEL'])
     db.init_app(app)
-    login_manager.init_app(app)
+    metrics.init_app(app)
     mail.init_app(app)
+    strava.init_app(app)
+    token_cache.init_app(app)
+    athlete_cache.init_app(app)
+    mail_dispatcher.init_app(app)
+    event_queue.init_app(app)
+    event_log.init_app(app)
+    admission.init_app(app)
+    pending_checks.init_app(app)
+    gear_cache.init_app(app)
+    activity_cache.maxsize = app.config['ACTIVITY_CACHE_MAX_ACTIVITIES']
+    activity_cache.clear()
     celery.conf.update(app.config)
-    celery.log.setup(loglevel=logging.DEBUG)
-
-    # Celery setup
-    # def celery_init_app(app: Flask) -> Celery: 
-    #     class FlaskTask(Task):
-    #         def __call__(self, *args: object, **kwargs: object) -> object:
-    #             with app.app_context():
-    #                 return self.run(*args, **kwargs)
-
-    #     celery_app = Celery(app.name, task_cls=FlaskTask)
-    #     celery_app.config_from_object(app.config["CELERY"])
-    #     celery_app.set_default()
-    #     app.extensions["celery"] = celery_app
-    #     return celery_app
-
-    # app.config.from_mapping(
-    #     CELERY=dict(
-    #         broker_url="redis://localhost",
-    #         result_backend="redis://localhost"
-    #     ),
-    # )
-
-    from app.auth import auth_bp
-    app.register_blueprint(auth_bp)
-
-    from app.gear import gear_bp
-    app.register_blueprint(gear_bp)
+    # the Celery object was built with the base config's broker; use the profile's
+    celery.conf.broker_url = app.config['CELERY_BROKER_URL']
+    celery.log.setup(loglevel=app.config['LOG_LEVEL'])
+
+    # tasks run inside this app's context
+    celery.flask_app = app
+
+    if role == 'web':
+        login_manager.init_app(app)
+        dedupe.init_app(app)
+
+        from app.auth.routes import auth_bp
+        app.register_blueprint(auth_bp)
+
+        from app.gear.routes import gear_bp
+        app.register_blueprint(gear_bp)
+    else:
+        # once in the parent, before Celery forks its children, rather than in each child's first task
+        celery.loader.import_default_modules()
+        configure_mappers()
 
     return app
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""Admission of webhook events according to how deep the worker queues are."""
+
+import logging
+import time
+from app.stores import redis_client
+
+logger = logging.getLogger(__name__)
+
+QUEUE = 'queue'
+DEFER = 'defer'
+SPILL = 'spill'
+
+# the Redis transport keeps lower priorities in sublists named queue + separator + step
+PRIORITY_STEPS = (0, 3, 6, 9)
+PRIORITY_SEPARATOR = '\x06\x16'
+
+class Admission:
+    """Decides how to take a new webhook event given the depth of the queues it'd join.
+
+    Strava must see an acknowledgement within seconds whatever the backlog, so
+    the webhook always acks; what changes is where the event goes. Past
+    ADMISSION_DEFER_WATERMARK waiting events, updates and deletes are queued
+    at low priority behind new activities. Past ADMISSION_SPILL_WATERMARK,
+    events are only written to the event log and queued from it once the
+    queues drain. The depth is sampled at most every ADMISSION_SAMPLE_INTERVAL
+    seconds per process, so admission adds a Redis round trip now and then
+    rather than one per event.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.defer_watermark = None
+        self.spill_watermark = None
+        self.low_priority = 9
+        self.sample_interval = 1.0
+        self._config = None
+        self._redis = None
+        self._metrics = None
+        self._depth = 0
+        self._sampled_at = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the watermarks and connect to the broker from the app config."""
+        self.enabled = app.config['ADMISSION_ENABLED']
+        self.defer_watermark = app.config['ADMISSION_DEFER_WATERMARK']
+        self.spill_watermark = app.config['ADMISSION_SPILL_WATERMARK']
+        self.low_priority = app.config['ADMISSION_LOW_PRIORITY']
+        self.sample_interval = app.config['ADMISSION_SAMPLE_INTERVAL']
+        self._config = app.config
+        self._sampled_at = 0.0
+        self._redis = None
+        if self.enabled and app.config['WORKER_MODE'] == 'asyncio':
+            self._redis = redis_client(app)
+        elif self.enabled and not app.config['CELERY_BROKER_URL'].startswith(('redis://', 'rediss://', 'unix://')):
+            # only the Redis transport's queue lengths can be read, so take every event as it comes
+            logger.warning("admission needs a Redis broker, turning it off")
+            self.enabled = False
+        elif self.enabled:
+            import redis
+            self._redis = redis.Redis.from_url(app.config['CELERY_BROKER_URL'])
+        self._metrics = app.extensions.get('metrics')
+        if self._metrics is not None:
+            self._metrics.set_admission_watermarks(self.defer_watermark, self.spill_watermark)
+        app.extensions['admission'] = self
+
+    def queue_keys(self):
+        """Return the Redis keys of every list holding events for workers."""
+        from app import celery, event_queue, partitions
+        count = self._config['EVENT_PARTITIONS']
+        if self._config['WORKER_MODE'] == 'asyncio':
+            return [event_queue.key_for(partition) for partition in (range(count) if count else [None])]
+        queues = [partitions.queue_name(partition) for partition in range(count)] if count else [celery.conf.task_default_queue]
+        return [queue + (f'{PRIORITY_SEPARATOR}{step}' if step else '') for queue in queues for step in PRIORITY_STEPS]
+
+    def depth(self):
+        """Return how many events are waiting for workers, sampled at most every sample_interval seconds."""
+        now = time.monotonic()
+        if now - self._sampled_at < self.sample_interval:
+            return self._depth
+        self._sampled_at = now
+        try:
+            pipeline = self._redis.pipeline(transaction=False)
+            for key in self.queue_keys():
+                pipeline.llen(key)
+            self._depth = sum(pipeline.execute())
+        except Exception as error:
+            # keep taking events as if the queues were as last seen rather than fail the ack
+            logger.warning(f"couldn't sample the queue depth: {error}")
+        if self._metrics is not None:
+            self._metrics.observe_queue_depth(self._depth)
+        return self._depth
+
+    def decide(self, data):
+        """Return QUEUE, DEFER or SPILL for a new event."""
+        if not self.enabled:
+            return QUEUE
+        depth = self.depth()
+        if depth >= self.spill_watermark:
+            return SPILL
+        if depth >= self.defer_watermark and data['aspect_type'] != 'create':
+            return DEFER
+        return QUEUE
+
+    def room(self):
+        """Return how many spilled events can be queued before the queues reach the defer watermark again."""
+        if not self.enabled:
+            # nothing to go by, so a watermark's worth at a time
+            return self.defer_watermark
+        return max(0, self.defer_watermark - self.depth())
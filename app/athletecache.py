@@ -0,0 +1,63 @@
+"""Read-through cache of athletes' email and default shoe."""
+
+from app.stores import MemoryStore, RedisStore, redis_client
+
+class AthleteCache:
+    """Caches athlete details by Strava athlete ID in an in-process LRU with an optional Redis tier.
+
+    Writes invalidate both tiers, but only the local tier of the writing process,
+    so entries in the local tier live for ATHLETE_CACHE_LOCAL_TTL seconds at most.
+    """
+
+    def __init__(self, app=None):
+        self.local = None
+        self.shared = None
+        self.local_ttl = None
+        self.shared_ttl = None
+        self._metrics = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the cache tiers from the app config."""
+        self.local = MemoryStore(app.config['ATHLETE_CACHE_MAX_ATHLETES'])
+        self.local_ttl = app.config['ATHLETE_CACHE_LOCAL_TTL']
+        self.shared_ttl = app.config['ATHLETE_CACHE_TTL']
+        if app.config['ATHLETE_CACHE_BACKEND'] == 'redis':
+            self.shared = RedisStore(redis_client(app), 'athlete:')
+        self._metrics = app.extensions.get('metrics')
+        app.extensions['athlete_cache'] = self
+
+    def get(self, strava_id):
+        """Retrieve cached athlete details, or None."""
+        key = str(strava_id)
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local')
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._count('shared')
+                self.local.set(key, value, self.local_ttl)
+                return value
+        self._count('miss')
+        return None
+
+    def _count(self, result):
+        if self._metrics is not None:
+            self._metrics.count_athlete_lookup(result)
+
+    def set(self, strava_id, value):
+        """Cache athlete details."""
+        key = str(strava_id)
+        self.local.set(key, value, self.local_ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, self.shared_ttl)
+
+    def invalidate(self, strava_id):
+        """Forget an athlete's cached details after they change."""
+        key = str(strava_id)
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
@@ -1,5 +1,3 @@
 from flask import Blueprint
 
-auth_bp = Blueprint('auth', __name__)
-
-from . import routes
\ No newline at end of file
+auth_bp = Blueprint('auth', __name__)
\ No newline at end of file
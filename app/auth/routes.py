@@ -1,9 +1,8 @@
-import requests
 from flask import flash, render_template, request, redirect, jsonify
 from flask_login import login_user, logout_user, login_required
 from app import crud
 from app.auth import auth_bp
-from app import db 
+from app import db, strava
 from datetime import datetime, timedelta
 from app import login_manager
 from .. import constants
@@ -58,7 +57,7 @@ def callback():
         'grant_type': 'authorization_code', # always 'authorization_code' for initial authentication
     }
     
-    token_response = requests.post(constants.TOKEN_URL, data=data)
+    token_response = strava.exchange_token(data)
 
     if token_response.status_code == 200:
         token_data = token_response.json()
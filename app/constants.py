@@ -1,10 +1,12 @@
 import os 
 
-# Retrieve secrets
-CLIENT_ID = os.environ['CLIENT_ID']
-CLIENT_SECRET = os.environ['CLIENT_SECRET']
-REDIRECT_URI = os.environ['REDIRECT_URI']
-STRAVA_VERIFY_TOKEN = os.environ['STRAVA_VERIFY_TOKEN']
+# Secrets, read from the environment when first used so that importing the app needs none of them
+SECRETS = ('CLIENT_ID', 'CLIENT_SECRET', 'REDIRECT_URI', 'STRAVA_VERIFY_TOKEN')
+
+def __getattr__(name):
+    if name in SECRETS:
+        return os.environ[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Strava endpoints
 BASE_URL = 'https://www.strava.com/api/v3'
@@ -1,8 +1,33 @@
 """CRUD operations for interacting with the database."""
 
-from app.model import User, AccessToken, RefreshToken, Shoe
+import uuid
+from collections import namedtuple
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from app import activity_cache, athlete_cache, constants
+from app.model import db, User, AccessToken, RefreshToken, Shoe, ShoeDefault, Activity, BackfillCursor, ShoeStats, ShoeWeeklyStats, LoggedEvent
 from datetime import datetime, timedelta
 
+# everything needed to process a webhook event for an athlete, as plain values;
+# default_gear maps each sport type with a default shoe to that shoe's (strava_gear_id, name)
+EventContext = namedtuple('EventContext', ['user_id', 'email', 'email_consent', 'access_token_code',
+                                           'access_token_expires_at', 'default_gear'])
+
+# the fields of a Strava activity the gear checker needs
+ActivityRecord = namedtuple('ActivityRecord', ['activity_id', 'user_id', 'gear_id', 'sport_type', 'start_date_local',
+                                               'distance', 'moving_time', 'fetched_at'])
+
+# the totals kept per shoe, overall and by week
+STAT_FIELDS = ('distance', 'moving_time', 'activity_count')
+
+# an event from the event log claimed for a new task; received_at is a timestamp, as the webhook records it
+EventClaim = namedtuple('EventClaim', ['event_id', 'data', 'received_at', 'task_id'])
+
+def upsert(model):
+    """Build an INSERT ... ON CONFLICT statement for the database in use."""
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
 def get_user_by_id(user_id):
     """Retrieve a user by user ID."""
     return User.query.get(user_id)
@@ -13,7 +38,7 @@ def get_user_by_email(email):
 
 def create_shoe(strava_id, name, nickname, retired, user_id):
     """Create a shoe instance."""
-    shoe = Shoe(strava_gear_id=strava_id, name=name, nickname=nickname, retired=retired, user_id=user_id, run_default=False)
+    shoe = Shoe(strava_gear_id=strava_id, name=name, nickname=nickname, retired=retired, user_id=user_id)
     return shoe
 
 def get_shoe_by_id(id):
@@ -24,14 +49,401 @@ def get_shoe_by_strava_id(strava_id):
     """Retrieve a shoe by Strava ID."""
     return Shoe.query.filter_by(strava_gear_id=strava_id).first()
 
-def get_user_default_shoe(user_id):
-    """Retrieve a user's default shoe."""
-    return Shoe.query.filter_by(user_id = user_id, run_default = True).first() 
+def get_user_shoes(user_id):
+    """Retrieve all of a user's shoes."""
+    return Shoe.query.filter_by(user_id = user_id).all()
+
+def sync_user_shoes(user_id, strava_shoes):
+    """Insert or update a user's shoes from Strava athlete data and return all of the user's shoes.
+
+    Loads the user's shoes once, then writes every new or changed shoe in a single
+    upsert, so a sync costs the same few queries however many shoes there are.
+    """
+    existing = {shoe.strava_gear_id: shoe for shoe in get_user_shoes(user_id)}
+    rows = []
+    for strava_shoe in strava_shoes:
+        row = {'strava_gear_id': strava_shoe['id'], 'name': strava_shoe['name'], 'nickname': strava_shoe['nickname'],
+               'retired': strava_shoe['retired'], 'user_id': user_id}
+        shoe = existing.get(strava_shoe['id'])
+        if shoe and (shoe.name, shoe.nickname, shoe.retired) == (row['name'], row['nickname'], row['retired']):
+            continue
+        rows.append(row)
+    if not rows:
+        return list(existing.values())
+
+    statement = upsert(Shoe).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Shoe.strava_gear_id],
+        set_={'name': statement.excluded.name, 'nickname': statement.excluded.nickname,
+              'retired': statement.excluded.retired, 'user_id': statement.excluded.user_id},
+    )
+    db.session.execute(statement)
+    db.session.commit()
+    return Shoe.query.filter_by(user_id = user_id).execution_options(populate_existing=True).all()
+
+def get_user_active_shoes(user_id):
+    """Retrieve a user's shoes that aren't retired."""
+    return Shoe.query.filter_by(user_id = user_id, retired = False).all()
+
+def get_user_default_shoe(user_id, sport_type='Run'):
+    """Retrieve a user's default shoe for a sport type."""
+    return Shoe.query.join(ShoeDefault).filter(ShoeDefault.user_id == user_id, ShoeDefault.sport_type == sport_type).first()
+
+def get_user_default_gear_ids(user_id):
+    """Retrieve a map of sport type to the Strava ID of the user's default shoe for it."""
+    query = select(ShoeDefault.sport_type, Shoe.strava_gear_id).join(Shoe).where(ShoeDefault.user_id == user_id)
+    return dict(db.session.execute(query).all())
+
+def get_user_shoe_defaults(user_id):
+    """Retrieve a map of shoe ID to the sport types it's the user's default for."""
+    defaults = {}
+    for shoe_id, sport_type in db.session.execute(
+            select(ShoeDefault.shoe_id, ShoeDefault.sport_type).where(ShoeDefault.user_id == user_id)):
+        defaults.setdefault(shoe_id, []).append(sport_type)
+    return defaults
+
+def set_default_shoe(user, shoe_id, sport_types, scope=constants.SHOE_ACTIVITIES):
+    """Make a shoe the user's default for exactly the given sport types within scope.
+
+    Sport types in scope but not given stop defaulting to the shoe. Returns maps
+    of shoe ID to the sport types added to and removed from each shoe.
+    """
+    existing = {default.sport_type: default for default in ShoeDefault.query.filter_by(user_id = user.id)}
+    added = {}
+    deleted = {}
+    for sport_type in scope:
+        default = existing.get(sport_type)
+        if sport_type in sport_types:
+            if default is None:
+                db.session.add(ShoeDefault(user_id=user.id, shoe_id=shoe_id, sport_type=sport_type))
+            elif default.shoe_id != shoe_id:
+                deleted.setdefault(default.shoe_id, []).append(sport_type)
+                default.shoe_id = shoe_id
+            else:
+                continue
+            added.setdefault(shoe_id, []).append(sport_type)
+        elif default is not None and default.shoe_id == shoe_id:
+            db.session.delete(default)
+            deleted.setdefault(shoe_id, []).append(sport_type)
+    db.session.commit()
+    athlete_cache.invalidate(user.strava_id)
+    return added, deleted
 
 def get_user_by_strava_id(strava_id):
     """Retrieve a user by Strava ID."""
     return User.query.filter_by(strava_id=strava_id).first()
 
+def get_event_context(strava_id):
+    """Retrieve the user, access token and default shoe for a Strava athlete.
+
+    Athlete details come from the athlete cache when possible, leaving the token
+    fields empty for the token cache to fill; otherwise they are loaded in one query.
+    Returns None for an unknown athlete or one without an access token.
+    """
+    cached = athlete_cache.get(strava_id)
+    if cached is not None:
+        user_id, email, email_consent, default_gear = cached
+        return EventContext(user_id, email, email_consent, None, None, default_gear)
+
+    # one row per sport type with a default shoe
+    query = (
+        select(User.id, User.email, User.email_consent, AccessToken.code, AccessToken.expires_at,
+               ShoeDefault.sport_type, Shoe.strava_gear_id, Shoe.name)
+        .outerjoin(AccessToken, AccessToken.user_id == User.id)
+        .outerjoin(ShoeDefault, ShoeDefault.user_id == User.id)
+        .outerjoin(Shoe, Shoe.id == ShoeDefault.shoe_id)
+        .where(User.strava_id == strava_id)
+    )
+    rows = db.session.execute(query).all()
+    # without an access token, e.g. after deauthorizing the app, there's nothing to fetch activities with
+    if not rows or rows[0].code is None:
+        return None
+    default_gear = {sport_type: (strava_gear_id, name) for *_, sport_type, strava_gear_id, name in rows if sport_type}
+    context = EventContext(*rows[0][:5], default_gear)
+    athlete_cache.set(strava_id, [context.user_id, context.email, context.email_consent, default_gear])
+    return context
+
+def set_email_consent(user, email, email_consent):
+    """Update a user's email address and consent to reminders."""
+    user.email = email
+    user.email_consent = email_consent
+    db.session.commit()
+    athlete_cache.invalidate(user.strava_id)
+
+def select_activities():
+    """Build a query for stored activities as ActivityRecord fields."""
+    return select(Activity.strava_activity_id, Activity.user_id, Activity.gear_id, Activity.sport_type,
+                  Activity.start_date_local, Activity.distance, Activity.moving_time, Activity.fetched_at)
+
+def get_activity(activity_id):
+    """Retrieve a stored activity, from the activity cache when possible."""
+    activity = activity_cache.get(str(activity_id))
+    if activity is not None:
+        return activity
+    row = db.session.execute(select_activities().where(Activity.strava_activity_id == activity_id)).first()
+    if not row:
+        return None
+    activity = ActivityRecord(*row)
+    activity_cache.set(str(activity_id), activity)
+    return activity
+
+def lock_activities(activity_ids):
+    """Retrieve the stored activities among activity_ids by ID, locking their rows until the transaction ends."""
+    rows = db.session.execute(
+        select_activities().where(Activity.strava_activity_id.in_(activity_ids)).with_for_update()
+    )
+    return {row[0]: ActivityRecord(*row) for row in rows}
+
+def save_activities(user_id, activities_details):
+    """Store the fields the gear checker needs from Strava activities and return the records.
+
+    Shoe totals are corrected in the same transaction by the difference between
+    each activity as stored before and after. New activities are inserted only
+    if no one else has stored them meanwhile, e.g. a backfill and a webhook
+    event at once; those that were are updated like stored ones, so their
+    distance is counted once.
+    """
+    fetched_at = datetime.now()
+    activities = [ActivityRecord(details['id'], user_id, details['gear_id'], details['sport_type'],
+                                 datetime.strptime(details['start_date_local'], '%Y-%m-%dT%H:%M:%SZ'),
+                                 details['distance'], details['moving_time'], fetched_at)
+                  for details in activities_details]
+    if not activities:
+        return activities
+    previous = lock_activities([activity.activity_id for activity in activities])
+    rows = {}
+    for activity in activities:
+        values = activity._asdict()
+        values['strava_activity_id'] = values.pop('activity_id')
+        rows[activity.activity_id] = values
+
+    new_ids = [activity_id for activity_id in rows if activity_id not in previous]
+    if new_ids:
+        statement = upsert(Activity).values([rows[activity_id] for activity_id in new_ids])
+        statement = statement.on_conflict_do_nothing(index_elements=[Activity.strava_activity_id])
+        inserted = set(db.session.scalars(statement.returning(Activity.strava_activity_id)))
+        previous.update(lock_activities([activity_id for activity_id in new_ids if activity_id not in inserted]))
+    if previous:
+        statement = upsert(Activity).values([rows[activity_id] for activity_id in previous])
+        statement = statement.on_conflict_do_update(
+            index_elements=[Activity.strava_activity_id],
+            set_={field: statement.excluded[field] for field in ('gear_id', 'sport_type', 'start_date_local', 'distance',
+                                                                 'moving_time', 'fetched_at')},
+        )
+        db.session.execute(statement)
+    apply_shoe_stat_deltas(list(previous.values()), activities)
+    db.session.commit()
+    return activities
+
+def save_activity(activity_id, user_id, activity_details):
+    """Store the fields the gear checker needs from a detailed Strava activity."""
+    activity, = save_activities(user_id, [{**activity_details, 'id': activity_id}])
+    activity_cache.set(str(activity_id), activity)
+    return activity
+
+def patch_activity(activity_id, updates):
+    """Apply the changes from an update event to a stored activity without fetching it.
+
+    Returns the patched activity, or None if it isn't stored.
+    """
+    activity = get_activity(activity_id)
+    if activity is None:
+        return None
+    sport_type = updates.get('sport_type', updates.get('type'))
+    if sport_type and sport_type != activity.sport_type:
+        Activity.query.filter_by(strava_activity_id = activity_id).update({'sport_type': sport_type})
+        db.session.commit()
+        activity = activity._replace(sport_type = sport_type)
+        activity_cache.set(str(activity_id), activity)
+    return activity
+
+def delete_activity(activity_id):
+    """Remove a stored activity and take it off its shoe's totals."""
+    row = db.session.execute(
+        select_activities().where(Activity.strava_activity_id == activity_id).with_for_update()
+    ).first()
+    if row:
+        Activity.query.filter_by(strava_activity_id = activity_id).delete()
+        apply_shoe_stat_deltas([ActivityRecord(*row)], [])
+        db.session.commit()
+    activity_cache.delete(str(activity_id))
+
+def shoe_stat_deltas(removed, added):
+    """Net the changes to each shoe's weekly totals from activities removed and added.
+
+    Returns a map of (gear_id, week_start, user_id) to [distance, moving_time, activity_count] deltas.
+    """
+    deltas = {}
+    for sign, activities in ((-1, removed), (1, added)):
+        for activity in activities:
+            if not activity.gear_id or activity.start_date_local is None:
+                continue
+            start = activity.start_date_local.date()
+            key = (activity.gear_id, start - timedelta(days=start.weekday()), activity.user_id)
+            delta = deltas.setdefault(key, [0, 0, 0])
+            delta[0] += sign * (activity.distance or 0)
+            delta[1] += sign * (activity.moving_time or 0)
+            delta[2] += sign
+    return {key: delta for key, delta in deltas.items() if any(delta)}
+
+def apply_shoe_stat_deltas(removed, added):
+    """Add the difference made by replacing removed activities with added ones to shoe totals.
+
+    Each table gets one upsert adding the deltas to the stored totals, so a
+    reassigned or deleted activity costs a few statements rather than a recompute.
+    """
+    weekly = shoe_stat_deltas(removed, added)
+    if not weekly:
+        return
+    totals = {}
+    for (gear_id, _, _), delta in weekly.items():
+        total = totals.setdefault(gear_id, [0, 0, 0])
+        for i, value in enumerate(delta):
+            total[i] += value
+
+    for model, rows in (
+        (ShoeStats, [{'gear_id': gear_id, **dict(zip(STAT_FIELDS, delta))} for gear_id, delta in totals.items()]),
+        (ShoeWeeklyStats, [{'gear_id': gear_id, 'week_start': week_start, 'user_id': user_id, **dict(zip(STAT_FIELDS, delta))}
+                           for (gear_id, week_start, user_id), delta in weekly.items()]),
+    ):
+        statement = upsert(model).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(model.__table__.primary_key.columns),
+            set_={field: getattr(model, field) + statement.excluded[field] for field in STAT_FIELDS},
+        )
+        db.session.execute(statement)
+
+def get_user_shoe_stats(user_id):
+    """Retrieve each of a user's active shoes with its totals, which are None for shoes with no activities."""
+    return db.session.execute(
+        select(Shoe.strava_gear_id, Shoe.name, Shoe.nickname, ShoeStats.distance, ShoeStats.moving_time,
+               ShoeStats.activity_count)
+        .outerjoin(ShoeStats, ShoeStats.gear_id == Shoe.strava_gear_id)
+        .where(Shoe.user_id == user_id, Shoe.retired == False)
+        .order_by(ShoeStats.distance.desc().nulls_last())
+    ).all()
+
+def get_user_weekly_distances(user_id, since):
+    """Retrieve a map of (gear_id, week_start) to distance for a user's weeks starting on or after since."""
+    rows = db.session.execute(
+        select(ShoeWeeklyStats.gear_id, ShoeWeeklyStats.week_start, ShoeWeeklyStats.distance)
+        .where(ShoeWeeklyStats.user_id == user_id, ShoeWeeklyStats.week_start >= since)
+    )
+    return {(gear_id, week_start): distance for gear_id, week_start, distance in rows}
+
+def claim_replacement_alert(gear_id, distance):
+    """Mark a shoe as alerted if its total has reached distance and it hasn't been yet.
+
+    Returns whether this call marked it, so the alert goes out once however many
+    workers check the same shoe.
+    """
+    result = db.session.execute(
+        update(ShoeStats)
+        .where(ShoeStats.gear_id == gear_id, ShoeStats.distance >= distance, ShoeStats.replacement_alerted_on.is_(None))
+        .values(replacement_alerted_on = datetime.now())
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+def release_replacement_alert(gear_id):
+    """Unmark a shoe as alerted, after the alert claimed for it couldn't be sent."""
+    db.session.execute(update(ShoeStats).where(ShoeStats.gear_id == gear_id).values(replacement_alerted_on = None))
+    db.session.commit()
+
+def get_backfill_cursor(user_id):
+    """Retrieve a user's backfill progress, starting a new backfill if there is none."""
+    cursor = db.session.get(BackfillCursor, user_id)
+    if cursor is None:
+        cursor = BackfillCursor(user_id=user_id)
+        db.session.add(cursor)
+        db.session.commit()
+    return cursor
+
+def log_events(events):
+    """Append (data, received_at) webhook events to the event log in one transaction and return their IDs.
+
+    An event given as (data, received_at, True) is logged as spilled, to be queued later.
+    """
+    rows = [{'received_at': datetime.fromtimestamp(received_at), 'owner_id': data['owner_id'],
+             'object_id': data['object_id'], 'aspect_type': data['aspect_type'], 'payload': data,
+             'spilled': bool(spilled and spilled[0])}
+            for data, received_at, *spilled in events]
+    # on its own connection, so the commit doesn't take along anything pending in the caller's session
+    with db.engine.begin() as connection:
+        return connection.scalars(insert(LoggedEvent).returning(LoggedEvent.id, sort_by_parameter_order=True),
+                                  rows).all()
+
+def claim_event(event_id, task_id, lease):
+    """Claim a logged event for task_id unless it's processed or another task claimed it under lease seconds ago.
+
+    Returns whether the event is task_id's to process, so a redelivered or
+    requeued copy of an event is processed once. A task's retries keep its ID
+    and with it the claim.
+    """
+    now = datetime.now()
+    result = db.session.execute(
+        update(LoggedEvent)
+        .where(LoggedEvent.id == event_id, LoggedEvent.processed_at.is_(None),
+               or_(LoggedEvent.claimed_by.is_(None), LoggedEvent.claimed_by == task_id,
+                   LoggedEvent.claimed_at < now - timedelta(seconds=lease)))
+        .values(claimed_by=task_id, claimed_at=now)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+def finish_event(event_id):
+    """Mark a logged event as processed."""
+    db.session.execute(update(LoggedEvent).where(LoggedEvent.id == event_id).values(processed_at=datetime.now()))
+    db.session.commit()
+
+def claim_logged_events(conditions, limit, requeue=False):
+    """Claim up to limit logged events matching conditions for new tasks, in log order.
+
+    Rows another claimer has locked are skipped rather than waited for, so
+    concurrent sweeps claim different events. Each claim is recorded under a
+    new task ID and any processed or spilled mark is cleared; requeue counts it
+    as a requeue. Returns EventClaims for the caller to queue.
+    """
+    events = db.session.scalars(
+        select(LoggedEvent).where(*conditions).order_by(LoggedEvent.id).limit(limit).with_for_update(skip_locked=True)
+    ).all()
+    now = datetime.now()
+    claims = []
+    for event in events:
+        event.claimed_by = uuid.uuid4().hex
+        event.claimed_at = now
+        event.processed_at = None
+        event.spilled = False
+        if requeue:
+            event.requeues += 1
+        claims.append(EventClaim(event.id, event.payload, event.received_at.timestamp(), event.claimed_by))
+    db.session.commit()
+    return claims
+
+def claim_stalled_events(lease, max_requeues, limit):
+    """Claim events still unprocessed lease seconds after arriving and not claimed in that time, to queue again."""
+    cutoff = datetime.now() - timedelta(seconds=lease)
+    return claim_logged_events((LoggedEvent.processed_at.is_(None), LoggedEvent.received_at < cutoff,
+                                or_(LoggedEvent.claimed_at.is_(None), LoggedEvent.claimed_at < cutoff),
+                                LoggedEvent.requeues < max_requeues, LoggedEvent.spilled.is_(False)),
+                               limit, requeue=True)
+
+def claim_spilled_events(limit):
+    """Claim the oldest events spilled to the event log, to queue now that there's room."""
+    return claim_logged_events((LoggedEvent.spilled.is_(True),), limit)
+
+def claim_events_to_replay(since, until, after_id, limit, owner_id=None, include_processed=False):
+    """Claim events received between since and until with IDs after after_id, to process again.
+
+    Only events never processed are claimed unless include_processed is set.
+    """
+    conditions = [LoggedEvent.received_at >= since, LoggedEvent.received_at < until, LoggedEvent.id > after_id]
+    if owner_id is not None:
+        conditions.append(LoggedEvent.owner_id == owner_id)
+    if not include_processed:
+        conditions.append(LoggedEvent.processed_at.is_(None))
+    return claim_logged_events(conditions, limit)
+
 def create_user(strava_id):
     """Create a new user."""
     user = User(strava_id=strava_id)
@@ -56,11 +468,22 @@ def strava_authenticated(user_id):
 def user_has_active_access_token(user_id):
     """Check if the user has an active access token."""
     token = get_access_token(user_id)
-    return token.expires_at > datetime.now() + timedelta(minutes=5)
+    return token is not None and token.expires_at > datetime.now() + timedelta(minutes=5)
 
 def get_access_token(user_id):
-    """Retrieve the access token for a user."""
-    return AccessToken.query.filter_by(user_id=user_id).one()
+    """Retrieve the access token for a user, or None if they have none."""
+    return AccessToken.query.filter_by(user_id=user_id).one_or_none()
+
+def get_user_ids_with_tokens_expiring_before(cutoff):
+    """Retrieve the IDs of users whose access token expires before cutoff."""
+    return [user_id for user_id, in AccessToken.query.with_entities(AccessToken.user_id).filter(AccessToken.expires_at < cutoff)]
+
+def get_active_users(since, limit, after_id=0):
+    """Retrieve the (ID, Strava ID) of up to limit users with an activity starting since, by ID after after_id."""
+    query = (select(User.id, User.strava_id).join(Activity, Activity.user_id == User.id)
+             .where(Activity.start_date_local >= since, User.id > after_id).group_by(User.id, User.strava_id)
+             .order_by(User.id).limit(limit))
+    return db.session.execute(query).all()
 
 def get_refresh_token(user_id):
     """Retrieve the refresh token for a user."""
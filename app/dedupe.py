@@ -0,0 +1,41 @@
+"""Deduplication of repeat Strava webhook deliveries."""
+
+from app.stores import make_store
+
+class EventDeduplicator:
+    """Drops webhook events that have already been delivered.
+
+    Strava retries a delivery when it doesn't see a timely acknowledgement, so
+    the same event can arrive more than once. An event is identified by its
+    object, aspect, time and owner and remembered for DEDUPE_TTL seconds.
+    """
+
+    def __init__(self, app=None):
+        self.store = None
+        self.ttl = None
+        self._metrics = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the backing store from the app config."""
+        self.store = make_store(app, app.config['DEDUPE_BACKEND'], 'dedupe:', app.config['DEDUPE_MAX_EVENTS'])
+        self.ttl = app.config['DEDUPE_TTL']
+        self._metrics = app.extensions.get('metrics')
+        app.extensions['dedupe'] = self
+
+    @staticmethod
+    def event_key(data):
+        """Build the identity of a webhook event."""
+        return f"{data['object_id']}:{data['aspect_type']}:{data['event_time']}:{data['owner_id']}"
+
+    def is_first_delivery(self, data):
+        """Record an event and return whether it hasn't been seen before."""
+        first = self.store.add(self.event_key(data), 1, self.ttl)
+        if self._metrics is not None:
+            self._metrics.count_webhook_delivery('first' if first else 'duplicate')
+        return first
+
+    def forget(self, data):
+        """Forget an event whose handoff failed, so Strava's retry of it is taken rather than dropped."""
+        self.store.delete(self.event_key(data))
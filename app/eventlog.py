@@ -0,0 +1,82 @@
+"""Durable log of accepted webhook events."""
+
+import threading
+import time
+
+class _Entry:
+    """An event waiting to be logged, and once it's committed, its ID or the error that stopped it."""
+
+    __slots__ = ('data', 'received_at', 'spilled', 'event_id', 'error')
+
+    def __init__(self, data, received_at, spilled):
+        self.data = data
+        self.received_at = received_at
+        self.spilled = spilled
+        self.event_id = None
+        self.error = None
+
+class EventLog:
+    """Writes each accepted webhook event to the event_log table before it's queued.
+
+    An acknowledged event is then on disk even if Redis or a worker loses it,
+    and can be requeued or replayed from the log. Appends are group committed:
+    while one thread commits, events appended by others gather, and the next
+    thread to commit writes them all with one INSERT and one commit, at most
+    EVENT_LOG_BATCH_SIZE at a time. Under a burst the cost per event is a
+    share of a commit rather than a commit each.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.batch_size = 500
+        self.commits = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._metrics = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure logging and batching from the app config."""
+        self.enabled = app.config['EVENT_LOG_ENABLED']
+        self.batch_size = app.config['EVENT_LOG_BATCH_SIZE']
+        self._metrics = app.extensions.get('metrics')
+        app.extensions['event_log'] = self
+
+    def append(self, data, received_at, spilled=False):
+        """Log an event and return its ID once committed, or None if the log is disabled.
+
+        A spilled event is logged to be queued later, when the queues have room.
+        """
+        if not self.enabled:
+            return None
+        entry = _Entry(data, received_at, spilled)
+        with self._lock:
+            self._pending.append(entry)
+        while entry.event_id is None:
+            with self._commit_lock:
+                # the thread before may have committed this entry along with its own
+                if entry.event_id is None and entry.error is None:
+                    self._commit_pending()
+            if entry.error is not None:
+                raise entry.error
+        return entry.event_id
+
+    def _commit_pending(self):
+        """Write the events waiting to be logged, up to a batch, in one transaction."""
+        from app import crud
+        with self._lock:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+        started = time.perf_counter()
+        try:
+            event_ids = crud.log_events([(entry.data, entry.received_at, entry.spilled) for entry in batch])
+        except Exception as error:
+            for entry in batch:
+                entry.error = error
+            return
+        for entry, event_id in zip(batch, event_ids):
+            entry.event_id = event_id
+        self.commits += 1
+        if self._metrics is not None:
+            self._metrics.observe_event_log_commit(len(batch), time.perf_counter() - started)
@@ -0,0 +1,46 @@
+"""Queue of webhook events for the asyncio worker."""
+
+import json
+from app.stores import redis_client
+
+# the object_type of entries asking the worker for a partition to refresh a user's tokens
+TOKEN_REFRESH = 'token_refresh'
+
+class EventQueue:
+    """A Redis list of raw webhook events, pushed by the web app and popped by asyncio workers.
+
+    Only used when WORKER_MODE is 'asyncio'; prefork workers take events from
+    Celery's own queue instead.
+    """
+
+    def __init__(self, app=None):
+        self.key = 'events:async'
+        self._redis = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Connect to Redis if the app runs asyncio workers."""
+        self.key = app.config['ASYNC_EVENT_QUEUE']
+        self._redis = redis_client(app) if app.config['WORKER_MODE'] == 'asyncio' else None
+        app.extensions['event_queue'] = self
+
+    def push(self, data, received_at=None, event_id=None, task_id=None, partition=None):
+        """Add an event, with when the webhook received it and its event log claim, to the back of its queue."""
+        self._redis.rpush(self.key_for(partition), json.dumps([data, received_at, event_id, task_id]))
+
+    def push_token_refresh(self, owner_id, user_id, margin=None, partition=None):
+        """Ask the worker for a partition to refresh a user's tokens, in turn with the athlete's events."""
+        self.push({'object_type': TOKEN_REFRESH, 'owner_id': owner_id, 'user_id': user_id, 'margin': margin},
+                  partition=partition)
+
+    def key_for(self, partition=None):
+        """Return the Redis key of the queue, or of one partition's queue."""
+        return self.key if partition is None else f'{self.key}:{partition}'
+
+    @staticmethod
+    def decode(raw):
+        """Turn a popped queue entry back into (data, received_at, event_id, task_id)."""
+        # entries queued before the event log have only the first two
+        data, received_at, event_id, task_id = (json.loads(raw) + [None, None])[:4]
+        return data, received_at, event_id, task_id
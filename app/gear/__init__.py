@@ -1,5 +1,3 @@
 from flask import Blueprint
 
-gear_bp = Blueprint('gear', __name__)
-
-from . import routes
\ No newline at end of file
+gear_bp = Blueprint('gear', __name__)
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""An asyncio worker that keeps many webhook events in flight per process.
+
+A Celery prefork child handles one event at a time and spends most of it
+waiting on Strava and the mail server. With WORKER_MODE = 'asyncio' the
+webhook pushes events onto the event queue instead, and each worker process
+checks up to ASYNC_WORKER_CONCURRENCY of them at once. Activities are fetched
+with aiohttp; everything else that blocks, the database, tokens, the rate
+limiter's Redis and mail, runs on a small thread pool, each call in its own
+app context and so with its own database session. Whether to remind is
+decided by the same function the prefork task uses.
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import redis.asyncio
+from .. import constants, crud, db, event_queue, metrics, pending_checks, strava, tokens
+from ..eventqueue import TOKEN_REFRESH
+from ..ratelimit import PRIORITY_HIGH, RateLimitDeferred
+from . import helpers
+
+logger = logging.getLogger(__name__)
+
+class AsyncEventWorker:
+    """Processes webhook events concurrently on one event loop.
+
+    Use as an async context manager, which opens and closes the HTTP session.
+    """
+
+    def __init__(self, app, concurrency=None, threads=None):
+        self.app = app
+        self.concurrency = concurrency or app.config['ASYNC_WORKER_CONCURRENCY']
+        self.processed = 0
+        self.failed = 0
+        self._executor = ThreadPoolExecutor(max_workers=threads or app.config['ASYNC_WORKER_THREADS'])
+        self._session = None
+
+    async def __aenter__(self):
+        timeout = aiohttp.ClientTimeout(sock_connect=strava.timeout[0], sock_read=strava.timeout[1])
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._executor.shutdown()
+
+    def _in_context(self, function, *args):
+        with self.app.app_context():
+            try:
+                return function(*args)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+    async def run_in_thread(self, function, *args):
+        """Run blocking work on the thread pool, in a new app context with its own database session.
+
+        The calling task's context variables go along, so SQL is counted
+        against the event that ran it.
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, self._in_context,
+                                                                function, *args)
+
+    async def get_activity(self, access_token_code, activity_id):
+        """Retrieve a detailed activity, waiting for the rate limit window to reset if need be."""
+        limiter = strava.rate_limiter
+        while True:
+            try:
+                await self.run_in_thread(limiter.acquire, PRIORITY_HIGH)
+                url = f'{constants.BASE_URL}/activities/{activity_id}'
+                started = time.perf_counter()
+                async with self._session.get(url, params={'include_all_efforts': 'false'},
+                                             headers={'Authorization': f'Bearer {access_token_code}'}) as response:
+                    metrics.observe_strava_call(url, response.status, time.perf_counter() - started, response.headers)
+                    await self.run_in_thread(limiter.update_from_headers, response.headers)
+                    if response.status == 429:
+                        raise await self.run_in_thread(limiter.defer_until_reset)
+                    response.raise_for_status()
+                    return await response.json()
+            except RateLimitDeferred as deferred:
+                # holding the slot while waiting stops the worker taking events it can't fetch yet
+                await asyncio.sleep(deferred.retry_after)
+
+    async def process_event(self, data):
+        """Process an event from the Strava webhook, as helpers.process_new_event does."""
+        if data['object_type'] == TOKEN_REFRESH:
+            # handed over by a process outside this partition, as tokens.refresh_user_tokens is to prefork workers
+            await self.run_in_thread(tokens.refresh_access_code, data['user_id'], data['margin'])
+            return
+        if data['object_type'] != 'activity':
+            return
+        if data['aspect_type'] != 'create':
+            await self.update_store(data)
+            return
+        if pending_checks.delay:
+            # the deferred check runs as a Celery task
+            await self.run_in_thread(helpers.defer_gear_check, data['owner_id'], data['object_id'])
+            return
+
+        with metrics.stage('context'):
+            context = await self.run_in_thread(crud.get_event_context, data['owner_id'])
+        if not context:
+            return
+        activity_id = data['object_id']
+        activity = await self.run_in_thread(crud.get_activity, activity_id)
+        if activity is None:
+            with metrics.stage('token'):
+                access_token_code = await self.run_in_thread(tokens.retrieve_valid_access_code, context.user_id,
+                                                             helpers.loaded_access_token(context))
+            with metrics.stage('fetch'):
+                activity_details = await self.get_activity(access_token_code, activity_id)
+            with metrics.stage('store'):
+                activity = await self.run_in_thread(crud.save_activity, activity_id, context.user_id, activity_details)
+                await self.run_in_thread(helpers.check_shoe_mileage, context, activity.gear_id)
+
+        with metrics.stage('decide'):
+            reminder = helpers.reminder_for(context, activity)
+        if reminder:
+            with metrics.stage('email'):
+                await self.run_in_thread(helpers.send_email, context.email, *reminder)
+        metrics.count_gear_check('immediate')
+
+    async def update_store(self, data):
+        """Apply an update or delete to the activity store, as the prefork task does.
+
+        These rarely call Strava; when one has to wait for the rate limit
+        window, it waits here rather than being retried as a task.
+        """
+        while True:
+            try:
+                return await self.run_in_thread(helpers.handle_event, None, data)
+            except RateLimitDeferred as deferred:
+                await asyncio.sleep(deferred.retry_after)
+
+    async def process_safely(self, data, received_at=None, event_id=None, task_id=None):
+        """Process an event, logging rather than raising if it fails.
+
+        An event from the event log is claimed first, under task_id if it was
+        requeued or replayed, and marked processed once done.
+        """
+        # each event runs in its own task, so its SQL is counted separately
+        metrics.begin_unit('async_event')
+        try:
+            if event_id is not None and not await self.run_in_thread(crud.claim_event, event_id,
+                                                                     task_id or uuid.uuid4().hex,
+                                                                     self.app.config['EVENT_LOG_LEASE']):
+                return
+            metrics.observe_queue_lag(received_at)
+            await self.process_event(data)
+            if event_id is not None:
+                await self.run_in_thread(crud.finish_event, event_id)
+            self.processed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception(f"couldn't process event for activity {data.get('object_id')}")
+        finally:
+            metrics.end_unit()
+
+    async def process_events(self, events):
+        """Process a batch of events, at most concurrency at a time."""
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def process(data):
+            async with slots:
+                await self.process_safely(data)
+
+        await asyncio.gather(*(process(data) for data in events))
+
+    async def process_after(self, previous, *entry):
+        """Process an event once the previous event for the same athlete, if any, is done."""
+        if previous is not None:
+            await asyncio.wait([previous])
+        await self.process_safely(*entry)
+
+    async def run(self, partition=None):
+        """Pop events from the event queue, or a partition's queue, and process them until cancelled.
+
+        Events for different athletes are processed concurrently, but each
+        athlete's in the order they were queued.
+        """
+        client = redis.asyncio.Redis.from_url(self.app.config['REDIS_URL'])
+        key = event_queue.key_for(partition)
+        slots = asyncio.Semaphore(self.concurrency)
+        in_flight = set()
+        # the last event started for each athlete with events in flight
+        latest = {}
+
+        def finished(task, owner_id):
+            in_flight.discard(task)
+            if latest.get(owner_id) is task:
+                del latest[owner_id]
+            slots.release()
+
+        try:
+            while True:
+                # only take an event off the queue when there's a free slot for it
+                await slots.acquire()
+                _, raw = await client.blpop(key)
+                entry = event_queue.decode(raw)
+                owner_id = entry[0].get('owner_id')
+                task = asyncio.create_task(self.process_after(latest.get(owner_id), *entry))
+                latest[owner_id] = task
+                in_flight.add(task)
+                task.add_done_callback(lambda task, owner_id=owner_id: finished(task, owner_id))
+        finally:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+            await client.aclose()
@@ -0,0 +1,92 @@
+"""Backfill of past activities recorded with a user's default gear.
+
+Activities are streamed page by page through a pipeline of generators, so
+memory stays bounded however many activities an athlete has. A few pages are
+fetched ahead concurrently, within the rate budget for low priority calls, and
+the next page to fetch is saved after each page so an interrupted backfill
+resumes where it stopped.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from .. import celery, constants, crud, db, strava, tokens
+from ..ratelimit import PRIORITY_LOW, RateLimitDeferred
+
+# seconds to wait for a token refresh handed to another partition's worker before trying again
+TOKEN_RETRY_DELAY = 30
+
+def fetch_activity_pages(access_token_code, start_page, per_page, concurrency):
+    """Yield (page, activities) in page order, fetching up to concurrency pages ahead."""
+    def fetch(page):
+        response = strava.get_athlete_activities(access_token_code, page, per_page, PRIORITY_LOW)
+        response.raise_for_status()
+        return response.json()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {page: executor.submit(fetch, page) for page in range(start_page, start_page + concurrency)}
+        page = start_page
+        try:
+            while True:
+                activities = in_flight.pop(page).result()
+                yield page, activities
+                # a short page is the last one
+                if len(activities) < per_page:
+                    return
+                in_flight[page + concurrency] = executor.submit(fetch, page + concurrency)
+                page += 1
+        finally:
+            for future in in_flight.values():
+                future.cancel()
+
+def shoe_activities(activities):
+    """Keep activities of a sport that can have a default shoe."""
+    return [activity for activity in activities if activity['sport_type'] in constants.SHOE_ACTIVITIES]
+
+def backfill_default_gear_activities(user_id, per_page=None, concurrency=None):
+    """Yield the user's past activities recorded with their default shoe, resuming from the saved cursor.
+
+    Every activity that could have a default shoe is kept in the activity store
+    along the way. Raises RateLimitDeferred when the rate budget runs out; the
+    cursor is saved, so calling again later carries on.
+    """
+    per_page = per_page or current_app.config['BACKFILL_PAGE_SIZE']
+    concurrency = concurrency or current_app.config['BACKFILL_CONCURRENCY']
+    default_gear_ids = crud.get_user_default_gear_ids(user_id)
+    cursor = crud.get_backfill_cursor(user_id)
+    if not default_gear_ids or cursor.completed_on is not None:
+        return
+
+    access_token_code = tokens.retrieve_valid_access_code(user_id)
+    for page, activities in fetch_activity_pages(access_token_code, cursor.next_page, per_page, concurrency):
+        stored = crud.save_activities(user_id, shoe_activities(activities))
+        matches = [activity for activity in stored if activity.gear_id == default_gear_ids.get(activity.sport_type)]
+        cursor.next_page = page + 1
+        cursor.matched += len(matches)
+        if len(activities) < per_page:
+            cursor.completed_on = datetime.now()
+        db.session.commit()
+        yield from matches
+
+def restart_backfill(user_id):
+    """Start a user's backfill again from the first page."""
+    cursor = crud.get_backfill_cursor(user_id)
+    cursor.next_page = 1
+    cursor.matched = 0
+    cursor.completed_on = None
+    db.session.commit()
+
+@celery.task(bind=True)
+def backfill_user_activities(self, user_id):
+    """Backfill a user's past default gear activities, deferring when the rate budget runs out.
+
+    It also defers when the worker for the user's partition hasn't refreshed
+    their tokens yet; the refresh carries on meanwhile.
+    """
+    try:
+        matched = sum(1 for _ in backfill_default_gear_activities(user_id))
+    except RateLimitDeferred as deferred:
+        raise self.retry(countdown=deferred.retry_after, max_retries=None)
+    except TimeoutError:
+        raise self.retry(countdown=TOKEN_RETRY_DELAY, max_retries=10)
+    return matched
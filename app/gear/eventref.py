@@ -0,0 +1,37 @@
+"""Compact references to webhook events, as queued for Celery workers.
+
+A task carries only what processing an event needs: the object and athlete
+IDs, the object and aspect types as small integers and, for updates, which
+fields changed, with the new sport type if it did. Workers load everything else
+about the athlete through crud.get_event_context and its caches, and the full
+payload stays in the event log.
+"""
+
+OBJECT_TYPES = ('activity', 'athlete')
+ASPECT_TYPES = ('create', 'update', 'delete')
+# update fields whose new values processing uses; the rest only matter by name
+KEPT_UPDATE_VALUES = {'type', 'sport_type'}
+
+def encode(names, name):
+    """Return a name's index in names, or the name itself if Strava sends one we don't know."""
+    return names.index(name) if name in names else name
+
+def decode(names, code):
+    """Turn a code from encode back into its name."""
+    return names[code] if isinstance(code, int) else code
+
+def event_ref(data):
+    """Reduce a webhook event to [object_id, owner_id, object type, aspect type], plus updates if any."""
+    ref = [data['object_id'], data['owner_id'], encode(OBJECT_TYPES, data['object_type']),
+           encode(ASPECT_TYPES, data['aspect_type'])]
+    updates = data.get('updates')
+    if isinstance(updates, dict) and updates:
+        ref.append({field: value if field in KEPT_UPDATE_VALUES else None for field, value in updates.items()})
+    return ref
+
+def event_from_ref(ref):
+    """Rebuild the parts of a webhook event that processing reads from a reference."""
+    object_id, owner_id, object_type, aspect_type, *updates = ref
+    return {'object_type': decode(OBJECT_TYPES, object_type), 'object_id': object_id,
+            'aspect_type': decode(ASPECT_TYPES, aspect_type), 'owner_id': owner_id,
+            'updates': updates[0] if updates else {}}
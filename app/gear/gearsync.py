@@ -0,0 +1,87 @@
+"""Keeping athletes' gear in step with Strava without making the gear pages wait on it.
+
+The gear pages show shoes from the shoes table, filtered to those Strava last
+listed for the athlete according to the gear cache. A stale entry is served as
+is and refreshed by a background task; a missing one, or a request to refresh
+now, is fetched while the page waits. A periodic job refreshes recently active
+athletes' gear at low priority, stopping when the rate budget runs out.
+"""
+
+from datetime import datetime, timedelta
+from flask import current_app
+from .. import athlete_cache, celery, crud, gear_cache, strava, tokens
+from ..ratelimit import RateLimitDeferred
+
+def refresh_gear(user_id, strava_id):
+    """Fetch a user's shoes from Strava, store them and cache their IDs; return the IDs."""
+    access_token_code = tokens.retrieve_valid_access_code(user_id)
+    shoes = strava.get_athlete(access_token_code).json().get('shoes', [])
+
+    # bring the app database up to date with the shoes on strava in a fixed number of queries
+    crud.sync_user_shoes(user_id, shoes)
+    athlete_cache.invalidate(strava_id)
+    gear_ids = [shoe['id'] for shoe in shoes]
+    gear_cache.set(user_id, gear_ids)
+    return gear_ids
+
+def current_gear_ids(user_id, strava_id, refresh=False):
+    """Return the Strava gear IDs of a user's current shoes, fetching them only if not cached or asked to.
+
+    A stale cached entry is returned straight away and refreshed in the
+    background. Raises RateLimitDeferred if a fetch has to wait for the rate limit.
+    """
+    entry = gear_cache.get(user_id)
+    if entry is None or refresh:
+        return refresh_gear(user_id, strava_id)
+    if gear_cache.is_stale(entry) and gear_cache.claim_refresh(user_id):
+        refresh_user_gear.delay(user_id, strava_id)
+    return entry['gear_ids']
+
+@celery.task
+def refresh_user_gear(user_id, strava_id):
+    """Refresh a user's gear in the background, leaving it stale if the rate budget is spent."""
+    try:
+        refresh_gear(user_id, strava_id)
+    except RateLimitDeferred:
+        # the page asks again once the claim on this refresh lapses
+        return False
+    return True
+
+@celery.task
+def refresh_active_gear():
+    """Refresh the stale gear of recently active users, until the batch or the rate budget runs out.
+
+    Users are taken in ID order from where the last run stopped, so each active
+    user comes round however many there are; past the last, the next run starts
+    over from the first.
+    """
+    config = current_app.config
+    since = datetime.now() - timedelta(days=config['GEAR_REFRESH_ACTIVE_DAYS'])
+    batch = config['GEAR_REFRESH_BATCH_SIZE']
+    after_id = gear_cache.refresh_cursor()
+    refreshed = 0
+    try:
+        while refreshed < batch:
+            users = crud.get_active_users(since, batch, after_id)
+            if not users:
+                after_id = 0
+                break
+            for user_id, strava_id in users:
+                if refreshed == batch:
+                    break
+                entry = gear_cache.peek(user_id)
+                if entry is None or gear_cache.is_stale(entry):
+                    try:
+                        refresh_gear(user_id, strava_id)
+                        refreshed += 1
+                    except RateLimitDeferred:
+                        raise
+                    except Exception as err:
+                        # one user's failed refresh shouldn't stop the sweep
+                        current_app.logger.warning(f"couldn't refresh gear for user {user_id}: {err}")
+                after_id = user_id
+    except RateLimitDeferred:
+        # leave the rest to the next run rather than wait on webhook events' share
+        pass
+    gear_cache.set_refresh_cursor(after_id)
+    return refreshed
@@ -1,38 +1,178 @@
-import requests
+from flask import current_app
 from flask_mail import Message
-from datetime import datetime
 from .. import constants
-from . import celery, mail 
+from .. import crud
+from .. import tokens
+from .. import celery, mail_dispatcher, metrics, partitions, pending_checks, strava
+from ..mailer import MailDeferred
+from ..ratelimit import PRIORITY_HIGH, PRIORITY_LOW, RateLimitDeferred
+from .eventref import event_from_ref
+
+# update event fields that can't mean the gear changed; Strava doesn't say when it did
+NON_GEAR_UPDATES = {'title', 'type', 'sport_type', 'private'}
+
+# tasks that may send mail retry when the server can't take it for now, backing off for up to about 45 minutes
+MAIL_RETRY = {'autoretry_for': (MailDeferred,), 'retry_backoff': 30, 'retry_backoff_max': 10 * 60,
+              'retry_kwargs': {'max_retries': 8}}
 
 # process new activity routes 
-@celery.task
-def process_new_event(data, user_email, user_default_shoe_strava_id, user_default_shoe_name, access_token_code):
-    """Process new event from Strava webhook."""
-    # ignore events that don't represent creation of a new activity 
-    if data['object_type'] != 'activity' or data['aspect_type'] != 'create':
-        return 
+@celery.task(bind=True, **MAIL_RETRY)
+def process_new_event(self, event, received_at=None, event_id=None):
+    """Process new event from Strava webhook.
 
-    # retrieve detailed information on newly created activity from activities API
+    event is a compact reference from eventref.event_ref, or a whole webhook
+    payload as queued before references. received_at is when the webhook
+    acknowledged the event, for measuring queue lag. event_id is the event's
+    entry in the event log, claimed for this task before processing and marked
+    processed after.
+    """
+    data = event if isinstance(event, dict) else event_from_ref(event)
+    if event_id is not None and not crud.claim_event(event_id, self.request.id, current_app.config['EVENT_LOG_LEASE']):
+        # processed already, or another task is on it
+        return
+    metrics.observe_queue_lag(received_at)
+    handle_event(self, data)
+    if event_id is not None:
+        crud.finish_event(event_id)
+
+def handle_event(task, data):
+    """Act on a webhook event: keep the activity store up to date and remind the athlete if need be.
+
+    task is the Celery task to retry when the rate limit is reached, or None to
+    raise RateLimitDeferred to the caller instead.
+    """
+    if data['object_type'] != 'activity':
+        return
     activity_id = data['object_id']
-    headers = {'Authorization': f'Bearer {access_token_code}'}
-    params = {'include_all_efforts': False}
-    activity_details_response = requests.get(f'{constants.BASE_URL}/activities/{activity_id}', headers=headers, params=params)
 
-    # parse gear and sport type 
-    activity_details_data = activity_details_response.json()
-    strava_gear_id = activity_details_data['gear_id']
-    sport_type = activity_details_data['sport_type']
+    # keep the local activity store in step without calling the API
+    if data['aspect_type'] == 'delete':
+        if pending_checks.cancel(activity_id):
+            metrics.count_gear_check('cancelled')
+        crud.delete_activity(activity_id)
+        return
+    if data['aspect_type'] == 'update':
+        updates = data.get('updates', {})
+        activity = crud.patch_activity(activity_id, updates)
+        if pending_checks.is_pending(activity_id):
+            # the pending check fetches the activity as it is by then
+            metrics.count_gear_check('coalesced')
+            return
+        # an update naming none of the fields above may be a gear change, which moves mileage between shoes
+        if activity is not None and activity.sport_type in constants.SHOE_ACTIVITIES and not set(updates) & NON_GEAR_UPDATES:
+            context = crud.get_event_context(data['owner_id'])
+            if context:
+                fetch_activity(task, context, activity_id, PRIORITY_LOW)
+        return
+    if data['aspect_type'] != 'create':
+        return 
 
-    # check if activity type is out of scope for gear checker (only activity types that can have a default shoe are in scope)
-    if sport_type not in constants.SHOE_ACTIVITIES: 
+    if pending_checks.delay:
+        defer_gear_check(data['owner_id'], activity_id)
+        return
+    check_activity(task, data['owner_id'], activity_id)
+    metrics.count_gear_check('immediate')
+
+def defer_gear_check(owner_id, activity_id):
+    """Schedule the gear check of a new activity for when the delay is over, once however often it's created."""
+    if not pending_checks.schedule(activity_id):
+        return
+    options = {}
+    partition = partitions.partition_for(owner_id)
+    # asyncio workers don't consume the partitions' Celery queues, so then the default queue's worker checks it
+    if partition is not None and current_app.config['WORKER_MODE'] != 'asyncio':
+        options['queue'] = partitions.queue_name(partition)
+    check_deferred_gear.apply_async((owner_id, activity_id), countdown=pending_checks.delay, **options)
+    metrics.count_gear_check('scheduled')
+
+@celery.task(bind=True, **MAIL_RETRY)
+def check_deferred_gear(self, owner_id, activity_id):
+    """Check a new activity's gear after the delay, unless it was deleted or checked meanwhile."""
+    if not pending_checks.is_pending(activity_id):
+        return
+    check_activity(self, owner_id, activity_id)
+    # only once checked, so a retry after a rate limit still finds it pending
+    pending_checks.cancel(activity_id)
+    metrics.count_gear_check('deferred')
+
+def check_activity(task, owner_id, activity_id):
+    """Store a new activity, adding it to its shoe's totals, and remind the athlete if it used their default shoe."""
+    # gather information required to process event
+    with metrics.stage('context'):
+        context = crud.get_event_context(owner_id)
+    # athletes without a default shoe get no reminders, but their shoe totals are still kept
+    if not context:
         return
 
+    # retrieve the activity from the local store, or from the activities API the first time
+    activity = crud.get_activity(activity_id)
+    if activity is None:
+        activity = fetch_activity(task, context, activity_id)
+
+    with metrics.stage('decide'):
+        reminder = reminder_for(context, activity)
+    if reminder:
+        with metrics.stage('email'):
+            send_email(context.email, *reminder)
+
+def reminder_for(context, activity):
+    """Return the (sport, shoe name, date) to remind the athlete about, or None if the activity needs no reminder."""
+    # check if activity type is out of scope for gear checker (only activity types that can have a default shoe are in scope)
+    if activity.sport_type not in constants.SHOE_ACTIVITIES: 
+        return None
+
     # check if gear used is the default for the sport per user settings in app 
-    if strava_gear_id == user_default_shoe_strava_id:
-        sport_type_user_friendly = constants.USER_FRIENDLY_SPORT_NAMES[sport_type]
-        activity_date = datetime.strptime(activity_details_data['start_date_local'], '%Y-%m-%dT%H:%M:%SZ')
-        activity_date_friendly = activity_date.strftime('%m/%d')
-        send_email(user_email, sport_type_user_friendly, user_default_shoe_name, activity_date_friendly)
+    default_gear = context.default_gear.get(activity.sport_type)
+    if not default_gear or activity.gear_id != default_gear[0]:
+        return None
+    sport_type_user_friendly = constants.USER_FRIENDLY_SPORT_NAMES[activity.sport_type]
+    activity_date_friendly = activity.start_date_local.strftime('%m/%d')
+    return sport_type_user_friendly, default_gear[1], activity_date_friendly
+
+def fetch_activity(task, context, activity_id, priority=PRIORITY_HIGH):
+    """Retrieve an activity from the activities API, store it and check its shoe's mileage."""
+    with metrics.stage('token'):
+        access_token_code = tokens.retrieve_valid_access_code(context.user_id, loaded_access_token(context))
+    try:
+        with metrics.stage('fetch'):
+            activity_details_response = strava.get_activity(access_token_code, activity_id, priority)
+    except RateLimitDeferred as deferred:
+        if task is None:
+            # the asyncio worker waits for the window itself
+            raise
+        # wait for the rate limit window to reset rather than dropping the event
+        raise task.retry(countdown=deferred.retry_after, max_retries=None)
+    with metrics.stage('store'):
+        activity = crud.save_activity(activity_id, context.user_id, activity_details_response.json())
+        check_shoe_mileage(context, activity.gear_id)
+    return activity
+
+def loaded_access_token(context):
+    """Return the (code, expires_at) pair an event context carries, or None if it came from the cache."""
+    return (context.access_token_code, context.access_token_expires_at) if context.access_token_code else None
+
+def check_shoe_mileage(context, gear_id):
+    """Tell the athlete once when a shoe's total distance reaches the replacement threshold."""
+    threshold = current_app.config['SHOE_REPLACEMENT_DISTANCE']
+    if not gear_id or not context.email or not crud.claim_replacement_alert(gear_id, threshold):
+        return
+    shoe = crud.get_shoe_by_strava_id(gear_id)
+    if not shoe:
+        return
+    try:
+        send_replacement_email(context.email, shoe.name, round(threshold / 1000))
+    except Exception:
+        # the shoe's next activity claims it again and sends the alert
+        crud.release_replacement_alert(gear_id)
+        raise
+
+def send_replacement_email(recipient_address, shoe_name, distance_km):
+    """Send a notification that a shoe is due for replacement."""
+    msg = Message(f'Time to think about replacing your {shoe_name}', sender = 'stravagearupdater@gmail.com', recipients = [recipient_address])
+    msg.html = f"Hello athlete!<br> \
+        Your {shoe_name} have now covered over {distance_km} km. <br> \
+        Most running shoes lose their cushioning somewhere around here, so it may be time for a new pair."
+    mail_dispatcher.send(msg)
 
 def send_email(recipient_address, sport_type, user_default_shoe_name, activity_date):
     """Send email notification."""
@@ -43,4 +183,4 @@ def send_email(recipient_address, sport_type, user_default_shoe_name, activity_d
         If that's the gear you used, you can ignore this message! \
         Otherwise, this is your reminder to update your gear."  
     print(msg.recipients)
-    mail.send(msg)
\ No newline at end of file
+    mail_dispatcher.send(msg)
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""Intake of Strava webhook events."""
+
+import time
+from flask import current_app
+from .. import admission, dedupe, event_log, event_queue, partitions
+from ..admission import DEFER, SPILL
+from . import helpers
+from .eventref import event_ref
+
+# fields Strava sends with every webhook event
+# https://developers.strava.com/docs/webhooks/
+EVENT_FIELDS = {
+    'object_type': str,
+    'object_id': int,
+    'aspect_type': str,
+    'owner_id': int,
+    'subscription_id': int,
+    'event_time': int,
+}
+
+def is_valid_event(data):
+    """Check that a webhook payload has the shape of a Strava event."""
+    if not isinstance(data, dict):
+        return False
+    for field, field_type in EVENT_FIELDS.items():
+        if not isinstance(data.get(field), field_type):
+            return False
+    return True
+
+def enqueue_event(data):
+    """Log a raw webhook event and hand it off to the worker, dropping repeat deliveries.
+
+    Returns what became of the event: 'queued', 'deferred' to low priority,
+    'spilled' to the event log to be queued later, or 'duplicate'.
+    """
+    if not dedupe.is_first_delivery(data):
+        return 'duplicate'
+    try:
+        received_at = time.time()
+        decision = admission.decide(data)
+        if decision == SPILL and not event_log.enabled:
+            # with no log to queue it from later, the nearest thing is the back of the queue
+            decision = DEFER
+        event_id = event_log.append(data, received_at, decision == SPILL)
+        if decision == SPILL:
+            return 'spilled'
+        if decision == DEFER:
+            queue_event(data, received_at, event_id, priority=admission.low_priority)
+            return 'deferred'
+        queue_event(data, received_at, event_id)
+        return 'queued'
+    except Exception:
+        # the webhook fails and Strava delivers the event again, which mustn't be taken for a repeat
+        dedupe.forget(data)
+        raise
+
+def queue_event(data, received_at, event_id=None, task_id=None, priority=None):
+    """Queue an event for a worker, on its athlete's partition if events are partitioned.
+
+    task_id names the task when an event log claim was already recorded for it.
+    priority is a Celery message priority; the asyncio workers' queues have none.
+    """
+    partition = partitions.partition_for(data['owner_id'])
+    if current_app.config['WORKER_MODE'] == 'asyncio':
+        event_queue.push(data, received_at, event_id, task_id, partition)
+        return
+    options = {} if partition is None else {'queue': partitions.queue_name(partition)}
+    if priority is not None:
+        options['priority'] = priority
+    # positional, so the message doesn't carry argument names
+    helpers.process_new_event.apply_async((event_ref(data), received_at, event_id), task_id=task_id, **options)
@@ -0,0 +1,59 @@
+"""Queueing events from the event log again, after they're lost or to process them anew.
+
+Every accepted webhook event is in the event log before it's queued, and is
+marked processed when a worker finishes it. Events left unprocessed, because
+Redis lost them or a worker died partway through, are requeued by a periodic
+sweep, and events the webhook only logged because the queues were too deep
+are queued by another as the queues drain. replay-events.py queues a time
+range again by hand, after an outage or a fix to how events are processed.
+"""
+
+from flask import current_app
+from .. import admission, celery, crud
+from .intake import queue_event
+
+def dispatch(claims):
+    """Queue claimed events for workers, each as the task its claim was recorded for."""
+    for claim in claims:
+        queue_event(claim.data, claim.received_at, claim.event_id, claim.task_id)
+    return len(claims)
+
+@celery.task
+def requeue_stalled_events():
+    """Queue again events that no worker has finished within the lease, up to a limit per run.
+
+    Nothing is requeued while the queues are past the defer watermark: events
+    waiting that long are likely still queued, not lost, and a copy would only
+    deepen the backlog.
+    """
+    if admission.enabled and admission.depth() >= admission.defer_watermark:
+        return 0
+    config = current_app.config
+    claims = crud.claim_stalled_events(config['EVENT_LOG_LEASE'], config['EVENT_LOG_MAX_REQUEUES'],
+                                       config['EVENT_LOG_SWEEP_LIMIT'])
+    if claims:
+        current_app.logger.warning(f"requeued {len(claims)} stalled events, from event {claims[0].event_id}")
+    return dispatch(claims)
+
+@celery.task
+def drain_spilled_events():
+    """Queue events spilled to the event log while the queues were too deep, as far as there's room now."""
+    limit = min(admission.room(), current_app.config['EVENT_LOG_SWEEP_LIMIT'])
+    if not limit:
+        return 0
+    return dispatch(crud.claim_spilled_events(limit))
+
+def replay_events(since, until, owner_id=None, include_processed=False, batch_size=500):
+    """Queue the events received between since and until again and return how many were queued.
+
+    Only events never processed are queued unless include_processed is set,
+    since processing a create event again can send its reminder again.
+    """
+    queued = 0
+    after_id = 0
+    while True:
+        claims = crud.claim_events_to_replay(since, until, after_id, batch_size, owner_id, include_processed)
+        if not claims:
+            return queued
+        queued += dispatch(claims)
+        after_id = claims[-1].event_id
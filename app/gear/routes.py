@@ -1,31 +1,39 @@
 """Server for the running helper app."""
 
-import requests
-from flask import render_template, request, redirect, jsonify
-from flask_login import current_user
+import time
+from datetime import date, timedelta
+from flask import current_app, flash, render_template, request, redirect, jsonify
+from flask_login import current_user, login_required
 import app.crud as crud
-from app.model import db
 from app.gear import gear_bp
-from .. import tokens
+from .. import metrics
 from .. import constants
-from . import helpers
+from .. import tokens
+from ..ratelimit import RateLimitDeferred
+from . import gearsync, intake
 
 @gear_bp.route('/webhook', methods=['POST'])
 def webhook():
-    # handle event
-    # gather information required to process event 
-    data = request.get_json()
-    user = crud.get_user_by_strava_id(data['owner_id'])
-    access_token_code = tokens.retrieve_valid_access_code(user.id)
-    user_default_shoe = crud.get_user_default_shoe(user.id)
-    user_default_shoe_strava_id = user_default_shoe.strava_gear_id
-    user_default_shoe_name = user_default_shoe.name
-    
-    # process event asynchronously with celery task 
-    helpers.process_new_event.delay(data, user.email, user_default_shoe_strava_id, user_default_shoe_name, access_token_code)
+    """Acknowledge a Strava webhook event and queue it for the worker."""
+    # Strava requires an acknowledgement within 2 seconds, so only the payload
+    # shape is checked here; user, token and gear lookups happen in the worker
+    started = time.perf_counter()
+    data = request.get_json(silent=True)
+    if not intake.is_valid_event(data):
+        metrics.observe_ack('invalid', time.perf_counter() - started)
+        return jsonify({"status": "invalid event"}), 400
+
+    # queued, deferred or spilled as the queues' depth allows, but always acknowledged
+    outcome = intake.enqueue_event(data)
 
-    # acknowledge new event with status code 200 (required within 2 seconds)
-    return jsonify({"status": "success"})
+    # acknowledge new event with status code 200
+    ack_seconds = time.perf_counter() - started
+    metrics.observe_ack(outcome, ack_seconds)
+    ack_ms = ack_seconds * 1000
+    current_app.logger.debug(f"acknowledged webhook event in {ack_ms:.2f}ms")
+    response = jsonify({"status": "success"})
+    response.headers['Server-Timing'] = f'ack;dur={ack_ms:.2f}'
+    return response
 
 @gear_bp.route('/gear-reminders')
 def display_gear_reminders_home():
@@ -39,37 +47,24 @@ def updateGear():
 
 @gear_bp.route('/retrieve-gear')
 def retrieve_gear():
-    """Retrieve gear data from Strava."""
+    """Display the user's shoes as last synced from Strava, or synced now with ?refresh=1."""
     user = current_user
-    access_token_code = tokens.retrieve_valid_access_code(user.id)
+    try:
+        gear_ids = gearsync.current_gear_ids(user.id, user.strava_id, refresh=bool(request.args.get('refresh')))
+    except (RateLimitDeferred, TimeoutError):
+        # gear sync gives way to webhook events, or waited too long on the athlete's partition
+        # to refresh their tokens; show the gear we already have
+        flash("Strava is busy right now, so your gear may be out of date. Try again in a few minutes.")
+        gear_ids = None
+    except tokens.MissingTokens:
+        flash("Connect your Strava account again to see your latest gear.")
+        gear_ids = None
 
-    # retrieve user's shoes from strava
-    headers = {'Authorization': f'Bearer {access_token_code}'}
-    athlete_details_response = requests.get(f'{constants.BASE_URL}/athlete', headers=headers)
-    athlete_details_data = athlete_details_response.json() 
-    shoes = athlete_details_data.get('shoes', '')
-
-    shoe_objects = []
-    active_shoes = []
-    for shoe in shoes: 
-        # if the shoe is in the app database, ensure all data is up to date 
-        if crud.get_shoe_by_strava_id(shoe['id']):
-            shoe_obj = crud.get_shoe_by_strava_id(shoe['id'])
-            if shoe_obj.name != shoe['name']:
-                shoe_obj.name = shoe['name']
-            if shoe_obj.retired != shoe['retired']:
-                shoe_obj.retired = shoe['retired']
-            if shoe_obj.nickname != shoe['nickname']:
-                shoe_obj.nickname = shoe['nickname']
-        # if shoe isn't yet in app database, add it
-        else: 
-            shoe_obj = crud.create_shoe(shoe['id'], shoe['name'], shoe['nickname'], shoe['retired'], user.id)
-            shoe_objects.append(shoe_obj)
-        # only display active shoes on the front end 
-        if not shoe_obj.retired:
-            active_shoes.append(shoe_obj)
-    db.session.add_all(shoe_objects)
-    db.session.commit()
+    # only display active shoes on the front end 
+    active_shoes = crud.get_user_active_shoes(user.id)
+    if gear_ids is not None:
+        gear_ids = set(gear_ids)
+        active_shoes = [shoe for shoe in active_shoes if shoe.strava_gear_id in gear_ids]
     default_shoe = crud.get_user_default_shoe(user.id)
     return render_template('set-default-gear.html', default_shoe = default_shoe, shoes = active_shoes)
 
@@ -77,14 +72,46 @@ def retrieve_gear():
 def set_default_run_shoes():
     """Update the default running shoes for a user. """
     user = current_user
-    previous_default_shoe = crud.get_user_default_shoe(user.id)
-    new_default_shoe_id = int(request.form['dropdown'])
-    if previous_default_shoe and previous_default_shoe.id == new_default_shoe_id:
-        return redirect('/retrieve-gear')
-    else:
-        if previous_default_shoe:
-            previous_default_shoe.run_default = False
-        shoe_obj = crud.get_shoe_by_id(new_default_shoe_id)
-        shoe_obj.run_default = True
-        db.session.commit()
-    return redirect('/retrieve-gear')
\ No newline at end of file
+    shoe_obj = crud.get_shoe_by_id(int(request.form['dropdown']))
+    if shoe_obj and shoe_obj.user_id == user.id:
+        crud.set_default_shoe(user, shoe_obj.id, {'Run'}, scope = {'Run'})
+    return redirect('/retrieve-gear')
+
+@gear_bp.route('/gear-setup')
+@login_required
+def gear_setup():
+    """Display the user's shoes and the sports each is the default for."""
+    user = current_user
+    shoes = crud.get_user_active_shoes(user.id)
+    defaults = {shoe_id: ', '.join(sorted(sport_types)) for shoe_id, sport_types in crud.get_user_shoe_defaults(user.id).items()}
+    return render_template('gear-setup.html', shoes = shoes, defaults = defaults)
+
+@gear_bp.route('/set-default-gear', methods=['POST'])
+@login_required
+def set_default_gear():
+    """Make a shoe the user's default for the sport types checked in the gear setup form."""
+    user = current_user
+    data = request.get_json(silent=True) or {}
+    shoe_obj = crud.get_shoe_by_id(data.get('shoe_id'))
+    activity_types = set(data.get('activity_types', []))
+    if not shoe_obj or shoe_obj.user_id != user.id or not activity_types <= constants.SHOE_ACTIVITIES:
+        return jsonify({'success': False}), 400
+
+    added, deleted = crud.set_default_shoe(user, shoe_obj.id, activity_types)
+    return jsonify({
+        'success': True,
+        'addedAssociations': {shoe_id: ', '.join(sorted(sport_types)) for shoe_id, sport_types in added.items()},
+        'deletedAssociations': {shoe_id: ', '.join(sorted(sport_types)) for shoe_id, sport_types in deleted.items()},
+    })
+
+@gear_bp.route('/rotation')
+@login_required
+def rotation():
+    """Display the mileage on each of the user's shoes, overall and over recent weeks."""
+    user = current_user
+    today = date.today()
+    weeks = [today - timedelta(days=today.weekday(), weeks=n) for n in reversed(range(8))]
+    shoes = crud.get_user_shoe_stats(user.id)
+    weekly_distances = crud.get_user_weekly_distances(user.id, weeks[0])
+    return render_template('rotation.html', shoes = shoes, weeks = weeks, weekly_distances = weekly_distances,
+                           replacement_distance = current_app.config['SHOE_REPLACEMENT_DISTANCE'])
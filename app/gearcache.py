@@ -0,0 +1,73 @@
+"""Cache of the gear athletes have on Strava."""
+
+import time
+from app.stores import make_store
+
+class GearCache:
+    """Remembers which of a user's shoes Strava last listed, and when.
+
+    The shoes themselves are in the shoes table; an entry is the Strava gear IDs
+    of the athlete's current shoes, so the gear pages can be shown without
+    calling Strava. Entries older than GEAR_CACHE_MAX_AGE are stale and served
+    while a refresh runs in the background; after GEAR_CACHE_TTL they're gone.
+    """
+
+    # a background refresh that fails leaves its mark this long, holding off retries
+    REFRESH_CLAIM_TTL = 5 * 60
+
+    def __init__(self, app=None):
+        self.store = None
+        self.ttl = None
+        self.max_age = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the backing store and ages from the app config."""
+        self.store = make_store(app, app.config['GEAR_CACHE_BACKEND'], 'gear:', app.config['GEAR_CACHE_MAX_ATHLETES'])
+        self.ttl = app.config['GEAR_CACHE_TTL']
+        self.max_age = app.config['GEAR_CACHE_MAX_AGE']
+        app.extensions['gear_cache'] = self
+
+    def get(self, user_id):
+        """Retrieve a user's cached entry, a dict of gear_ids and synced_at, or None."""
+        entry = self.store.get(str(user_id))
+        if entry is None:
+            self.misses += 1
+        elif self.is_stale(entry):
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def peek(self, user_id):
+        """Retrieve a user's cached entry, or None, without counting the lookup in the stats."""
+        return self.store.get(str(user_id))
+
+    def set(self, user_id, gear_ids):
+        """Cache the Strava gear IDs of a user's current shoes, as synced now."""
+        self.store.set(str(user_id), {'gear_ids': sorted(gear_ids), 'synced_at': time.time()}, self.ttl)
+        self.store.delete(f'refreshing:{user_id}')
+
+    def is_stale(self, entry):
+        """Check whether an entry is due a refresh."""
+        return entry['synced_at'] + self.max_age <= time.time()
+
+    def claim_refresh(self, user_id):
+        """Return whether a background refresh for the user isn't already under way, marking one if so."""
+        return self.store.add(f'refreshing:{user_id}', 1, self.REFRESH_CLAIM_TTL)
+
+    def refresh_cursor(self):
+        """Return the ID of the last user the refresh job went past, or 0 to start from the first."""
+        return self.store.get('refresh-cursor') or 0
+
+    def set_refresh_cursor(self, user_id):
+        """Record where the refresh job's next run starts."""
+        self.store.set('refresh-cursor', user_id, self.ttl)
+
+    def stats(self):
+        """Report fresh hit, stale hit and miss counts for this process."""
+        return {'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses}
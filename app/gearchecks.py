@@ -0,0 +1,42 @@
+"""Gear checks deferred until athletes have had a chance to fix their gear themselves."""
+
+from app.stores import make_store
+
+class PendingChecks:
+    """Activities whose gear check is scheduled but hasn't run yet.
+
+    Many athletes change the gear on an activity within minutes of their watch
+    syncing it. With GEAR_CHECK_DELAY set, the check for a new activity runs
+    that many seconds after its create event instead of straight away; update
+    events arriving meanwhile are left to that check and a delete cancels it,
+    so an activity costs at most one fetch and one reminder.
+    """
+
+    def __init__(self, app=None):
+        self.store = None
+        self.delay = 0
+        self.ttl = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the delay and the backing store from the app config."""
+        self.store = make_store(app, app.config['GEAR_CHECK_BACKEND'], 'gear-check:', app.config['GEAR_CHECK_MAX_PENDING'])
+        self.delay = app.config['GEAR_CHECK_DELAY']
+        # outlives the delay so a check held up by a busy queue or a rate limit still finds its entry
+        self.ttl = self.delay + app.config['GEAR_CHECK_GRACE']
+        app.extensions['gear_checks'] = self
+
+    def schedule(self, activity_id):
+        """Record a pending check and return whether there wasn't one already."""
+        return self.store.add(str(activity_id), 1, self.ttl)
+
+    def is_pending(self, activity_id):
+        """Check whether an activity's check is still to run."""
+        return self.store.get(str(activity_id)) is not None
+
+    def cancel(self, activity_id):
+        """Drop a pending check and return whether there was one."""
+        pending = self.is_pending(activity_id)
+        self.store.delete(str(activity_id))
+        return pending
@@ -0,0 +1,87 @@
+"""Sending email over a persistent SMTP connection."""
+
+import logging
+import os
+import smtplib
+import threading
+
+logger = logging.getLogger(__name__)
+
+def is_transient(error):
+    """Check whether a failed send may succeed later: a dropped connection or a 4xx reply."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+class MailDeferred(Exception):
+    """Raised when a message can't be sent for now, so the task sending it can retry later."""
+
+class MailDispatcher:
+    """Sends messages over one authenticated connection per process.
+
+    Connecting and logging in to the SMTP server costs far more than sending a
+    message, so the connection is kept open between tasks and only reopened
+    after a fork or when the server has dropped it.
+    """
+
+    def __init__(self, mail, app=None):
+        self.mail = mail
+        self._connection = None
+        self._connection_pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Start afresh with the app's mail settings."""
+        self.close()
+        app.extensions['mail_dispatcher'] = self
+
+    def _connect(self):
+        """Return this process's open connection, opening one if needed."""
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = self.mail.connect().__enter__()
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def close(self):
+        """Close this process's connection, if open."""
+        connection, self._connection = self._connection, None
+        if connection is not None and self._connection_pid == os.getpid():
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+    def _deliver(self, message):
+        """Send one message and return 1, or 0 if refused for good; raise MailDeferred if it may go later."""
+        try:
+            self._send(message)
+        except (smtplib.SMTPException, OSError) as error:
+            if is_transient(error):
+                # the next attempt starts from a fresh connection
+                self.close()
+                raise MailDeferred(f"couldn't send {message.subject!r} for now: {error}") from error
+            # a bad address won't get any better, and retrying would resend the athlete's other mail
+            logger.error(f"dropped message {message.subject!r} to {message.recipients}: {error}")
+            return 0
+        return 1
+
+    def _send(self, message):
+        """Send one message, reconnecting once if the server dropped the connection."""
+        try:
+            self._connect().send(message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+            self.close()
+            self._connect().send(message)
+
+    def send(self, message):
+        """Send a message now and return 1, or 0 if it was refused for good.
+
+        A transient failure raises MailDeferred and nothing keeps the message;
+        the mail-sending tasks retry on it with backoff, sending it once.
+        """
+        with self._lock:
+            return self._deliver(message)
@@ -0,0 +1,201 @@
+"""Prometheus metrics for the webhook, the event worker and the services they call."""
+
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+from flask import Response, abort, current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.ratelimit import parse_rate_limit_header
+
+# [name, queries, seconds] for the request, task or event being handled
+_unit = ContextVar('metrics_unit', default=None)
+
+ACK_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+class Metrics:
+    """Timings and counters for the hot path, served at /metrics in Prometheus text format.
+
+    Recording is an in-memory update, or an mmap write when
+    PROMETHEUS_MULTIPROC_DIR is set for Celery and web workers to share, so it
+    costs next to nothing between scrapes. With METRICS_ENABLED off nothing is
+    recorded at all.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._metrics = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the metrics, hook them into requests and SQL, and add the /metrics route."""
+        self.enabled = app.config['METRICS_ENABLED']
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        if self._metrics is None:
+            self._metrics = self._create_metrics()
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            task_prerun.connect(lambda task=None, **kwargs: self.begin_unit(task.name), weak=False)
+            task_postrun.connect(lambda **kwargs: self.end_unit(), weak=False)
+            worker_process_shutdown.connect(self._mark_process_dead, weak=False)
+        app.before_request(lambda: self.begin_unit(request.endpoint or 'unknown'))
+        app.teardown_request(lambda exc: self.end_unit())
+        app.add_url_rule('/metrics', 'metrics', self.serve)
+
+    @staticmethod
+    def _create_metrics():
+        """Register the metrics with prometheus_client, once per process."""
+        from prometheus_client import Counter, Gauge, Histogram
+        return {
+            'webhook_ack': Histogram('webhook_ack_seconds', 'Time to acknowledge a webhook event', ['outcome'],
+                                     buckets=ACK_BUCKETS),
+            'stage': Histogram('event_stage_seconds', 'Time spent in each stage of processing an event', ['stage']),
+            'queue_lag': Histogram('event_queue_lag_seconds', 'Time from acknowledging an event to a worker starting on it'),
+            'strava_requests': Counter('strava_requests', 'Calls to the Strava API', ['endpoint', 'status']),
+            'strava_seconds': Histogram('strava_request_seconds', 'Time taken by calls to the Strava API', ['endpoint']),
+            'strava_usage': Gauge('strava_rate_limit_usage', 'Strava rate limit usage last reported', ['window'],
+                                  multiprocess_mode='mostrecent'),
+            'strava_limit': Gauge('strava_rate_limit', 'Strava rate limits last reported', ['window'],
+                                  multiprocess_mode='mostrecent'),
+            'sql_seconds': Histogram('sql_query_seconds', 'Time taken by SQL statements'),
+            'unit_queries': Histogram('sql_queries_per_unit', 'SQL statements per request, task or event', ['unit'],
+                                      buckets=QUERY_BUCKETS),
+            'unit_sql_seconds': Histogram('sql_seconds_per_unit', 'Time in SQL statements per request, task or event',
+                                          ['unit']),
+            'event_log_batch': Histogram('event_log_batch_events', 'Events written per event log commit',
+                                         buckets=BATCH_BUCKETS),
+            'event_log_seconds': Histogram('event_log_commit_seconds', 'Time taken by event log commits',
+                                           buckets=ACK_BUCKETS),
+            'queue_depth': Gauge('event_queue_depth', 'Events waiting for workers, as last sampled for admission',
+                                 multiprocess_mode='mostrecent'),
+            'admission_watermark': Gauge('event_admission_watermark', 'Queue depths past which new events are deferred '
+                                         'or spilled to the event log', ['level'], multiprocess_mode='mostrecent'),
+            'webhook_deliveries': Counter('webhook_deliveries', 'Webhook deliveries by whether they were the first or a '
+                                          'duplicate', ['outcome']),
+            'athlete_cache': Counter('athlete_cache_lookups', 'Athlete cache lookups by the tier that answered, or miss',
+                                     ['result']),
+            'gear_checks': Counter('gear_checks', 'Gear checks of new activities by outcome; coalesced and cancelled '
+                                   'ones were avoided', ['outcome']),
+        }
+
+    @staticmethod
+    def _mark_process_dead(pid=None, **kwargs):
+        """Drop a finished Celery child's live gauges from the shared metrics."""
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid or os.getpid())
+
+    def begin_unit(self, name):
+        """Start counting SQL for a request, task or event."""
+        if self.enabled:
+            _unit.set([name, 0, 0.0])
+
+    def end_unit(self):
+        """Record the SQL counted for the current request, task or event."""
+        unit = _unit.get()
+        if unit is None:
+            return
+        _unit.set(None)
+        name, queries, seconds = unit
+        self._metrics['unit_queries'].labels(name).observe(queries)
+        self._metrics['unit_sql_seconds'].labels(name).observe(seconds)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_started'].pop()
+        self._metrics['sql_seconds'].observe(seconds)
+        unit = _unit.get()
+        if unit is not None:
+            unit[1] += 1
+            unit[2] += seconds
+
+    def observe_ack(self, outcome, seconds):
+        """Record how long the webhook took to acknowledge an event and what became of it."""
+        if self.enabled:
+            self._metrics['webhook_ack'].labels(outcome).observe(seconds)
+
+    def observe_queue_lag(self, received_at):
+        """Record how long an event waited between the webhook and a worker."""
+        if self.enabled and received_at:
+            self._metrics['queue_lag'].observe(max(0.0, time.time() - received_at))
+
+    def observe_event_log_commit(self, events, seconds):
+        """Record a group commit to the event log and how many events it wrote."""
+        if self.enabled:
+            self._metrics['event_log_batch'].observe(events)
+            self._metrics['event_log_seconds'].observe(seconds)
+
+    def observe_queue_depth(self, depth):
+        """Record the number of events waiting for workers."""
+        if self.enabled:
+            self._metrics['queue_depth'].set(depth)
+
+    def set_admission_watermarks(self, defer, spill):
+        """Export the queue depths at which the webhook defers and spills events."""
+        if self.enabled:
+            self._metrics['admission_watermark'].labels('defer').set(defer)
+            self._metrics['admission_watermark'].labels('spill').set(spill)
+
+    def count_webhook_delivery(self, outcome):
+        """Count a webhook delivery as the first of its event or a duplicate."""
+        if self.enabled:
+            self._metrics['webhook_deliveries'].labels(outcome).inc()
+
+    def count_athlete_lookup(self, result):
+        """Count an athlete cache lookup answered by the local or shared tier, or missed."""
+        if self.enabled:
+            self._metrics['athlete_cache'].labels(result).inc()
+
+    def count_gear_check(self, outcome):
+        """Count a gear check run (immediate or deferred), scheduled, or avoided by an update or delete while pending."""
+        if self.enabled:
+            self._metrics['gear_checks'].labels(outcome).inc()
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage of processing an event."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._metrics['stage'].labels(name).observe(time.perf_counter() - started)
+
+    def observe_strava_call(self, url, status, seconds, headers):
+        """Record a Strava API call and the rate limit usage it reported."""
+        if not self.enabled:
+            return
+        # numeric IDs would make a series per activity
+        endpoint = re.sub(r'/\d+', '/{id}', urlsplit(url).path)
+        self._metrics['strava_requests'].labels(endpoint, status).inc()
+        self._metrics['strava_seconds'].labels(endpoint).observe(seconds)
+        for name, values in (('strava_usage', headers.get('X-RateLimit-Usage')), ('strava_limit', headers.get('X-RateLimit-Limit'))):
+            parsed = parse_rate_limit_header(values)
+            if parsed:
+                self._metrics[name].labels('short').set(parsed[0])
+                self._metrics[name].labels('daily').set(parsed[1])
+
+    def serve(self):
+        """Serve the metrics in Prometheus text format to local scrapers."""
+        from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+        if request.remote_addr not in current_app.config['METRICS_ALLOWED_ADDRS']:
+            abort(404)
+        registry = REGISTRY
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            from prometheus_client import multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -10,7 +10,7 @@ class User(UserMixin, db.Model):
     __tablename__ = "users"
 
     id = db.Column(db.Integer, autoincrement=True, primary_key=True)
-    strava_id = db.Column(db.Integer)
+    strava_id = db.Column(db.Integer, index=True, unique=True)
     email = db.Column(db.String, unique=True)
     password_hash = db.Column(db.String)
     created_on = db.Column(db.DateTime, nullable=False)
@@ -33,19 +33,127 @@ class Shoe(db.Model):
     __tablename__ = "shoes"
 
     id = db.Column(db.Integer, autoincrement=True, primary_key=True)
-    strava_gear_id = db.Column(db.String)
+    strava_gear_id = db.Column(db.String, index=True, unique=True)
     name = db.Column(db.String)
     nickname = db.Column(db.String)
     retired = db.Column(db.Boolean)
-    run_default = db.Column(db.Boolean)
 
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
 
     user = db.relationship("User", back_populates="shoes")
+    defaults = db.relationship("ShoeDefault", back_populates="shoe", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f'<Shoe id={self.id} name={self.name}>'
 
+class ShoeDefault(db.Model):
+    """A shoe set as a user's default for a sport type."""
+
+    __tablename__ = "shoe_defaults"
+    __table_args__ = (
+        # at most one default shoe per user for each sport
+        db.Index("ix_shoe_defaults_user_id_sport_type", "user_id", "sport_type", unique=True),
+    )
+
+    id = db.Column(db.Integer, autoincrement=True, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    shoe_id = db.Column(db.Integer, db.ForeignKey("shoes.id"), nullable=False, index=True)
+    sport_type = db.Column(db.String, nullable=False)
+
+    shoe = db.relationship("Shoe", back_populates="defaults")
+
+    def __repr__(self):
+        return f'<ShoeDefault shoe_id={self.shoe_id} sport_type={self.sport_type}>'
+
+class Activity(db.Model):
+    """The parts of a Strava activity needed to check its gear."""
+
+    __tablename__ = "activities"
+
+    strava_activity_id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
+    gear_id = db.Column(db.String)
+    sport_type = db.Column(db.String)
+    start_date_local = db.Column(db.DateTime)
+    distance = db.Column(db.Float)
+    moving_time = db.Column(db.Integer)
+    fetched_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<Activity strava_activity_id={self.strava_activity_id} sport_type={self.sport_type}>'
+
+class ShoeStats(db.Model):
+    """Running totals for a piece of gear, kept up to date as activities are stored."""
+
+    __tablename__ = "shoe_stats"
+
+    gear_id = db.Column(db.String, primary_key=True)
+    distance = db.Column(db.Float, nullable=False, default=0)
+    moving_time = db.Column(db.Integer, nullable=False, default=0)
+    activity_count = db.Column(db.Integer, nullable=False, default=0)
+    replacement_alerted_on = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ShoeStats gear_id={self.gear_id} distance={self.distance}>'
+
+class ShoeWeeklyStats(db.Model):
+    """A week's totals for a piece of gear, weeks starting on Monday."""
+
+    __tablename__ = "shoe_weekly_stats"
+    __table_args__ = (
+        db.Index("ix_shoe_weekly_stats_user_id_week_start", "user_id", "week_start"),
+    )
+
+    gear_id = db.Column(db.String, primary_key=True)
+    week_start = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    distance = db.Column(db.Float, nullable=False, default=0)
+    moving_time = db.Column(db.Integer, nullable=False, default=0)
+    activity_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ShoeWeeklyStats gear_id={self.gear_id} week_start={self.week_start}>'
+
+class BackfillCursor(db.Model):
+    """How far a user's historical activity backfill has got."""
+
+    __tablename__ = "backfill_cursors"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    next_page = db.Column(db.Integer, nullable=False, default=1)
+    matched = db.Column(db.Integer, nullable=False, default=0)
+    completed_on = db.Column(db.DateTime)
+    updated_on = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f'<BackfillCursor user_id={self.user_id} next_page={self.next_page}>'
+
+class LoggedEvent(db.Model):
+    """A webhook event as accepted, kept so it can be processed again if it's lost or needs replaying."""
+
+    __tablename__ = "event_log"
+    __table_args__ = (
+        db.Index("ix_event_log_unprocessed", "received_at", postgresql_where=db.text("processed_at IS NULL")),
+        db.Index("ix_event_log_spilled", "id", postgresql_where=db.text("spilled")),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), autoincrement=True, primary_key=True)
+    received_at = db.Column(db.DateTime, nullable=False, index=True)
+    owner_id = db.Column(db.BigInteger, nullable=False)
+    object_id = db.Column(db.BigInteger, nullable=False)
+    aspect_type = db.Column(db.String, nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    # the task processing the event, and since when; set again when the event is requeued or replayed
+    claimed_by = db.Column(db.String)
+    claimed_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+    requeues = db.Column(db.Integer, nullable=False, default=0)
+    # accepted while the queues were past the spill watermark, and not queued yet
+    spilled = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f'<LoggedEvent id={self.id} aspect_type={self.aspect_type} object_id={self.object_id}>'
+
 class AccessToken(db.Model):
     """A short-lived access token."""
 
@@ -55,8 +163,8 @@ class AccessToken(db.Model):
     code = db.Column(db.String)
     scope_activity_read_all = db.Column(db.Boolean)
     scope_profile_read_all = db.Column(db.Boolean)
-    expires_at = db.Column(db.DateTime)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    expires_at = db.Column(db.DateTime, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True, unique=True)
 
     user = db.relationship("User", back_populates="access_tokens")
 
@@ -72,7 +180,7 @@ class RefreshToken(db.Model):
     code = db.Column(db.String)
     scope_activity_read_all = db.Column(db.Boolean)
     scope_profile_read_all = db.Column(db.Boolean)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True, unique=True)
 
     user = db.relationship("User", back_populates="refresh_tokens")
 
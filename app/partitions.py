@@ -0,0 +1,42 @@
+"""Partitioning of webhook events by athlete.
+
+With EVENT_PARTITIONS set, each athlete's events go to one of that many
+queues, picked by a jump consistent hash of their Strava ID, and each queue
+is consumed by a single worker process one event at a time. An athlete's
+events are then processed in order by the same process, which keeps their
+cached details and tokens warm and makes it the only process refreshing
+their tokens. Adding partitions moves only the athletes whose hash changes,
+about 1/n of them when going from n - 1 to n.
+
+Partition workers consume only partition queues, with one process each:
+
+    celery -A worker.celery worker -Q events.0 --concurrency 1
+"""
+
+from flask import current_app
+
+# whether this process consumes partition queues, and so may refresh tokens for the athletes hashed to them
+consumer = False
+
+def jump_hash(key, buckets):
+    """Map an integer key to one of buckets, moving few keys when buckets grows (Lamping and Veach)."""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+def partition_for(strava_id):
+    """Return the partition for an athlete's events, or None if events aren't partitioned."""
+    partitions = current_app.config['EVENT_PARTITIONS']
+    return jump_hash(strava_id, partitions) if partitions else None
+
+def queue_name(partition):
+    """Return the Celery queue of a partition."""
+    return current_app.config['EVENT_PARTITION_QUEUE'].format(partition)
+
+def is_partition_queue(name, config):
+    """Check whether a Celery queue name is one of the partition queues."""
+    prefix = config['EVENT_PARTITION_QUEUE'].split('{', 1)[0]
+    return name.startswith(prefix) and name[len(prefix):].isdigit()
@@ -0,0 +1,153 @@
+"""Scheduling of Strava API calls within the app's rate limits.
+
+Strava allows a fixed number of requests per 15 minute window (resetting on the
+quarter hour) and per day (resetting at midnight UTC), shared by every process
+using the app's credentials. Each window is a bucket of tokens refilled when the
+window resets. Calls take a token from every window before going out, and the
+counts are corrected from the X-RateLimit-Usage header Strava returns.
+
+Low priority calls (e.g. gear sync) may only use part of each window, so
+webhook activity fetches keep a reserve. A call that doesn't fit is deferred
+with RateLimitDeferred rather than sent to fail with a 429.
+"""
+
+import threading
+import time
+from app.stores import redis_client
+
+PRIORITY_HIGH = 'high'
+PRIORITY_LOW = 'low'
+
+SHORT_WINDOW = 15 * 60
+DAILY_WINDOW = 24 * 60 * 60
+
+class RateLimitDeferred(Exception):
+    """Raised when a Strava call has to wait for a rate limit window to reset."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Strava rate limit reached, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+def parse_rate_limit_header(value):
+    """Parse a header like '100,1000' into (short, daily) integers."""
+    try:
+        short, daily = value.split(',')
+        return int(short), int(daily)
+    except (AttributeError, ValueError):
+        return None
+
+class MemoryRateLimitBackend:
+    """Window counters for a single process."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def take(self, keys, caps, ttls):
+        """Count a call in every window if all have room; return the index of a full window otherwise."""
+        with self._lock:
+            for i, key in enumerate(keys):
+                if self._counts.get(key, 0) + 1 > caps[i]:
+                    return i
+            for key in keys:
+                self._counts[key] = self._counts.get(key, 0) + 1
+            # forget windows that have passed
+            if len(self._counts) > 16:
+                self._counts = {key: self._counts[key] for key in keys}
+            return None
+
+    def sync(self, keys, usages, ttls):
+        """Raise window counts to the usage Strava reports."""
+        with self._lock:
+            for key, usage in zip(keys, usages):
+                self._counts[key] = max(self._counts.get(key, 0), usage)
+
+class RedisRateLimitBackend:
+    """Window counters shared by every worker through Redis."""
+
+    TAKE_SCRIPT = """
+    for i, key in ipairs(KEYS) do
+        if tonumber(redis.call('GET', key) or '0') + 1 > tonumber(ARGV[i]) then
+            return i - 1
+        end
+    end
+    for i, key in ipairs(KEYS) do
+        redis.call('INCR', key)
+        redis.call('EXPIRE', key, ARGV[#KEYS + i])
+    end
+    return -1
+    """
+
+    SYNC_SCRIPT = """
+    for i, key in ipairs(KEYS) do
+        if tonumber(redis.call('GET', key) or '0') < tonumber(ARGV[i]) then
+            redis.call('SET', key, ARGV[i], 'EX', ARGV[#KEYS + i])
+        end
+    end
+    """
+
+    def __init__(self, client):
+        self._take = client.register_script(self.TAKE_SCRIPT)
+        self._sync = client.register_script(self.SYNC_SCRIPT)
+
+    def take(self, keys, caps, ttls):
+        """Count a call in every window if all have room; return the index of a full window otherwise."""
+        full = self._take(keys=keys, args=[*caps, *ttls])
+        return None if full == -1 else full
+
+    def sync(self, keys, usages, ttls):
+        """Raise window counts to the usage Strava reports."""
+        self._sync(keys=keys, args=[*usages, *ttls])
+
+class StravaRateLimiter:
+    """Admits Strava calls within the short and daily rate limits."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.limits = (100, 1000)
+        self.low_priority_share = 0.8
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the backend and limits from the app config."""
+        if app.config['RATE_LIMIT_BACKEND'] == 'redis':
+            self.backend = RedisRateLimitBackend(redis_client(app))
+        else:
+            self.backend = MemoryRateLimitBackend()
+        self.limits = (app.config['STRAVA_SHORT_LIMIT'], app.config['STRAVA_DAILY_LIMIT'])
+        self.low_priority_share = app.config['RATE_LIMIT_LOW_PRIORITY_SHARE']
+
+    @staticmethod
+    def windows(now):
+        """Return the keys and seconds until reset of the current short and daily windows."""
+        short_start = int(now // SHORT_WINDOW * SHORT_WINDOW)
+        daily_start = int(now // DAILY_WINDOW * DAILY_WINDOW)
+        keys = [f'strava:ratelimit:short:{short_start}', f'strava:ratelimit:daily:{daily_start}']
+        resets = [short_start + SHORT_WINDOW - now, daily_start + DAILY_WINDOW - now]
+        return keys, resets
+
+    def acquire(self, priority=PRIORITY_HIGH):
+        """Take a token for a call, or raise RateLimitDeferred if the call has to wait."""
+        keys, resets = self.windows(time.time())
+        share = 1 if priority == PRIORITY_HIGH else self.low_priority_share
+        caps = [int(limit * share) for limit in self.limits]
+        ttls = [int(reset) + 1 for reset in resets]
+        full = self.backend.take(keys, caps, ttls)
+        if full is not None:
+            raise RateLimitDeferred(int(resets[full]) + 1)
+
+    def update_from_headers(self, headers):
+        """Correct limits and window counts from Strava's rate limit headers."""
+        limits = parse_rate_limit_header(headers.get('X-RateLimit-Limit'))
+        if limits:
+            self.limits = limits
+        usages = parse_rate_limit_header(headers.get('X-RateLimit-Usage'))
+        if usages:
+            keys, resets = self.windows(time.time())
+            self.backend.sync(keys, list(usages), [int(reset) + 1 for reset in resets])
+
+    def defer_until_reset(self):
+        """Build the deferral for a call Strava rejected with a 429."""
+        _, resets = self.windows(time.time())
+        return RateLimitDeferred(int(resets[0]) + 1)
@@ -9,7 +9,7 @@ for (const form of forms){
         const shoeId = parseInt(form.id.split('-').pop());
         // iterate over checked checkboxes in this form to pull activity types from value field 
         var checkedActivityTypes = [];
-        var checkboxes = document.querySelectorAll('input[type=checkbox]:checked')
+        var checkboxes = form.querySelectorAll('input[type=checkbox]:checked')
         for (var i = 0; i < checkboxes.length; i++) {
             checkboxes[i]
             checkedActivityTypes.push(checkboxes[i].value)
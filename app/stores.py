@@ -0,0 +1,100 @@
+"""Bounded key-value stores used for caching and deduplication."""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class MemoryStore:
+    """An in-process LRU store with per-key expiry, standing in for Redis."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        """Return the entry for key if it exists and hasn't expired."""
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return entry
+
+    def _put(self, key, value, ttl, now):
+        """Store a value and evict the least recently used entries past maxsize."""
+        self._items[key] = (value, now + ttl if ttl else None)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, key):
+        """Retrieve a value, or None if missing or expired."""
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            return entry[0] if entry else None
+
+    def set(self, key, value, ttl=None):
+        """Store a value, optionally expiring after ttl seconds."""
+        with self._lock:
+            self._put(key, value, ttl, time.monotonic())
+
+    def add(self, key, value, ttl=None):
+        """Store a value only if the key is absent; return whether it was stored."""
+        with self._lock:
+            now = time.monotonic()
+            if self._live(key, now):
+                return False
+            self._put(key, value, ttl, now)
+            return True
+
+    def delete(self, key):
+        """Remove a key."""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """Remove every key."""
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+class RedisStore:
+    """A store backed by Redis, with keys namespaced by prefix and values stored as JSON."""
+
+    def __init__(self, client, prefix=''):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        """Retrieve a value, or None if missing or expired."""
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        """Store a value, optionally expiring after ttl seconds."""
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def add(self, key, value, ttl=None):
+        """Store a value only if the key is absent; return whether it was stored."""
+        return bool(self.client.set(self.prefix + key, json.dumps(value), ex=ttl, nx=True))
+
+    def delete(self, key):
+        """Remove a key."""
+        self.client.delete(self.prefix + key)
+
+def redis_client(app):
+    """Create a Redis client from the app's REDIS_URL."""
+    import redis
+    return redis.Redis.from_url(app.config['REDIS_URL'])
+
+def make_store(app, backend, prefix, maxsize):
+    """Create a Redis or in-memory store per configuration."""
+    if backend == 'redis':
+        return RedisStore(redis_client(app), prefix)
+    return MemoryStore(maxsize)
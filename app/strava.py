@@ -0,0 +1,104 @@
+"""Client for the Strava API with pooled keep-alive connections."""
+
+import logging
+import os
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from . import constants
+from .ratelimit import PRIORITY_HIGH, PRIORITY_LOW, StravaRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# methods that are safe to retry when a request fails part way through
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'})
+
+class StravaClient:
+    """Sends requests to Strava over a connection pool owned by the current process."""
+
+    def __init__(self, app=None, pool_size=10, connect_timeout=3.05, read_timeout=10, max_retries=3, retry_backoff=0.5):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._session = None
+        self._session_pid = None
+        self.rate_limiter = None
+        self.metrics = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure pool size, timeouts and retries from the app config."""
+        self.pool_size = app.config['STRAVA_POOL_SIZE']
+        self.timeout = (app.config['STRAVA_CONNECT_TIMEOUT'], app.config['STRAVA_READ_TIMEOUT'])
+        self.max_retries = app.config['STRAVA_MAX_RETRIES']
+        self.retry_backoff = app.config['STRAVA_RETRY_BACKOFF']
+        self._session = None
+        self.rate_limiter = StravaRateLimiter(app)
+        self.metrics = app.extensions.get('metrics')
+        app.extensions['strava'] = self
+
+    @property
+    def session(self):
+        """Return this process's session, creating a new one after a fork."""
+        # connections can't be shared with a parent process, e.g. Celery prefork workers
+        if self._session is None or self._session_pid != os.getpid():
+            retry = Retry(
+                total=self.max_retries,
+                backoff_factor=self.retry_backoff,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=IDEMPOTENT_METHODS,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+            self._session_pid = os.getpid()
+        return self._session
+
+    def request(self, method, url, access_token=None, priority=PRIORITY_LOW, **kwargs):
+        """Send a request to Strava; url may be a path relative to the API base.
+
+        Calls with a priority count against the rate limits and raise
+        RateLimitDeferred when they have to wait; priority None is unmetered.
+        """
+        metered = self.rate_limiter is not None and priority is not None
+        if metered:
+            self.rate_limiter.acquire(priority)
+        if not url.startswith('http'):
+            url = f'{constants.BASE_URL}{url}'
+        if access_token:
+            kwargs['headers'] = {**kwargs.get('headers', {}), 'Authorization': f'Bearer {access_token}'}
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        response = self.session.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - started
+        logger.debug(f"{method} {url} -> {response.status_code} in {elapsed * 1000:.1f}ms")
+        if self.metrics is not None:
+            self.metrics.observe_strava_call(url, response.status_code, elapsed, response.headers)
+        if metered:
+            self.rate_limiter.update_from_headers(response.headers)
+            if response.status_code == 429:
+                raise self.rate_limiter.defer_until_reset()
+        return response
+
+    def get_activity(self, access_token, activity_id, priority=PRIORITY_HIGH):
+        """Retrieve a detailed activity."""
+        return self.request('GET', f'/activities/{activity_id}', access_token, priority, params={'include_all_efforts': False})
+
+    def get_athlete(self, access_token):
+        """Retrieve the authenticated athlete, including their gear."""
+        return self.request('GET', '/athlete', access_token, PRIORITY_LOW)
+
+    def get_athlete_activities(self, access_token, page, per_page=200, priority=PRIORITY_LOW):
+        """Retrieve a page of the athlete's activities, newest first."""
+        return self.request('GET', '/athlete/activities', access_token, priority, params={'page': page, 'per_page': per_page})
+
+    def exchange_token(self, data):
+        """Exchange an authorization code or refresh token for new tokens."""
+        # token exchanges aren't deferred: a user or event is waiting on them
+        return self.request('POST', constants.TOKEN_URL, priority=None, data=data)
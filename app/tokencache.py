@@ -0,0 +1,65 @@
+"""Cache of users' access tokens with single-flight refresh locks."""
+
+import threading
+import time
+from contextlib import contextmanager
+from app.stores import make_store, redis_client
+
+class TokenCache:
+    """Remembers access tokens until shortly before they expire.
+
+    Refreshing a token invalidates the previous refresh token, so concurrent
+    refreshes for the same user must not happen. lock() serializes them, across
+    workers through Redis or within a process with striped local locks.
+    """
+
+    LOCAL_LOCK_STRIPES = 64
+
+    def __init__(self, app=None):
+        self.store = None
+        self.refresh_margin = 300
+        self._redis = None
+        self._lock_timeout = 30
+        self._local_locks = [threading.Lock() for _ in range(self.LOCAL_LOCK_STRIPES)]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the cache and lock backends from the app config."""
+        self.store = make_store(app, app.config['TOKEN_CACHE_BACKEND'], 'token:', app.config['TOKEN_CACHE_MAX_USERS'])
+        self.refresh_margin = app.config['TOKEN_REFRESH_MARGIN']
+        self._lock_timeout = app.config['TOKEN_LOCK_TIMEOUT']
+        self._redis = redis_client(app) if app.config['TOKEN_LOCK_BACKEND'] == 'redis' else None
+        app.extensions['token_cache'] = self
+
+    def expires_soon(self, expires_at, margin=None):
+        """Check whether a token expiring at a Unix timestamp is within the refresh margin."""
+        return expires_at <= time.time() + (self.refresh_margin if margin is None else margin)
+
+    def get(self, user_id):
+        """Retrieve a cached access token code that isn't about to expire."""
+        cached = self.store.get(str(user_id))
+        if cached is None or self.expires_soon(cached[1]):
+            return None
+        return cached[0]
+
+    def set(self, user_id, code, expires_at):
+        """Cache an access token code until it's due for refresh."""
+        ttl = int(expires_at - time.time() - self.refresh_margin)
+        if ttl > 0:
+            self.store.set(str(user_id), [code, expires_at], ttl)
+
+    def invalidate(self, user_id):
+        """Forget a user's cached access token."""
+        self.store.delete(str(user_id))
+
+    @contextmanager
+    def lock(self, user_id, local=False):
+        """Hold the lock for refreshing a user's tokens, only within this process if local."""
+        if self._redis is not None and not local:
+            with self._redis.lock(f'token-refresh:{user_id}', timeout=self._lock_timeout,
+                                  blocking_timeout=self._lock_timeout):
+                yield
+        else:
+            with self._local_locks[user_id % self.LOCAL_LOCK_STRIPES]:
+                yield
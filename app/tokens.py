@@ -1,22 +1,91 @@
-import requests
+import time
+from flask import current_app
 from app import crud
-from app import db 
+from app import celery, db, event_queue, partitions, strava, token_cache
 from datetime import datetime, timedelta
 from . import constants
 
-def retrieve_valid_access_code(user_id):
-    """Retrieve a valid access code."""
-    # return existing valid access code 
-    if crud.user_has_active_access_token(user_id): 
-        print("using existing access token")
-        return crud.get_access_token(user_id).code 
-    
-    # use refresh token to retrieve new access token 
-    token_data = refresh_tokens(user_id)
-    print(token_data)
-    access_token_code = update_tokens_in_db(user_id, token_data)
-    print(f"your new access token is {access_token_code}")
-    return access_token_code
+class MissingTokens(LookupError):
+    """Raised when a user has no tokens to use or refresh, e.g. after their account was removed."""
+
+def retrieve_valid_access_code(user_id, access_token=None):
+    """Retrieve a valid access code.
+
+    access_token may be a (code, expires_at) pair the caller already loaded, e.g.
+    from an event context, to save reading it from the database.
+    """
+    # return cached access code
+    access_token_code = token_cache.get(user_id)
+    if access_token_code:
+        return access_token_code
+
+    # return existing valid access code
+    if access_token is None:
+        access_token = stored_access_token(user_id)
+    access_token_code, expires_at = access_token[0], access_token[1].timestamp()
+    if not token_cache.expires_soon(expires_at):
+        token_cache.set(user_id, access_token_code, expires_at)
+        return access_token_code
+
+    # use refresh token to retrieve new access token
+    return refresh_access_code(user_id)
+
+def refresh_access_code(user_id, margin=None):
+    """Refresh a user's tokens unless they are still valid beyond margin seconds, and return the access code."""
+    if current_app.config['EVENT_PARTITIONS'] and not partitions.consumer:
+        return refresh_on_partition(user_id, margin)
+    # only one refresh per user at a time: a refresh invalidates the previous refresh token;
+    # with partitions, only the process consuming the user's partition refreshes their tokens
+    with token_cache.lock(user_id, local=partitions.consumer):
+        # another worker may have refreshed while we waited for the lock
+        db.session.expire_all()
+        access_token_code, expires_at = stored_access_token(user_id)
+        expires_at = expires_at.timestamp()
+        if not token_cache.expires_soon(expires_at, margin):
+            token_cache.set(user_id, access_token_code, expires_at)
+            return access_token_code
+
+        token_data = refresh_tokens(user_id)
+        access_token_code = update_tokens_in_db(user_id, token_data)
+        token_cache.set(user_id, access_token_code, (datetime.now() + timedelta(seconds = token_data['expires_in'])).timestamp())
+        current_app.logger.info(f"refreshed access token for user {user_id}")
+        return access_token_code
+
+def refresh_on_partition(user_id, margin=None, wait=True):
+    """Have the worker for a user's partition refresh their tokens, and wait for the new access code if wait.
+
+    Prefork workers take the refresh as a task on the partition's queue and
+    asyncio workers from the partition's event queue. The wait is at most
+    TOKEN_PARTITION_WAIT seconds, since a web request may be the one waiting;
+    after that TimeoutError is raised and the refresh still happens.
+    """
+    user = crud.get_user_by_id(user_id)
+    if user is None:
+        raise MissingTokens(f"user {user_id} doesn't exist")
+    partition = partitions.partition_for(user.strava_id)
+    if current_app.config['WORKER_MODE'] == 'asyncio':
+        event_queue.push_token_refresh(user.strava_id, user_id, margin, partition)
+    else:
+        refresh_user_tokens.apply_async((user_id, margin), queue=partitions.queue_name(partition))
+    if not wait:
+        return None
+    deadline = time.monotonic() + current_app.config['TOKEN_PARTITION_WAIT']
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        db.session.expire_all()
+        access_token_code, expires_at = stored_access_token(user_id)
+        expires_at = expires_at.timestamp()
+        if not token_cache.expires_soon(expires_at, margin):
+            token_cache.set(user_id, access_token_code, expires_at)
+            return access_token_code
+    raise TimeoutError(f"tokens for user {user_id} weren't refreshed on their partition in time")
+
+def stored_access_token(user_id):
+    """Retrieve a user's access token from the database as (code, expires_at), raising MissingTokens if there's none."""
+    access_token = crud.get_access_token(user_id)
+    if access_token is None:
+        raise MissingTokens(f"user {user_id} has no access token")
+    return access_token.code, access_token.expires_at
 
 def refresh_tokens(user_id):
     """Use user's refresh token to retrieve updated tokens."""
@@ -28,7 +97,7 @@ def refresh_tokens(user_id):
         'refresh_token': refresh_token.code,
     }
 
-    token_response = requests.post(constants.TOKEN_URL, data=data) 
+    token_response = strava.exchange_token(data)
     token_data = token_response.json()
     return token_data
 
@@ -42,12 +111,34 @@ def update_tokens_in_db(user_id, token_data):
     access_token_code = token_data['access_token']
     refresh_token_code = token_data['refresh_token']
     expires_at = datetime.now() + timedelta(seconds = token_data['expires_in'])
-    
-    # update token attributes 
+
+    # update token attributes
     access_token.expires_at = expires_at
     access_token.code = access_token_code
-    refresh_token.code = refresh_token_code 
+    refresh_token.code = refresh_token_code
     db.session.add_all([access_token,refresh_token])
     db.session.commit()
 
-    return access_token_code
\ No newline at end of file
+    return access_token_code
+
+@celery.task
+def refresh_user_tokens(user_id, margin=None):
+    """Refresh a user's tokens on the worker for their partition."""
+    refresh_access_code(user_id, margin)
+
+@celery.task
+def refresh_expiring_tokens():
+    """Refresh access tokens that will expire soon, so events never wait on a refresh."""
+    window = current_app.config['TOKEN_SWEEP_WINDOW']
+    user_ids = crud.get_user_ids_with_tokens_expiring_before(datetime.now() + timedelta(seconds = window))
+    for user_id in user_ids:
+        try:
+            if current_app.config['EVENT_PARTITIONS'] and not partitions.consumer:
+                # partition workers refresh in their own time, between events
+                refresh_on_partition(user_id, margin = window, wait = False)
+            else:
+                refresh_access_code(user_id, margin = window)
+        except Exception as err:
+            # one user's failed refresh shouldn't stop the sweep
+            current_app.logger.warning(f"couldn't refresh tokens for user {user_id}: {err}")
+    return len(user_ids)
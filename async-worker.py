@@ -0,0 +1,32 @@
+"""Entry point for asyncio workers, used instead of Celery workers when WORKER_MODE = 'asyncio'.
+
+    source secrets.sh
+    python3 async-worker.py --concurrency 200
+    python3 async-worker.py --partition 3      # with EVENT_PARTITIONS set, one process per partition
+"""
+
+import argparse
+import asyncio
+from app import create_app, event_queue, partitions
+from app.gear.aioworker import AsyncEventWorker
+
+async def work(app, concurrency, threads, partition):
+    async with AsyncEventWorker(app, concurrency, threads) as worker:
+        print(f"processing up to {worker.concurrency} events at once from {event_queue.key_for(partition)}")
+        await worker.run(partition)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Process webhook events on an asyncio event loop.')
+    parser.add_argument('--concurrency', type=int, help='events in flight at once')
+    parser.add_argument('--threads', type=int, help='threads for database, token and mail calls')
+    parser.add_argument('--partition', type=int, help='the partition to process, with EVENT_PARTITIONS set')
+    args = parser.parse_args()
+
+    app = create_app(role='worker')
+    # the only process for this partition's athletes, so it refreshes their tokens itself
+    partitions.consumer = args.partition is not None
+    with app.app_context():
+        try:
+            asyncio.run(work(app, args.concurrency, args.threads, args.partition))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,44 @@
+"""Script to find a user's past activities recorded with their default shoe.
+
+Streams the athlete's activity history from Strava and prints each activity
+that used the default shoe. Progress is saved after every page, so running the
+script again after an interruption picks up where it stopped.
+
+    source secrets.sh
+    python3 backfill-activities.py --strava-id 12345
+    python3 backfill-activities.py --strava-id 12345 --queue     # run in a Celery worker instead
+    python3 backfill-activities.py --strava-id 12345 --restart   # start again from the first page
+"""
+
+import argparse
+from app import create_app, crud
+from app.gear.backfill import backfill_default_gear_activities, backfill_user_activities, restart_backfill
+from app.ratelimit import RateLimitDeferred
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill past default gear activities for a user.')
+    parser.add_argument('--strava-id', type=int, required=True, help="the athlete's Strava ID")
+    parser.add_argument('--concurrency', type=int, help='pages fetched at once')
+    parser.add_argument('--queue', action='store_true', help='queue the backfill for a Celery worker')
+    parser.add_argument('--restart', action='store_true', help='ignore saved progress and start from the first page')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        user = crud.get_user_by_strava_id(args.strava_id)
+        if not user:
+            parser.exit(1, f"no user with Strava ID {args.strava_id}\n")
+        if args.restart:
+            restart_backfill(user.id)
+        if args.queue:
+            backfill_user_activities.delay(user.id)
+            print(f"queued backfill for user {user.id}")
+        else:
+            try:
+                for activity in backfill_default_gear_activities(user.id, concurrency=args.concurrency):
+                    print(f"{activity.start_date_local:%Y-%m-%d} {activity.sport_type:<10} {activity.activity_id}")
+            except RateLimitDeferred as deferred:
+                print(f"paused for the Strava rate limit; run again in {deferred.retry_after}s to resume")
+            cursor = crud.get_backfill_cursor(user.id)
+            print(f"{cursor.matched} default gear activities found, next page {cursor.next_page}"
+                  f"{' (complete)' if cursor.completed_on else ''}")
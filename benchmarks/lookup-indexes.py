@@ -0,0 +1,97 @@
+"""Benchmark the webhook path's lookups with and without their indexes.
+
+Seeds users, shoes and tokens, times the hot lookups, then drops the indexes
+and times them again. Uses a throwaway SQLite file unless --database-url
+points at a scratch Postgres database (its tables are dropped and recreated).
+
+    source secrets.sh
+    python3 benchmarks/lookup-indexes.py --users 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import insert, text
+from app import create_app, crud, db
+from app.model import AccessToken, RefreshToken, Shoe, ShoeDefault, User
+from config import Config
+
+INDEXES = ['ix_users_strava_id', 'ix_shoes_strava_gear_id', 'ix_shoes_user_id', 'ix_shoe_defaults_user_id_sport_type',
+           'ix_access_tokens_user_id', 'ix_access_tokens_expires_at', 'ix_refresh_tokens_user_id']
+
+def seed(users, batch=10000):
+    """Insert users with two shoes (one the default for runs) and a pair of tokens each."""
+    expires_at = datetime.now() + timedelta(hours=6)
+    for start in range(1, users + 1, batch):
+        ids = range(start, min(start + batch, users + 1))
+        db.session.execute(insert(User), [{'id': i, 'strava_id': 1_000_000 + i, 'created_on': datetime.now(), 'email_consent': True} for i in ids])
+        db.session.execute(insert(Shoe), [{'id': 2 * i + n, 'strava_gear_id': f'g{i}-{n}', 'name': f'shoe {n}', 'retired': False, 'user_id': i} for i in ids for n in range(2)])
+        db.session.execute(insert(ShoeDefault), [{'user_id': i, 'shoe_id': 2 * i, 'sport_type': 'Run'} for i in ids])
+        db.session.execute(insert(AccessToken), [{'code': f'a{i}', 'expires_at': expires_at, 'user_id': i} for i in ids])
+        db.session.execute(insert(RefreshToken), [{'code': f'r{i}', 'user_id': i} for i in ids])
+        db.session.commit()
+
+def time_lookups(users, lookups):
+    """Return mean milliseconds per lookup for each hot query."""
+    user_ids = [random.randint(1, users) for _ in range(lookups)]
+    queries = {
+        'users.strava_id': lambda i: crud.get_user_by_strava_id(1_000_000 + i),
+        'shoes.strava_gear_id': lambda i: crud.get_shoe_by_strava_id(f'g{i}-1'),
+        'shoe_defaults(user_id, sport)': lambda i: crud.get_user_default_shoe(i),
+        'access_tokens.user_id': lambda i: crud.get_access_token(i),
+        'refresh_tokens.user_id': lambda i: crud.get_refresh_token(i),
+    }
+    results = {}
+    for name, query in queries.items():
+        started = time.perf_counter()
+        for user_id in user_ids:
+            query(user_id)
+            db.session.expunge_all()
+        results[name] = (time.perf_counter() - started) * 1000 / lookups
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url or f'sqlite:///{tempfile.mkdtemp()}/lookups.db'
+        SQLALCHEMY_ECHO = False
+        DEDUPE_BACKEND = 'memory'
+        RATE_LIMIT_BACKEND = 'memory'
+        TOKEN_LOCK_BACKEND = 'memory'
+        ATHLETE_CACHE_BACKEND = 'memory'
+        GEAR_CHECK_BACKEND = 'memory'
+        GEAR_CACHE_BACKEND = 'memory'
+        ADMISSION_ENABLED = False
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        seed(args.users)
+        print(f"seeded {args.users} users in {time.perf_counter() - started:.1f}s")
+
+        indexed = time_lookups(args.users, args.lookups)
+        for index in INDEXES:
+            db.session.execute(text(f'DROP INDEX {index}'))
+        db.session.commit()
+        unindexed = time_lookups(args.users, args.lookups)
+
+    print(f"{'lookup':<30}{'indexed':>12}{'no index':>12}")
+    for name in indexed:
+        print(f"{name:<30}{indexed[name]:>10.3f}ms{unindexed[name]:>10.3f}ms")
+
+if __name__ == '__main__':
+    main()
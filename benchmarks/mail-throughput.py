@@ -0,0 +1,71 @@
+"""Benchmark reminder email throughput: a connection per message versus the persistent dispatcher.
+
+Sends the same messages to a local SMTP sink whose connect and login latency
+mimic an SSL connection and login to a real provider.
+
+    source secrets.sh
+    python3 benchmarks/mail-throughput.py --messages 200 --connect-latency 0.05 --login-latency 0.1
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask_mail import Message
+from app import create_app, mail, mail_dispatcher
+from benchmarks.standins.smtp import SMTPSink
+from config import Config
+
+def make_message(n):
+    """Build a reminder like the ones the worker sends."""
+    return Message(f'Check your gear on your run on 02/{n % 28 + 1:02d}', sender='stravagearupdater@gmail.com',
+                   recipients=[f'runner{n}@example.com'], html='You logged a run using your default gear.')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--connect-latency', type=float, default=0.05)
+    parser.add_argument('--login-latency', type=float, default=0.1)
+    args = parser.parse_args()
+
+    sink = SMTPSink(connect_latency=args.connect_latency, login_latency=args.login_latency).start()
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        SQLALCHEMY_ECHO = False
+        MAIL_SERVER = '127.0.0.1'
+        MAIL_PORT = sink.port
+        MAIL_USE_SSL = False
+        DEDUPE_BACKEND = 'memory'
+        RATE_LIMIT_BACKEND = 'memory'
+        TOKEN_LOCK_BACKEND = 'memory'
+        ATHLETE_CACHE_BACKEND = 'memory'
+        GEAR_CHECK_BACKEND = 'memory'
+        GEAR_CACHE_BACKEND = 'memory'
+        ADMISSION_ENABLED = False
+
+    app = create_app(BenchmarkConfig)
+    results = {}
+    with app.app_context():
+        started = time.perf_counter()
+        for n in range(args.messages):
+            mail.send(make_message(n))
+        results['connection per message (mail.send)'] = (time.perf_counter() - started, sink.connections)
+
+        connections_before = sink.connections
+        started = time.perf_counter()
+        for n in range(args.messages):
+            mail_dispatcher.send(make_message(n))
+        mail_dispatcher.close()
+        results['persistent connection (MailDispatcher)'] = (time.perf_counter() - started, sink.connections - connections_before)
+    sink.stop()
+
+    print(f"messages: {args.messages}")
+    for name, (elapsed, connections) in results.items():
+        print(f"{name:<42}{args.messages / elapsed:>8.1f} msg/s  {connections} connections")
+
+if __name__ == '__main__':
+    main()
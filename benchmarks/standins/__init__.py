@@ -0,0 +1 @@
+"""Local stand-ins for the services the app talks to, for tests and benchmarks."""
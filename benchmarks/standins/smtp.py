@@ -0,0 +1,115 @@
+"""A local SMTP server that accepts and records every message."""
+
+import socketserver
+import threading
+import time
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks enough SMTP for smtplib: EHLO, AUTH, MAIL, RCPT, DATA, RSET, NOOP and QUIT."""
+
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        sink = self.server.sink
+        # stands in for the TLS handshake of a real mail server
+        time.sleep(sink.connect_latency)
+        sink.connections += 1
+        self.reply('220 localhost SMTP sink ready')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b'250-localhost\r\n250 AUTH PLAIN LOGIN\r\n')
+            elif verb == 'AUTH':
+                time.sleep(sink.login_latency)
+                self.reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = command.split(':', 1)[1].strip(' <>')
+                if recipient in sink.refused:
+                    self.reply('550 No such user here')
+                    continue
+                recipients.append(recipient)
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b'.\r\n', b'.\n', b''):
+                        break
+                    data.append(data_line)
+                # stands in for the provider accepting the message
+                time.sleep(sink.message_latency)
+                sink.record(recipients, b''.join(data))
+                self.reply('250 OK queued')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+class SMTPSink:
+    """Runs an SMTP server on a background thread and keeps what it receives.
+
+    connect_latency and login_latency (seconds) mimic the cost of connecting
+    and authenticating to a real provider over SSL, and message_latency the
+    time it takes to accept each message. Recipients in refused are rejected
+    as unknown.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, connect_latency=0.0, login_latency=0.0, message_latency=0.0):
+        self.connect_latency = connect_latency
+        self.login_latency = login_latency
+        self.message_latency = message_latency
+        self.messages = []
+        self.refused = set()
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer((host, port), SMTPHandler)
+        self._server.daemon_threads = True
+        self._server.sink = self
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def record(self, recipients, data):
+        """Keep a received message with the time it arrived."""
+        with self._lock:
+            self.messages.append((time.time(), recipients, data))
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a local SMTP sink.')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--connect-latency', type=float, default=0.0)
+    parser.add_argument('--login-latency', type=float, default=0.0)
+    args = parser.parse_args()
+    sink = SMTPSink(port=args.port, connect_latency=args.connect_latency, login_latency=args.login_latency).start()
+    print(f"SMTP sink listening on 127.0.0.1:{sink.port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"{len(sink.messages)} messages over {sink.connections} connections")
+    except KeyboardInterrupt:
+        sink.stop()
@@ -0,0 +1,150 @@
+"""A local HTTP server that answers like the parts of the Strava API the worker calls."""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+def default_activity(activity_id):
+    """A run with the first shoe, like the activities the gear checker looks at."""
+    return {'id': activity_id, 'gear_id': 'g1', 'sport_type': 'Run', 'start_date_local': '2024-02-16T07:00:00Z',
+            'distance': 10000.0, 'moving_time': 3000}
+
+def default_athlete(access_token):
+    """An athlete with two shoes, the first of them in use."""
+    return {'id': 1, 'shoes': [{'id': 'g1', 'name': 'Daily Trainer', 'nickname': None, 'retired': False},
+                               {'id': 'g2', 'name': 'Old Racer', 'nickname': None, 'retired': True}]}
+
+def token_response(form):
+    """Fresh tokens for an authorization code or refresh token exchange."""
+    code = form.get('code', form.get('refresh_token', ['']))[0]
+    athlete_id = int(code) if code.isdigit() else 1
+    stamp = time.time_ns()
+    return {'token_type': 'Bearer', 'access_token': f'access-{stamp}', 'refresh_token': f'refresh-{stamp}',
+            'expires_at': int(time.time()) + 6 * 60 * 60, 'expires_in': 6 * 60 * 60, 'athlete': {'id': athlete_id}}
+
+class StravaHandler(BaseHTTPRequestHandler):
+    """Serves the token exchange, GET /api/v3/athlete and GET /api/v3/activities/{id}.
+
+    API calls count against the rate limits; token exchanges don't, as on Strava.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        fake = self.server.fake
+        path = self.path.split('?', 1)[0]
+        match = re.fullmatch(r'/api/v3/activities/(\d+)', path)
+        # stands in for Strava's response time
+        fake.begin_call()
+        try:
+            time.sleep(fake.latency)
+        finally:
+            fake.end_call()
+        usage = fake.count_call()
+        if any(used > limit for used, limit in zip(usage, fake.limits)):
+            self.reply(429, {'message': 'Rate Limit Exceeded'}, usage)
+        elif match:
+            self.reply(200, fake.activity(int(match.group(1))), usage)
+        elif path == '/api/v3/athlete':
+            self.reply(200, fake.athlete(self.headers.get('Authorization', '').removeprefix('Bearer ')), usage)
+        else:
+            self.reply(404, {'message': 'Record Not Found'}, usage)
+
+    def do_POST(self):
+        fake = self.server.fake
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        time.sleep(fake.latency)
+        if self.path.split('?', 1)[0] == '/api/v3/oauth/token':
+            fake.token_exchanges += 1
+            self.reply(200, token_response(form))
+        else:
+            self.reply(404, {'message': 'Record Not Found'})
+
+    def reply(self, status, body, usage=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if usage is not None:
+            self.send_header('X-RateLimit-Limit', ','.join(map(str, self.server.fake.limits)))
+            self.send_header('X-RateLimit-Usage', ','.join(map(str, usage)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class FakeStrava:
+    """Runs a Strava stand-in on a background thread.
+
+    latency (seconds) is added to every response. activity(activity_id) builds
+    the activity returned for an ID and athlete(access_token) the athlete.
+    Calls are counted in 15 minute and daily windows and answered with 429
+    once either passes limits, as Strava does. max_in_flight is the most API
+    calls it has been answering at once.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, limits=(100000, 1000000), activity=default_activity,
+                 athlete=default_athlete):
+        self.latency = latency
+        self.limits = limits
+        self.activity = activity
+        self.athlete = athlete
+        self.calls = 0
+        self.token_exchanges = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._windows = [None, None]
+        self._usage = [0, 0]
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), StravaHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self):
+        """The URL to use in place of constants.BASE_URL."""
+        return f'http://127.0.0.1:{self.port}/api/v3'
+
+    def use(self, constants):
+        """Point the app's Strava endpoints at this stand-in."""
+        constants.BASE_URL = self.base_url
+        constants.TOKEN_URL = f'{self.base_url}/oauth/token'
+
+    def begin_call(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end_call(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def count_call(self):
+        """Count a call in the current windows and return the usage in each."""
+        now = time.time()
+        windows = [int(now // (15 * 60)), int(now // (24 * 60 * 60))]
+        with self._lock:
+            self.calls += 1
+            for i, window in enumerate(windows):
+                if self._windows[i] != window:
+                    self._windows[i] = window
+                    self._usage[i] = 0
+                self._usage[i] += 1
+            return list(self._usage)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,66 @@
+"""Benchmark pooled keep-alive Strava calls against a fresh connection per call.
+
+Runs a local HTTP server that answers like GET /activities/{id} and times the
+same number of calls made with bare requests.get and with StravaClient.
+
+    source secrets.sh
+    python3 benchmarks/strava-connections.py --calls 500
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.strava import StravaClient
+
+ACTIVITY = json.dumps({'gear_id': 'g1', 'sport_type': 'Run', 'start_date_local': '2024-02-16T07:00:00Z',
+                       'distance': 10000.0, 'moving_time': 3000}).encode()
+
+class ActivityHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(ACTIVITY)))
+        self.end_headers()
+        self.wfile.write(ACTIVITY)
+
+    def log_message(self, *args):
+        pass
+
+def time_calls(call, calls):
+    """Return the mean latency in milliseconds of calls to call()."""
+    started = time.perf_counter()
+    for _ in range(calls):
+        call().json()
+    return (time.perf_counter() - started) * 1000 / calls
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=500)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ActivityHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/activities/1'
+
+    client = StravaClient()
+    fresh = time_calls(lambda: requests.get(url, headers={'Authorization': 'Bearer x'}), args.calls)
+    pooled = time_calls(lambda: client.request('GET', url, 'x'), args.calls)
+    server.shutdown()
+
+    print(f"calls: {args.calls}")
+    print(f"fresh connection per call: {fresh:.3f}ms/call")
+    print(f"pooled keep-alive session: {pooled:.3f}ms/call")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark the size and serialization time of event task messages.
+
+Queues synthetic Strava events on an in-memory broker the way the webhook did
+before compact references (the whole payload and keyword arguments as JSON)
+and does now (an event reference and positional arguments as msgpack), and
+reports broker bytes per event and time spent serializing task arguments.
+
+    source secrets.sh
+    python3 benchmarks/task-payload.py --events 5000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kombu.serialization import dumps
+from app import create_app, celery
+from app.gear import helpers
+from app.gear.eventref import event_ref
+from config import Config
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ECHO = False
+    CELERY_BROKER_URL = 'memory://'
+    ADMISSION_ENABLED = False
+
+TITLES = ('Morning Run', 'Lunch Walk with the dog', 'Long run along the river, legs felt heavy after Thursday')
+
+def make_event(i):
+    """Build a synthetic event: mostly creates, some updates with a new title, a few deletes."""
+    aspect_type = 'create' if i % 20 < 14 else 'update' if i % 20 < 19 else 'delete'
+    return {
+        'object_type': 'activity',
+        'object_id': 10_000_000_000 + i,
+        'aspect_type': aspect_type,
+        'owner_id': 100_000_000 + i % 5000,
+        'subscription_id': 123456,
+        'event_time': int(time.time()),
+        'updates': {'title': TITLES[i % len(TITLES)]} if aspect_type == 'update' else {},
+    }
+
+def legacy_call(data, received_at, event_id):
+    """The task arguments as queued before compact references."""
+    return (data,), {'received_at': received_at, 'event_id': event_id}, 'json'
+
+def compact_call(data, received_at, event_id):
+    """The task arguments as queued now."""
+    return (event_ref(data), received_at, event_id), {}, 'msgpack'
+
+def measure(build, events, connection):
+    """Return (message bytes, body bytes, serialization microseconds) per event for one way of queueing."""
+    calls = [build(data, time.time(), 1_000_000 + i) for i, data in enumerate(events)]
+    embed = {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}
+
+    started = time.perf_counter()
+    body_bytes = 0
+    for args, kwargs, serializer in calls:
+        body_bytes += len(dumps((args, kwargs, embed), serializer=serializer)[2])
+    serialize_seconds = time.perf_counter() - started
+
+    channel = connection.default_channel
+    message_bytes = 0
+    for args, kwargs, serializer in calls:
+        helpers.process_new_event.apply_async(args, kwargs, serializer=serializer, connection=connection)
+        # the Redis transport stores this envelope, JSON encoded, in the queue's list
+        message_bytes += len(json.dumps(channel._get('celery')))
+    return message_bytes / len(events), body_bytes / len(events), serialize_seconds / len(events) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_app(BenchmarkConfig, role='worker')
+    events = [make_event(i) for i in range(args.events)]
+    with app.app_context(), celery.connection_for_write() as connection:
+        results = {'before (payload, JSON)': measure(legacy_call, events, connection),
+                   'after (reference, msgpack)': measure(compact_call, events, connection)}
+
+    print(f"{args.events} events")
+    print(f"{'':28} {'message B':>10} {'body B':>8} {'serialize us':>13}")
+    for name, (message_bytes, body_bytes, serialize_us) in results.items():
+        print(f"{name:28} {message_bytes:10.0f} {body_bytes:8.0f} {serialize_us:13.2f}")
+
+if __name__ == '__main__':
+    main()
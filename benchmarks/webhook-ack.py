@@ -0,0 +1,82 @@
+"""Benchmark webhook acknowledgement latency.
+
+Posts synthetic Strava events to the webhook handler through the Flask test
+client, with tasks going to an in-memory broker, and reports ack latency.
+
+    source secrets.sh
+    python3 benchmarks/webhook-ack.py --events 2000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app, db
+from config import Config
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ECHO = False
+    CELERY_BROKER_URL = 'memory://'
+    DEDUPE_BACKEND = 'memory'
+    RATE_LIMIT_BACKEND = 'memory'
+    TOKEN_LOCK_BACKEND = 'memory'
+    ATHLETE_CACHE_BACKEND = 'memory'
+    GEAR_CHECK_BACKEND = 'memory'
+    GEAR_CACHE_BACKEND = 'memory'
+    ADMISSION_ENABLED = False
+
+def make_event(i):
+    """Build a synthetic activity creation event."""
+    return {
+        'object_type': 'activity',
+        'object_id': 10_000_000 + i,
+        'aspect_type': 'create',
+        'owner_id': 1000 + i % 50,
+        'subscription_id': 1,
+        'event_time': int(time.time()),
+        'updates': {},
+    }
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of a sorted list of samples."""
+    index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+    return samples[index]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--no-event-log', action='store_true', help='queue events without logging them first')
+    args = parser.parse_args()
+
+    BenchmarkConfig.EVENT_LOG_ENABLED = not args.no_event_log
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+    app.logger.setLevel('WARNING')
+    client = app.test_client()
+
+    # warm up connections and route dispatch
+    for i in range(50):
+        client.post('/webhook', json=make_event(args.events + i))
+
+    samples = []
+    for i in range(args.events):
+        started = time.perf_counter()
+        response = client.post('/webhook', json=make_event(i))
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.status_code
+    samples.sort()
+
+    print(f"events: {args.events}")
+    print(f"ack latency p50: {percentile(samples, 50):.2f}ms")
+    print(f"ack latency p99: {percentile(samples, 99):.2f}ms")
+    print(f"ack latency max: {samples[-1]:.2f}ms")
+    print(f"ack latency mean: {statistics.fmean(samples):.2f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Load test the webhook end to end against local Strava and SMTP stand-ins.
+
+Serves the app on a local HTTP server with an in-process Celery worker on an
+in-memory broker, replays activity creation events at a target rate and
+reports:
+
+  - ack latency as Strava sees it, and as the handler reports it in Server-Timing
+  - event to email latency, from posting an event to its reminder reaching the sink
+  - worker throughput, from the first event queued to the last task finished
+  - database queries per event, web and worker together
+
+Every event is a run with the athlete's default shoe, so each should end in
+one email. The stand-ins run in this process, so their threads share the GIL
+with the app under test; compare runs made with the same options.
+
+    source secrets.sh
+    python3 benchmarks/webhook-load.py --rate 50 --duration 20 --workers 8
+    python3 benchmarks/webhook-load.py --rate 50 --duration 20 --json results.json
+"""
+
+import argparse
+import email
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from celery.contrib.testing.worker import start_worker
+from celery.signals import task_postrun
+from sqlalchemy import event, insert
+from werkzeug.serving import make_server
+from app import celery, constants, create_app, db, mail_dispatcher
+from app.model import AccessToken, RefreshToken, Shoe, ShoeDefault, User
+from benchmarks.standins.smtp import SMTPSink
+from benchmarks.standins.strava import FakeStrava, default_activity
+from config import Config
+
+# activity IDs are athlete * ACTIVITY_ID_BASE + the athlete's event number
+ACTIVITY_ID_BASE = 1_000_000
+FIRST_DAY = date(2023, 1, 1)
+
+def load_activity(activity_id):
+    """A run with the athlete's default shoe, dated by the athlete's event number so every reminder is distinct."""
+    athlete, number = divmod(activity_id, ACTIVITY_ID_BASE)
+    day = FIRST_DAY + timedelta(days=number % 365)
+    return {**default_activity(activity_id), 'gear_id': f'g{athlete}', 'start_date_local': f'{day:%Y-%m-%d}T07:00:00Z'}
+
+def make_event(n, athletes):
+    """Build the nth activity creation event, spread over the athletes."""
+    athlete, number = n % athletes + 1, n // athletes
+    return {'object_type': 'activity', 'object_id': athlete * ACTIVITY_ID_BASE + number, 'aspect_type': 'create',
+            'owner_id': athlete, 'subscription_id': 1, 'event_time': int(time.time()), 'updates': {}}
+
+def reminder_key(athlete, number):
+    """The recipient and subject date identifying the reminder for an athlete's event."""
+    return f'runner{athlete}@example.com', f'{FIRST_DAY + timedelta(days=number % 365):%m/%d}'
+
+def seed(athletes, expired_share):
+    """Insert athletes with a default shoe for runs and tokens, some of them due for refresh."""
+    ids = range(1, athletes + 1)
+    expired = set(ids[:int(athletes * expired_share)])
+    db.session.execute(insert(User), [{'id': i, 'strava_id': i, 'email': f'runner{i}@example.com',
+                                       'created_on': datetime.now(), 'email_consent': True} for i in ids])
+    db.session.execute(insert(Shoe), [{'id': i, 'strava_gear_id': f'g{i}', 'name': f'shoe {i}', 'retired': False,
+                                       'user_id': i} for i in ids])
+    db.session.execute(insert(ShoeDefault), [{'user_id': i, 'shoe_id': i, 'sport_type': 'Run'} for i in ids])
+    db.session.execute(insert(AccessToken), [{'code': f'a{i}', 'user_id': i,
+                                              'expires_at': datetime.now() + (timedelta(0) if i in expired else timedelta(hours=6))}
+                                             for i in ids])
+    db.session.execute(insert(RefreshToken), [{'code': f'r{i}', 'user_id': i} for i in ids])
+    db.session.commit()
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of samples."""
+    samples = sorted(samples)
+    if not samples:
+        return float('nan')
+    return samples[min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))]
+
+def post_events(url, count, rate, athletes):
+    """Post count events at rate per second, open loop, and return (sent_at, ack_ms, server_ms, status) per event."""
+    local = threading.local()
+    results = [None] * count
+
+    def post(n):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        sent_at = time.time()
+        started = time.perf_counter()
+        response = local.session.post(url, json=make_event(n, athletes))
+        ack_ms = (time.perf_counter() - started) * 1000
+        server_timing = response.headers.get('Server-Timing', '')
+        server_ms = float(server_timing.split('dur=')[1]) if 'dur=' in server_timing else float('nan')
+        results[n] = (sent_at, ack_ms, server_ms, response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        for n in range(count):
+            # open loop: events go out on schedule however slowly earlier ones are acknowledged
+            delay = started + n / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(post, n)
+    return results
+
+def wait_for(condition, timeout):
+    """Wait until condition() is true or timeout seconds pass; return whether it became true."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=50, help='events per second')
+    parser.add_argument('--duration', type=float, default=20, help='seconds to send events for')
+    parser.add_argument('--athletes', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8, help='Celery worker threads')
+    parser.add_argument('--strava-latency', type=float, default=0.15)
+    parser.add_argument('--strava-limits', default='100000,1000000', help='short and daily limits, e.g. 600,30000')
+    parser.add_argument('--smtp-latency', type=float, default=0.01, help='seconds to accept each message')
+    parser.add_argument('--expired-share', type=float, default=0.0, help='share of athletes whose token needs refreshing')
+    parser.add_argument('--database-url', help='a scratch database; its tables are dropped and recreated')
+    parser.add_argument('--drain-timeout', type=float, default=120)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+    count = int(args.rate * args.duration)
+
+    strava = FakeStrava(latency=args.strava_latency, limits=tuple(map(int, args.strava_limits.split(','))),
+                        activity=load_activity).start()
+    strava.use(constants)
+    sink = SMTPSink(message_latency=args.smtp_latency).start()
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url or f'sqlite:///{tempfile.mkdtemp()}/load.db'
+        SQLALCHEMY_ECHO = False
+        CELERY_BROKER_URL = 'memory://'
+        BROKER_TRANSPORT_OPTIONS = {'polling_interval': 0.01}
+        MAIL_SERVER = '127.0.0.1'
+        MAIL_PORT = sink.port
+        MAIL_USE_SSL = False
+        DEDUPE_BACKEND = 'memory'
+        RATE_LIMIT_BACKEND = 'memory'
+        TOKEN_LOCK_BACKEND = 'memory'
+        ATHLETE_CACHE_BACKEND = 'memory'
+        GEAR_CHECK_BACKEND = 'memory'
+        GEAR_CACHE_BACKEND = 'memory'
+        ADMISSION_ENABLED = False
+
+    app = create_app(BenchmarkConfig)
+    celery.log.setup(loglevel='WARNING')
+    app.logger.setLevel('WARNING')
+    logging.getLogger('werkzeug').setLevel('WARNING')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.athletes, args.expired_share)
+        queries = itertools.count()
+        event.listen(db.engine, 'before_cursor_execute', lambda *_: next(queries))
+    finished = []
+    task_postrun.connect(lambda **_: finished.append(time.time()), weak=False)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/webhook'
+
+    with start_worker(celery, pool='threads', concurrency=args.workers, perform_ping_check=False, loglevel='WARNING'):
+        print(f"sending {count} events at {args.rate:g}/s to {url}")
+        # send_email prints each recipient
+        sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+        try:
+            acks = post_events(url, count, args.rate, args.athletes)
+            drained = wait_for(lambda: len(finished) >= count, args.drain_timeout)
+            wait_for(lambda: len(sink.messages) >= count, 5)
+        finally:
+            sys.stdout = stdout
+    query_count = next(queries)
+    server.shutdown()
+    with app.app_context():
+        mail_dispatcher.close()
+    sink.stop()
+    strava.stop()
+
+    sent_at = {reminder_key(*divmod(make_event(n, args.athletes)['object_id'], ACTIVITY_ID_BASE)): acks[n][0]
+               for n in range(count)}
+    email_ms = []
+    for received_at, recipients, data in list(sink.messages):
+        subject = email.message_from_bytes(data)['Subject'] or ''
+        key = (recipients[0], subject.rsplit(' ', 1)[-1])
+        if key in sent_at:
+            email_ms.append((received_at - sent_at[key]) * 1000)
+    first_sent = min(ack[0] for ack in acks)
+    results = {
+        'events': count,
+        'rate': args.rate,
+        'achieved_rate': count / (max(ack[0] for ack in acks) - first_sent) if count > 1 else 0.0,
+        'errors': sum(1 for ack in acks if ack[3] != 200),
+        'ack_ms_p50': percentile([ack[1] for ack in acks], 50),
+        'ack_ms_p99': percentile([ack[1] for ack in acks], 99),
+        'handler_ms_p50': percentile([ack[2] for ack in acks], 50),
+        'handler_ms_p99': percentile([ack[2] for ack in acks], 99),
+        'emails': len(email_ms),
+        'email_ms_p50': percentile(email_ms, 50),
+        'email_ms_p99': percentile(email_ms, 99),
+        'processed': len(finished),
+        'drained': drained,
+        'worker_events_per_s': len(finished) / (max(finished) - first_sent) if finished else 0.0,
+        'queries_per_event': query_count / count,
+        'strava_calls': strava.calls,
+        'token_exchanges': strava.token_exchanges,
+        'smtp_connections': sink.connections,
+    }
+
+    print(f"events:             {count} at {args.rate:g}/s target, {results['achieved_rate']:.1f}/s sent, {results['errors']} errors")
+    print(f"ack latency:        p50 {results['ack_ms_p50']:.2f}ms  p99 {results['ack_ms_p99']:.2f}ms"
+          f"  (handler p50 {results['handler_ms_p50']:.2f}ms  p99 {results['handler_ms_p99']:.2f}ms)")
+    print(f"event to email:     p50 {results['email_ms_p50']:.0f}ms  p99 {results['email_ms_p99']:.0f}ms"
+          f"  ({results['emails']} of {count} emails)")
+    print(f"worker throughput:  {results['worker_events_per_s']:.1f} events/s with {args.workers} threads"
+          f"{'' if drained else ' (not drained before the timeout)'}")
+    print(f"database:           {results['queries_per_event']:.2f} queries/event")
+    print(f"strava:             {results['strava_calls']} calls, {results['token_exchanges']} token exchanges;"
+          f" smtp: {results['smtp_connections']} connections")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Benchmark event throughput of a prefork worker process against an asyncio worker process.
+
+Runs the Strava and SMTP stand-ins in a separate process, with latencies
+like the real services, and processes the same number of activity creation
+events in this process: one at a time, as a Celery prefork child does, then
+concurrently on an AsyncEventWorker. Reports events per second of wall time
+and per second of CPU time, i.e. per core kept busy.
+
+    source secrets.sh
+    python3 benchmarks/worker-modes.py --events 1000 --strava-latency 0.15 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import insert
+from app import constants, create_app, db, mail_dispatcher
+from app.gear import helpers
+from app.gear.aioworker import AsyncEventWorker
+from app.model import AccessToken, Shoe, ShoeDefault, User
+from benchmarks.standins.smtp import SMTPSink
+from benchmarks.standins.strava import FakeStrava, default_activity
+from config import Config
+
+def athlete_activity(activity_id):
+    """An activity of athlete activity_id // 1_000_000, half of them with their default shoe."""
+    return {**default_activity(activity_id), 'gear_id': f'g{activity_id // 1_000_000}' if activity_id % 2 else 'other'}
+
+def serve_standins(strava_latency, message_latency, ports):
+    """Run the stand-ins until the parent process exits."""
+    strava = FakeStrava(latency=strava_latency, activity=athlete_activity).start()
+    sink = SMTPSink(message_latency=message_latency).start()
+    ports.put((strava.port, sink.port))
+    while True:
+        time.sleep(60)
+
+def seed(athletes):
+    """Insert athletes with a default shoe for runs and a valid access token each."""
+    ids = range(1, athletes + 1)
+    db.session.execute(insert(User), [{'id': i, 'strava_id': i, 'email': f'runner{i}@example.com',
+                                       'created_on': datetime.now(), 'email_consent': True} for i in ids])
+    db.session.execute(insert(Shoe), [{'id': i, 'strava_gear_id': f'g{i}', 'name': f'shoe {i}', 'retired': False,
+                                       'user_id': i} for i in ids])
+    db.session.execute(insert(ShoeDefault), [{'user_id': i, 'shoe_id': i, 'sport_type': 'Run'} for i in ids])
+    db.session.execute(insert(AccessToken), [{'code': f'a{i}', 'expires_at': datetime.now() + timedelta(hours=6),
+                                              'user_id': i} for i in ids])
+    db.session.commit()
+
+def make_events(count, athletes, offset):
+    """Build activity creation events spread over the athletes, with activity IDs starting at offset."""
+    events = []
+    for n in range(count):
+        owner = n % athletes + 1
+        events.append({'object_type': 'activity', 'object_id': owner * 1_000_000 + offset + n, 'aspect_type': 'create',
+                       'owner_id': owner, 'subscription_id': 1, 'event_time': int(time.time()), 'updates': {}})
+    return events
+
+def measure(run):
+    """Return the wall and CPU seconds run() takes."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    # send_email prints each recipient
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--athletes', type=int, default=100)
+    parser.add_argument('--strava-latency', type=float, default=0.15)
+    parser.add_argument('--smtp-latency', type=float, default=0.01)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--prefork-events', type=int, help='events for the prefork run, which is slow (default: --events / 5)')
+    args = parser.parse_args()
+    prefork_events = args.prefork_events or max(1, args.events // 5)
+
+    ports = multiprocessing.Queue()
+    standins = multiprocessing.Process(target=serve_standins, args=(args.strava_latency, args.smtp_latency, ports), daemon=True)
+    standins.start()
+    strava_port, smtp_port = ports.get()
+    constants.BASE_URL = f'http://127.0.0.1:{strava_port}/api/v3'
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tempfile.mkdtemp()}/workers.db'
+        SQLALCHEMY_ECHO = False
+        MAIL_SERVER = '127.0.0.1'
+        MAIL_PORT = smtp_port
+        MAIL_USE_SSL = False
+        DEDUPE_BACKEND = 'memory'
+        RATE_LIMIT_BACKEND = 'memory'
+        TOKEN_LOCK_BACKEND = 'memory'
+        ATHLETE_CACHE_BACKEND = 'memory'
+        GEAR_CHECK_BACKEND = 'memory'
+        GEAR_CACHE_BACKEND = 'memory'
+        ADMISSION_ENABLED = False
+        STRAVA_SHORT_LIMIT = 100000
+        STRAVA_DAILY_LIMIT = 1000000
+
+    app = create_app(BenchmarkConfig)
+    app.logger.setLevel('WARNING')
+    results = {}
+    with app.app_context():
+        db.create_all()
+        seed(args.athletes)
+
+        events = make_events(prefork_events, args.athletes, 0)
+        results['prefork (one event at a time)'] = (len(events), *measure(lambda: [helpers.process_new_event(data) for data in events]))
+
+        events = make_events(args.events, args.athletes, 500_000)
+        async def work():
+            async with AsyncEventWorker(app, args.concurrency) as worker:
+                await worker.process_events(events)
+        results[f'asyncio ({args.concurrency} in flight)'] = (len(events), *measure(lambda: asyncio.run(work())))
+        mail_dispatcher.close()
+    standins.terminate()
+
+    print(f"Strava latency {args.strava_latency * 1000:.0f}ms, SMTP latency {args.smtp_latency * 1000:.0f}ms per message")
+    print(f"{'mode':<34}{'events':>8}{'events/s':>12}{'events/cpu-s':>15}")
+    for name, (count, wall, cpu) in results.items():
+        print(f"{name:<34}{count:>8}{count / wall:>12.1f}{count / cpu:>15.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Benchmark how quickly a fresh worker process is ready, and how long its first event takes.
+
+Starts new Python processes the way a scaled-up worker starts, each
+bootstrapping the app for the web or the worker role, and reports the medians of:
+
+  - interpreter: from spawning the process to running this script
+  - app: importing the app package, creating the app and importing the task modules, as a Celery worker does
+    at startup; both roles import the same package, so they differ only in what create_app sets up
+  - first event: processing an activity creation event against local Strava and SMTP stand-ins
+  - next event: processing a second event, for comparison with the first
+
+    python3 benchmarks/worker-startup.py --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+PHASES = ('interpreter', 'app', 'first event', 'next event')
+
+def make_event(activity_id):
+    """An activity creation event for the first athlete."""
+    return {'object_type': 'activity', 'object_id': activity_id, 'aspect_type': 'create', 'owner_id': 1,
+            'subscription_id': 1, 'event_time': int(time.time()), 'updates': {}}
+
+def child(role, spawned_at, database, strava_url, smtp_port, activity_id):
+    """Bootstrap the app for role, process two events, and print the time each phase took."""
+    started = time.time()
+    import config
+    from app import celery, constants, create_app
+    from app.gear import helpers
+
+    class BenchmarkConfig(config.TestConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{database}'
+        MAIL_SERVER = '127.0.0.1'
+        MAIL_PORT = smtp_port
+        MAIL_USE_SSL = False
+
+    create_app(BenchmarkConfig, role=role)
+    celery.loader.import_default_modules()
+    constants.BASE_URL = strava_url
+    ready = time.time()
+    # send_email prints each recipient
+    sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+    try:
+        helpers.process_new_event.apply(args=(make_event(activity_id),))
+        first = time.time()
+        helpers.process_new_event.apply(args=(make_event(activity_id + 1),))
+        second = time.time()
+    finally:
+        sys.stdout = stdout
+    print(json.dumps([started - spawned_at, ready - started, first - ready, second - first]))
+
+def seed(database):
+    """Create the database with one athlete, their default shoe for runs and a valid access token."""
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert
+    import config
+    from app import create_app, db
+    from app.model import AccessToken, Shoe, ShoeDefault, User
+
+    class SeedConfig(config.TestConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{database}'
+
+    with create_app(SeedConfig, role='worker').app_context():
+        db.create_all()
+        db.session.execute(insert(User), [{'id': 1, 'strava_id': 1, 'email': 'runner@example.com',
+                                           'created_on': datetime.now(), 'email_consent': True}])
+        db.session.execute(insert(Shoe), [{'id': 1, 'strava_gear_id': 'g1', 'name': 'Daily Trainer', 'retired': False,
+                                           'user_id': 1}])
+        db.session.execute(insert(ShoeDefault), [{'user_id': 1, 'shoe_id': 1, 'sport_type': 'Run'}])
+        db.session.execute(insert(AccessToken), [{'code': 'a1', 'expires_at': datetime.now() + timedelta(hours=6),
+                                                  'user_id': 1}])
+        db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='processes to start for each role')
+    parser.add_argument('--strava-latency', type=float, default=0.15)
+    parser.add_argument('--child', nargs=6, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        role, spawned_at, database, strava_url, smtp_port, activity_id = args.child
+        child(role, float(spawned_at), database, strava_url, int(smtp_port), int(activity_id))
+        return
+
+    from benchmarks.standins.smtp import SMTPSink
+    from benchmarks.standins.strava import FakeStrava
+    strava = FakeStrava(latency=args.strava_latency).start()
+    sink = SMTPSink().start()
+    database = f'{tempfile.mkdtemp()}/startup.db'
+    seed(database)
+
+    results = {}
+    activity_ids = iter(range(1000, 10 ** 9, 10))
+    for role in ('web', 'worker'):
+        runs = []
+        for _ in range(args.runs):
+            command = [sys.executable, __file__, '--child', role, repr(time.time()), database, strava.base_url,
+                       str(sink.port), str(next(activity_ids))]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(output.splitlines()[-1]))
+        results[role] = [statistics.median(phase) for phase in zip(*runs)]
+    sink.stop()
+    strava.stop()
+
+    print(f"medians of {args.runs} processes, Strava latency {args.strava_latency * 1000:.0f}ms")
+    print(f"{'bootstrap':<10}" + ''.join(f'{phase:>14}' for phase in PHASES) + f"{'to ready':>12}")
+    for role, phases in results.items():
+        print(f"{role:<10}" + ''.join(f'{seconds * 1000:>12.0f}ms' for seconds in phases)
+              + f"{sum(phases[:2]) * 1000:>10.0f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,176 @@
 import os
 
 class Config:
+    """Settings shared by every profile."""
     SECRET_KEY = os.environ.get('FLASK_KEY')
-    SQLALCHEMY_DATABASE_URI = 'postgresql:///gearupdaterdb'
-    SQLALCHEMY_ECHO = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///gearupdaterdb')
+    SQLALCHEMY_ECHO = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # database connection pool per process, chosen by create_app's role; empty leaves SQLAlchemy's defaults
+    WEB_ENGINE_OPTIONS = {}
+    WORKER_ENGINE_OPTIONS = {}
+    LOG_LEVEL = 'INFO'
     MAIL_SERVER = 'smtp.gmail.com'
     MAIL_PORT = 465
-    MAIL_USERNAME = os.environ['SENDING_ADDRESS']
-    MAIL_PASSWORD = os.environ['EMAIL_PASS']
+    MAIL_USERNAME = os.environ.get('SENDING_ADDRESS')
+    MAIL_PASSWORD = os.environ.get('EMAIL_PASS')
     MAIL_USE_TLS = False
     MAIL_USE_SSL = True
-    CELERY_BROKER_URL = 'redis://localhost'
\ No newline at end of file
+    CELERY_BROKER_URL = 'redis://localhost'
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost')
+    # webhook deliveries already seen are remembered for a day ('redis' or 'memory')
+    DEDUPE_BACKEND = 'redis'
+    DEDUPE_TTL = 24 * 60 * 60
+    DEDUPE_MAX_EVENTS = 100000
+    # pooled keep-alive connections to Strava, with retries for idempotent calls
+    STRAVA_POOL_SIZE = int(os.environ.get('STRAVA_POOL_SIZE', 10))
+    STRAVA_CONNECT_TIMEOUT = 3.05
+    STRAVA_READ_TIMEOUT = 10
+    STRAVA_MAX_RETRIES = 3
+    STRAVA_RETRY_BACKOFF = 0.5
+    # Strava's per-app limits; low priority calls leave the rest for webhook events ('redis' or 'memory')
+    RATE_LIMIT_BACKEND = 'redis'
+    STRAVA_SHORT_LIMIT = 100
+    STRAVA_DAILY_LIMIT = 1000
+    RATE_LIMIT_LOW_PRIORITY_SHARE = 0.8
+    # access tokens are cached per process and refreshed under a per-user lock ('redis' or 'memory')
+    TOKEN_CACHE_BACKEND = 'memory'
+    TOKEN_CACHE_MAX_USERS = 10000
+    TOKEN_LOCK_BACKEND = 'redis'
+    TOKEN_LOCK_TIMEOUT = 30
+    # how long a process outside an athlete's partition waits for it to refresh their tokens;
+    # web requests wait too, so it's short
+    TOKEN_PARTITION_WAIT = 3
+    TOKEN_REFRESH_MARGIN = 5 * 60
+    # the sweeper refreshes tokens expiring within the next half hour, every 10 minutes
+    TOKEN_SWEEP_WINDOW = 30 * 60
+    # athletes' email and default shoe, cached in process and optionally in Redis ('redis' or 'memory')
+    ATHLETE_CACHE_BACKEND = 'redis'
+    ATHLETE_CACHE_MAX_ATHLETES = 10000
+    ATHLETE_CACHE_LOCAL_TTL = 60
+    ATHLETE_CACHE_TTL = 24 * 60 * 60
+    # new activities are checked GEAR_CHECK_DELAY seconds after they're created, so gear fixed in
+    # the meantime costs no fetch or reminder; 0 checks straight away ('redis' or 'memory')
+    GEAR_CHECK_DELAY = 0
+    GEAR_CHECK_BACKEND = 'redis'
+    GEAR_CHECK_GRACE = 60 * 60
+    GEAR_CHECK_MAX_PENDING = 100000
+    # the shoes athletes have on Strava, cached for the gear pages: refreshed in the background once
+    # older than GEAR_CACHE_MAX_AGE, fetched while the page waits once gone ('redis' or 'memory');
+    # the refresh job goes round the athletes with an activity in the last GEAR_REFRESH_ACTIVE_DAYS
+    # days, refreshing up to GEAR_REFRESH_BATCH_SIZE stale ones hourly
+    GEAR_CACHE_BACKEND = 'redis'
+    GEAR_CACHE_MAX_ATHLETES = 10000
+    GEAR_CACHE_MAX_AGE = 6 * 60 * 60
+    GEAR_CACHE_TTL = 7 * 24 * 60 * 60
+    GEAR_REFRESH_ACTIVE_DAYS = 14
+    GEAR_REFRESH_BATCH_SIZE = 100
+    # recently seen activities kept in process in front of the activities table
+    ACTIVITY_CACHE_MAX_ACTIVITIES = 10000
+    # total distance in meters at which a shoe's owner is told it may need replacing
+    SHOE_REPLACEMENT_DISTANCE = 800000
+    # historical backfill reads pages of this many activities, this many pages at a time
+    BACKFILL_PAGE_SIZE = 200
+    BACKFILL_CONCURRENCY = 4
+    # Prometheus metrics, served at /metrics to these addresses; set PROMETHEUS_MULTIPROC_DIR
+    # in the environment to combine the metrics of every worker process on the host
+    METRICS_ENABLED = True
+    METRICS_ALLOWED_ADDRS = ('127.0.0.1', '::1')
+    # how events are processed: 'prefork' Celery tasks one at a time per process, or 'asyncio'
+    # workers (async-worker.py) with up to ASYNC_WORKER_CONCURRENCY events in flight per process
+    WORKER_MODE = 'prefork'
+    ASYNC_WORKER_CONCURRENCY = 200
+    # threads an asyncio worker runs database, token and mail calls on, each holding a connection
+    # while it runs; no more than WORKER_ENGINE_OPTIONS' pool_size plus max_overflow
+    ASYNC_WORKER_THREADS = 3
+    ASYNC_EVENT_QUEUE = 'events:async'
+    # accepted events are written to the event_log table before they're queued, committed in
+    # groups of up to EVENT_LOG_BATCH_SIZE; events not processed within EVENT_LOG_LEASE seconds
+    # are queued again, up to EVENT_LOG_MAX_REQUEUES times, EVENT_LOG_SWEEP_LIMIT per sweep, unless
+    # the queues are past ADMISSION_DEFER_WATERMARK
+    EVENT_LOG_ENABLED = True
+    EVENT_LOG_BATCH_SIZE = 500
+    EVENT_LOG_LEASE = 10 * 60
+    EVENT_LOG_MAX_REQUEUES = 5
+    EVENT_LOG_SWEEP_LIMIT = 1000
+    # the webhook samples the worker queues' depth every ADMISSION_SAMPLE_INTERVAL seconds; past
+    # ADMISSION_DEFER_WATERMARK events, updates and deletes are queued at ADMISSION_LOW_PRIORITY
+    # (9 is lowest on Redis), and past ADMISSION_SPILL_WATERMARK events are only written to the
+    # event log, to be queued by beat as the depth falls back under the defer watermark
+    ADMISSION_ENABLED = True
+    ADMISSION_SAMPLE_INTERVAL = 1.0
+    ADMISSION_DEFER_WATERMARK = 10000
+    ADMISSION_SPILL_WATERMARK = 50000
+    ADMISSION_LOW_PRIORITY = 9
+    # with EVENT_PARTITIONS > 0, each athlete's events go to one of that many queues, each
+    # consumed by one worker process (see app/partitions.py); 0 uses Celery's default queue
+    EVENT_PARTITIONS = 0
+    EVENT_PARTITION_QUEUE = 'events.{}'
+    # modules with tasks, imported by workers at startup since worker apps have no views importing them
+    CELERY_IMPORTS = ('app.gear.helpers', 'app.tokens', 'app.gear.backfill', 'app.gear.replay',
+                    'app.gear.gearsync')
+    CELERYBEAT_SCHEDULE = {
+        'refresh-expiring-tokens': {'task': 'app.tokens.refresh_expiring_tokens', 'schedule': 10 * 60},
+        'requeue-stalled-events': {'task': 'app.gear.replay.requeue_stalled_events', 'schedule': 60},
+        'drain-spilled-events': {'task': 'app.gear.replay.drain_spilled_events', 'schedule': 10},
+        'refresh-active-gear': {'task': 'app.gear.gearsync.refresh_active_gear', 'schedule': 60 * 60},
+    }
+    # workers take one event at a time and acknowledge it once processed, so a busy
+    # child doesn't sit on prefetched events and a crashed one's event is redelivered
+    CELERYD_PREFETCH_MULTIPLIER = 1
+    CELERY_ACKS_LATE = True
+    CELERYD_CONCURRENCY = 4
+    # nothing reads task results
+    CELERY_IGNORE_RESULT = True
+    # task arguments are IDs and small enums, sent as msgpack; JSON is still read so messages
+    # queued by an older release drain
+    CELERY_TASK_SERIALIZER = 'msgpack'
+    CELERY_ACCEPT_CONTENT = ['msgpack', 'json']
+    # workers take higher priority messages first, so deferred events wait behind new activities
+    BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority'}
+
+class DevConfig(Config):
+    """Local development: every SQL statement logged, a small pool and few workers."""
+    SQLALCHEMY_ECHO = True
+    LOG_LEVEL = 'DEBUG'
+    WEB_ENGINE_OPTIONS = {'pool_size': 2, 'max_overflow': 5, 'pool_pre_ping': True}
+    WORKER_ENGINE_OPTIONS = {'pool_size': 1, 'max_overflow': 2, 'pool_pre_ping': True}
+    CELERYD_CONCURRENCY = 2
+
+class TestConfig(Config):
+    """Unit tests: SQLite and in-process stand-ins for Redis and the broker."""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    LOG_LEVEL = 'WARNING'
+    CELERY_BROKER_URL = 'memory://'
+    CELERYD_CONCURRENCY = 1
+    DEDUPE_BACKEND = 'memory'
+    RATE_LIMIT_BACKEND = 'memory'
+    TOKEN_LOCK_BACKEND = 'memory'
+    ATHLETE_CACHE_BACKEND = 'memory'
+    GEAR_CHECK_BACKEND = 'memory'
+    GEAR_CACHE_BACKEND = 'memory'
+    ADMISSION_ENABLED = False
+
+class ProdConfig(Config):
+    """Production: pools sized per process and recycled before the server drops idle connections."""
+    LOG_LEVEL = 'INFO'
+    # the web app serves requests on several threads
+    WEB_ENGINE_OPTIONS = {'pool_size': 10, 'max_overflow': 10, 'pool_timeout': 5, 'pool_pre_ping': True,
+                          'pool_recycle': 30 * 60}
+    # a prefork child runs one task at a time; raise these for thread or gevent pools
+    WORKER_ENGINE_OPTIONS = {'pool_size': 1, 'max_overflow': 2, 'pool_timeout': 5, 'pool_pre_ping': True,
+                             'pool_recycle': 30 * 60}
+    # most athletes who fix their gear do so within minutes of syncing
+    GEAR_CHECK_DELAY = 10 * 60
+    # events mostly wait on Strava and SMTP, so run more children than cores
+    CELERYD_CONCURRENCY = int(os.environ.get('CELERY_CONCURRENCY', 2 * (os.cpu_count() or 1)))
+
+PROFILES = {'dev': DevConfig, 'test': TestConfig, 'prod': ProdConfig}
+
+def config_for_env(env=None):
+    """Return the config profile named by APP_ENV, 'dev' if unset."""
+    env = env or os.environ.get('APP_ENV', 'dev')
+    if env not in PROFILES:
+        raise ValueError(f"APP_ENV must be one of {', '.join(PROFILES)}, not {env!r}")
+    return PROFILES[env]
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""Script to apply schema migrations to an existing database.
+
+Runs each migrations/*.sql file that hasn't been applied yet, in file name
+order, and records it in the schema_migrations table. New databases created
+from the models already have the latest schema and only need to be marked:
+
+    source secrets.sh
+    python3 migrate-database.py            # apply pending migrations
+    python3 migrate-database.py --mark     # record all migrations as applied
+"""
+
+import argparse
+import os
+from sqlalchemy import text
+from app import create_app, db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+def pending_migrations(connection):
+    """Return the names of migration files not yet applied, in order."""
+    connection.execute(text('CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR PRIMARY KEY, applied_on TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'))
+    applied = {name for name, in connection.execute(text('SELECT name FROM schema_migrations'))}
+    return [name for name in sorted(os.listdir(MIGRATIONS_DIR)) if name.endswith('.sql') and name not in applied]
+
+def migrate(mark_only=False):
+    """Apply each pending migration in its own transaction."""
+    with db.engine.connect() as connection:
+        names = pending_migrations(connection)
+        connection.commit()
+        for name in names:
+            with connection.begin():
+                if not mark_only:
+                    with open(os.path.join(MIGRATIONS_DIR, name)) as migration:
+                        connection.exec_driver_sql(migration.read())
+                connection.execute(text('INSERT INTO schema_migrations (name) VALUES (:name)'), {'name': name})
+            print(f"{'marked' if mark_only else 'applied'} {name}")
+    if not names:
+        print("database is up to date")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply schema migrations.')
+    parser.add_argument('--mark', action='store_true', help='record migrations as applied without running them')
+    args = parser.parse_args()
+    app = create_app()
+    with app.app_context():
+        migrate(mark_only=args.mark)
@@ -0,0 +1,17 @@
+-- Indexes and uniqueness constraints for the lookups on the webhook path.
+
+-- keep the newest row where duplicates would violate the new constraints
+DELETE FROM access_tokens a USING access_tokens b WHERE a.user_id = b.user_id AND a.id < b.id;
+DELETE FROM refresh_tokens a USING refresh_tokens b WHERE a.user_id = b.user_id AND a.id < b.id;
+DELETE FROM shoes a USING shoes b WHERE a.strava_gear_id = b.strava_gear_id AND a.id < b.id;
+UPDATE shoes SET run_default = false
+    WHERE run_default AND id NOT IN (SELECT max(id) FROM shoes WHERE run_default GROUP BY user_id);
+
+-- not unique yet: the old login flow left duplicate athletes, which held/merge-duplicate-users.sql merges
+CREATE INDEX IF NOT EXISTS ix_users_strava_id ON users (strava_id);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_shoes_strava_gear_id ON shoes (strava_gear_id);
+CREATE INDEX IF NOT EXISTS ix_shoes_user_id ON shoes (user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_shoes_user_id_run_default ON shoes (user_id) WHERE run_default;
+CREATE UNIQUE INDEX IF NOT EXISTS ix_access_tokens_user_id ON access_tokens (user_id);
+CREATE INDEX IF NOT EXISTS ix_access_tokens_expires_at ON access_tokens (expires_at);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_refresh_tokens_user_id ON refresh_tokens (user_id);
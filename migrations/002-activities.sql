@@ -0,0 +1,11 @@
+-- Local store of the activity fields the gear checker needs.
+
+CREATE TABLE IF NOT EXISTS activities (
+    strava_activity_id BIGINT PRIMARY KEY,
+    user_id INTEGER REFERENCES users (id),
+    gear_id VARCHAR,
+    sport_type VARCHAR,
+    start_date_local TIMESTAMP,
+    fetched_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_activities_user_id ON activities (user_id);
@@ -0,0 +1,9 @@
+-- Resumable progress of historical activity backfills.
+
+CREATE TABLE IF NOT EXISTS backfill_cursors (
+    user_id INTEGER PRIMARY KEY REFERENCES users (id),
+    next_page INTEGER NOT NULL DEFAULT 1,
+    matched INTEGER NOT NULL DEFAULT 0,
+    completed_on TIMESTAMP,
+    updated_on TIMESTAMP
+);
@@ -0,0 +1,18 @@
+-- Default shoes per sport type, replacing the single shoes.run_default flag.
+
+CREATE TABLE IF NOT EXISTS shoe_defaults (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    shoe_id INTEGER NOT NULL REFERENCES shoes (id),
+    sport_type VARCHAR NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_shoe_defaults_user_id_sport_type ON shoe_defaults (user_id, sport_type);
+CREATE INDEX IF NOT EXISTS ix_shoe_defaults_shoe_id ON shoe_defaults (shoe_id);
+
+-- existing default shoes become the default for runs
+INSERT INTO shoe_defaults (user_id, shoe_id, sport_type)
+    SELECT user_id, id, 'Run' FROM shoes WHERE run_default
+    ON CONFLICT DO NOTHING;
+
+DROP INDEX IF EXISTS ix_shoes_user_id_run_default;
+ALTER TABLE shoes DROP COLUMN IF EXISTS run_default;
@@ -0,0 +1,36 @@
+-- Running totals per shoe, overall and by week, maintained as activities are stored.
+
+ALTER TABLE activities ADD COLUMN IF NOT EXISTS distance DOUBLE PRECISION;
+ALTER TABLE activities ADD COLUMN IF NOT EXISTS moving_time INTEGER;
+
+CREATE TABLE IF NOT EXISTS shoe_stats (
+    gear_id VARCHAR PRIMARY KEY,
+    distance DOUBLE PRECISION NOT NULL DEFAULT 0,
+    moving_time INTEGER NOT NULL DEFAULT 0,
+    activity_count INTEGER NOT NULL DEFAULT 0,
+    replacement_alerted_on TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS shoe_weekly_stats (
+    gear_id VARCHAR NOT NULL,
+    week_start DATE NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    distance DOUBLE PRECISION NOT NULL DEFAULT 0,
+    moving_time INTEGER NOT NULL DEFAULT 0,
+    activity_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (gear_id, week_start)
+);
+CREATE INDEX IF NOT EXISTS ix_shoe_weekly_stats_user_id_week_start ON shoe_weekly_stats (user_id, week_start);
+
+-- seed the totals from activities already stored; their distances fill in as they're refetched or backfilled
+INSERT INTO shoe_stats (gear_id, distance, moving_time, activity_count)
+    SELECT gear_id, COALESCE(SUM(distance), 0), COALESCE(SUM(moving_time), 0), COUNT(*)
+    FROM activities WHERE gear_id IS NOT NULL GROUP BY gear_id
+    ON CONFLICT DO NOTHING;
+
+INSERT INTO shoe_weekly_stats (gear_id, week_start, user_id, distance, moving_time, activity_count)
+    SELECT gear_id, date_trunc('week', start_date_local)::date, user_id,
+           COALESCE(SUM(distance), 0), COALESCE(SUM(moving_time), 0), COUNT(*)
+    FROM activities WHERE gear_id IS NOT NULL AND start_date_local IS NOT NULL
+    GROUP BY gear_id, date_trunc('week', start_date_local)::date, user_id
+    ON CONFLICT DO NOTHING;
@@ -0,0 +1,17 @@
+-- Append-only log of accepted webhook events, claimed by the workers that process them.
+
+CREATE TABLE IF NOT EXISTS event_log (
+    id BIGSERIAL PRIMARY KEY,
+    received_at TIMESTAMP NOT NULL,
+    owner_id BIGINT NOT NULL,
+    object_id BIGINT NOT NULL,
+    aspect_type VARCHAR NOT NULL,
+    payload JSON NOT NULL,
+    claimed_by VARCHAR,
+    claimed_at TIMESTAMP,
+    processed_at TIMESTAMP,
+    requeues INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_event_log_received_at ON event_log (received_at);
+-- the sweeper only looks for events not yet processed, a small share of the log
+CREATE INDEX IF NOT EXISTS ix_event_log_unprocessed ON event_log (received_at) WHERE processed_at IS NULL;
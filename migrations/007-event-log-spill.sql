@@ -0,0 +1,5 @@
+-- Events the webhook only logged because the worker queues were too deep, until they're queued.
+
+ALTER TABLE event_log ADD COLUMN IF NOT EXISTS spilled BOOLEAN NOT NULL DEFAULT FALSE;
+-- drained in log order, and rarely more than a backlog's worth
+CREATE INDEX IF NOT EXISTS ix_event_log_spilled ON event_log (id) WHERE spilled;
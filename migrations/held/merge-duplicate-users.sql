@@ -0,0 +1,30 @@
+-- HELD BACK: untested, never run against Postgres. Run it on a copy of the production database and
+-- check the merged athletes before applying it for real, after migrations 001 to 007.
+
+-- the old login flow could create a row per login for the same athlete: keep each athlete's newest
+-- row, move the older rows' shoes and activities to it, and keep an email only an older row had
+CREATE TEMPORARY TABLE user_merges AS
+    SELECT u.id AS old_id, k.id AS kept_id
+    FROM users u JOIN (SELECT strava_id, max(id) AS id FROM users WHERE strava_id IS NOT NULL
+                       GROUP BY strava_id HAVING count(*) > 1) k
+        ON u.strava_id = k.strava_id AND u.id <> k.id;
+CREATE TEMPORARY TABLE user_merge_emails AS
+    SELECT DISTINCT ON (m.kept_id) m.kept_id, u.email, u.email_consent
+    FROM user_merges m JOIN users u ON u.id = m.old_id
+    WHERE u.email IS NOT NULL ORDER BY m.kept_id, m.old_id DESC;
+UPDATE shoes SET user_id = m.kept_id FROM user_merges m WHERE shoes.user_id = m.old_id;
+UPDATE activities SET user_id = m.kept_id FROM user_merges m WHERE activities.user_id = m.old_id;
+UPDATE shoe_weekly_stats SET user_id = m.kept_id FROM user_merges m WHERE shoe_weekly_stats.user_id = m.old_id;
+-- tokens, defaults and backfill progress are the newest row's; the older rows' would collide with them
+DELETE FROM access_tokens WHERE user_id IN (SELECT old_id FROM user_merges);
+DELETE FROM refresh_tokens WHERE user_id IN (SELECT old_id FROM user_merges);
+DELETE FROM shoe_defaults WHERE user_id IN (SELECT old_id FROM user_merges);
+DELETE FROM backfill_cursors WHERE user_id IN (SELECT old_id FROM user_merges);
+DELETE FROM users WHERE id IN (SELECT old_id FROM user_merges);
+UPDATE users SET email = e.email, email_consent = e.email_consent
+    FROM user_merge_emails e WHERE users.id = e.kept_id AND users.email IS NULL;
+DROP TABLE user_merges, user_merge_emails;
+
+-- with the duplicates merged, users.strava_id can be unique, as the model declares it
+DROP INDEX IF EXISTS ix_users_strava_id;
+CREATE UNIQUE INDEX ix_users_strava_id ON users (strava_id);
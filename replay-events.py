@@ -0,0 +1,29 @@
+"""Script to queue webhook events from the event log again.
+
+Queues the events received in a time range for the workers, by default only
+those never processed, e.g. after an outage. With --include-processed every
+event in the range is processed again, e.g. after fixing how events are
+handled; athletes may then get a reminder again.
+
+    source secrets.sh
+    python3 replay-events.py --since 2024-02-16T06:00 --until 2024-02-16T09:00
+    python3 replay-events.py --since 2024-02-16 --until 2024-02-17 --strava-id 12345 --include-processed
+"""
+
+import argparse
+from datetime import datetime
+from app import create_app
+from app.gear.replay import replay_events
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Queue webhook events from the event log again.')
+    parser.add_argument('--since', type=datetime.fromisoformat, required=True, help='first receipt time, e.g. 2024-02-16T06:00')
+    parser.add_argument('--until', type=datetime.fromisoformat, default=datetime.now(), help='receipt time to stop before (default: now)')
+    parser.add_argument('--strava-id', type=int, help="only this athlete's events")
+    parser.add_argument('--include-processed', action='store_true', help='also queue events already processed')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        queued = replay_events(args.since, args.until, args.strava_id, args.include_processed)
+        print(f"queued {queued} events received from {args.since} until {args.until}")
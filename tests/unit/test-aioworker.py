@@ -0,0 +1,86 @@
+"""Unit tests for the asyncio event worker."""
+
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from app import constants, crud, db, strava
+
+pytest.importorskip('aiohttp')
+
+from app.eventqueue import TOKEN_REFRESH
+from app.gear.aioworker import AsyncEventWorker
+from app.ratelimit import RateLimitDeferred
+from benchmarks.standins.strava import FakeStrava, default_activity
+
+@pytest.fixture
+def athletes(app):
+    for n in range(1, 4):
+        user = crud.create_user(strava_id=n)
+        user.email = f'runner{n}@example.com'
+        db.session.add(user)
+        db.session.commit()
+        shoe = crud.create_shoe(f'g{n}', f'Trainer {n}', None, False, user.id)
+        db.session.add_all([shoe, crud.create_access_token('access', True, True, datetime.now() + timedelta(hours=6), user.id)])
+        db.session.commit()
+        crud.set_default_shoe(user, shoe.id, {'Run'})
+
+@pytest.fixture
+def fake_strava(monkeypatch):
+    # activities 100-199 are athlete 1's, 200-299 athlete 2's and so on; odd ones use another shoe
+    activity = lambda activity_id: {**default_activity(activity_id),
+                                     'gear_id': f'g{activity_id // 100}' if activity_id % 2 == 0 else 'other'}
+    fake = FakeStrava(latency=0.2, activity=activity).start()
+    monkeypatch.setattr(constants, 'BASE_URL', fake.base_url)
+    yield fake
+    fake.stop()
+
+def make_event(activity_id, aspect_type='create'):
+    return {'object_type': 'activity', 'object_id': activity_id, 'aspect_type': aspect_type,
+            'owner_id': activity_id // 100, 'subscription_id': 1, 'event_time': 1700000000, 'updates': {}}
+
+def process(app, events, concurrency=50):
+    async def work():
+        async with AsyncEventWorker(app, concurrency) as worker:
+            await worker.process_events(events)
+            return worker
+    return asyncio.run(work())
+
+def test_events_are_checked_concurrently(app, athletes, fake_strava, mocker):
+    send_email = mocker.patch('app.gear.helpers.send_email')
+    events = [make_event(owner * 100 + n) for owner in (1, 2, 3) for n in range(10)]
+    worker = process(app, events)
+    assert fake_strava.max_in_flight > 1
+    assert (worker.processed, worker.failed) == (30, 0)
+    assert fake_strava.calls == 30
+    assert send_email.call_count == 15
+    send_email.assert_any_call('runner2@example.com', 'run', 'Trainer 2', '02/16')
+    assert crud.get_activity(305).gear_id == 'other'
+
+def test_concurrency_is_bounded(app, athletes, fake_strava, mocker):
+    mocker.patch('app.gear.helpers.send_email')
+    worker = process(app, [make_event(100 + n) for n in range(4)], concurrency=2)
+    assert worker.processed == 4
+    assert fake_strava.max_in_flight <= 2
+
+def test_stored_activities_and_deletes_skip_strava(app, athletes, fake_strava, mocker):
+    mocker.patch('app.gear.helpers.send_email')
+    process(app, [make_event(100)])
+    process(app, [make_event(100), make_event(100, aspect_type='delete')])
+    assert fake_strava.calls == 1
+    assert crud.get_activity(100) is None
+
+def test_rate_limited_updates_wait_for_the_window(app, athletes, fake_strava, mocker):
+    mocker.patch('app.gear.helpers.send_email')
+    process(app, [make_event(100)])
+    sleep = mocker.patch('asyncio.sleep', new_callable=mocker.AsyncMock)
+    mocker.patch.object(strava.rate_limiter, 'acquire', side_effect=[RateLimitDeferred(30), None])
+    worker = process(app, [make_event(100, aspect_type='update')])
+    sleep.assert_called_once_with(30)
+    assert (worker.processed, worker.failed) == (1, 0)
+    assert fake_strava.calls == 2
+
+def test_token_refreshes_are_taken_from_the_queue(app, mocker):
+    refresh_access_code = mocker.patch('app.tokens.refresh_access_code')
+    worker = process(app, [{'object_type': TOKEN_REFRESH, 'owner_id': 1, 'user_id': 7, 'margin': 60}])
+    refresh_access_code.assert_called_once_with(7, 60)
+    assert worker.processed == 1
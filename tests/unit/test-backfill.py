@@ -0,0 +1,63 @@
+"""Unit tests for the historical activity backfill."""
+
+import pytest
+from datetime import datetime, timedelta
+from app import crud, db
+from app.gear.backfill import TOKEN_RETRY_DELAY, backfill_default_gear_activities, backfill_user_activities
+from app.ratelimit import RateLimitDeferred
+
+PER_PAGE = 10
+
+@pytest.fixture
+def user_id(app):
+    user = crud.create_user(strava_id=42)
+    db.session.add(user)
+    db.session.commit()
+    shoe = crud.create_shoe('g1', 'Daily Trainer', None, False, user.id)
+    db.session.add_all([shoe, crud.create_access_token('access', True, True, datetime.now() + timedelta(hours=6), user.id),
+                        crud.create_refresh_token('refresh', True, True, user.id)])
+    db.session.commit()
+    crud.set_default_shoe(user, shoe.id, {'Run'})
+    return user.id
+
+def make_page(page, size=PER_PAGE):
+    # every other activity uses the default shoe, every fifth is a ride
+    return [{'id': page * 100 + n, 'gear_id': 'g1' if n % 2 == 0 else 'g2', 'sport_type': 'Ride' if n % 5 == 4 else 'Run',
+             'start_date_local': '2024-02-16T07:00:00Z', 'distance': 5000.0, 'moving_time': 1500} for n in range(size)]
+
+def mock_pages(mocker, last_page, fail_on=()):
+    def get_athlete_activities(access_token, page, per_page, priority):
+        if page in fail_on:
+            raise RateLimitDeferred(60)
+        activities = make_page(page, PER_PAGE if page < last_page else 3) if page <= last_page else []
+        return mocker.Mock(json=lambda: activities, raise_for_status=lambda: None)
+    return mocker.patch('app.gear.backfill.strava.get_athlete_activities', side_effect=get_athlete_activities)
+
+def test_backfill_streams_default_gear_activities(user_id, mocker):
+    mock_pages(mocker, last_page=5)
+    matches = list(backfill_default_gear_activities(user_id, per_page=PER_PAGE, concurrency=3))
+    # 4 full pages with 4 default gear runs each, and 2 in the short last page
+    assert len(matches) == 18
+    assert all(activity.gear_id == 'g1' and activity.sport_type == 'Run' for activity in matches)
+    cursor = crud.get_backfill_cursor(user_id)
+    assert cursor.completed_on is not None
+    assert cursor.matched == 18
+
+def test_backfill_resumes_after_rate_limit(user_id, mocker):
+    mock_pages(mocker, last_page=5, fail_on={3})
+    with pytest.raises(RateLimitDeferred):
+        list(backfill_default_gear_activities(user_id, per_page=PER_PAGE, concurrency=2))
+    assert crud.get_backfill_cursor(user_id).next_page == 3
+
+    fetch = mock_pages(mocker, last_page=5)
+    matches = list(backfill_default_gear_activities(user_id, per_page=PER_PAGE, concurrency=2))
+    assert len(matches) == 10
+    assert min(call.args[1] for call in fetch.call_args_list) == 3
+
+def test_backfill_retries_while_the_partition_refreshes_tokens(user_id, mocker):
+    from celery.exceptions import Retry
+    mocker.patch('app.gear.backfill.tokens.retrieve_valid_access_code', side_effect=TimeoutError)
+    retry = mocker.patch.object(backfill_user_activities, 'retry', return_value=Retry())
+    with pytest.raises(Retry):
+        backfill_user_activities(user_id)
+    retry.assert_called_once_with(countdown=TOKEN_RETRY_DELAY, max_retries=10)
@@ -0,0 +1,57 @@
+"""Unit tests for config profiles."""
+
+import pytest
+import config
+from app import create_app
+
+def test_profile_from_app_env(monkeypatch):
+    monkeypatch.setenv('APP_ENV', 'prod')
+    assert config.config_for_env() is config.ProdConfig
+    monkeypatch.delenv('APP_ENV')
+    assert config.config_for_env() is config.DevConfig
+    with pytest.raises(ValueError):
+        config.config_for_env('staging')
+
+def test_engine_sized_for_role():
+    class PoolConfig(config.TestConfig):
+        WEB_ENGINE_OPTIONS = {'pool_pre_ping': True, 'pool_recycle': 600}
+        WORKER_ENGINE_OPTIONS = {'pool_pre_ping': True, 'pool_recycle': 60}
+
+    assert create_app(PoolConfig).config['SQLALCHEMY_ENGINE_OPTIONS']['pool_recycle'] == 600
+    assert create_app(PoolConfig, role='worker').config['SQLALCHEMY_ENGINE_OPTIONS']['pool_recycle'] == 60
+
+def test_worker_app_has_no_views():
+    worker = create_app(config.TestConfig, role='worker')
+    assert not [rule for rule in worker.url_map.iter_rules() if rule.endpoint.startswith(('auth.', 'gear.'))]
+    from app import celery
+    assert 'app.gear.helpers.process_new_event' in celery.tasks
+
+def test_broker_from_profile():
+    from app import celery
+    create_app(config.TestConfig)
+    assert celery.conf.broker_url == 'memory://'
+
+    class RemoteBrokerConfig(config.TestConfig):
+        CELERY_BROKER_URL = 'redis://broker.example:6379/1'
+
+    create_app(RemoteBrokerConfig)
+    assert celery.connection_for_write().as_uri() == 'redis://broker.example:6379/1'
+    create_app(config.TestConfig)
+
+def test_admission_off_without_redis_broker(caplog):
+    from app import admission
+
+    class AdmissionConfig(config.TestConfig):
+        ADMISSION_ENABLED = True
+
+    create_app(AdmissionConfig)
+    assert not admission.enabled
+    assert 'admission needs a Redis broker' in caplog.text
+    create_app(config.TestConfig)
+
+def test_secrets_read_when_used(monkeypatch):
+    from app import constants
+    monkeypatch.setenv('CLIENT_ID', '4242')
+    assert constants.CLIENT_ID == '4242'
+    with pytest.raises(AttributeError):
+        constants.NOT_A_SECRET
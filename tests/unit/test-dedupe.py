@@ -0,0 +1,55 @@
+"""Unit tests for webhook event deduplication."""
+
+import pytest
+from flask import Flask
+from app.dedupe import EventDeduplicator
+from app.stores import MemoryStore
+
+@pytest.fixture
+def deduplicator():
+    app = Flask(__name__)
+    app.config.update(DEDUPE_BACKEND='memory', DEDUPE_TTL=60, DEDUPE_MAX_EVENTS=3)
+    return EventDeduplicator(app)
+
+def make_event(object_id, aspect_type='create', event_time=1700000000, owner_id=42):
+    return {'object_id': object_id, 'aspect_type': aspect_type, 'event_time': event_time, 'owner_id': owner_id}
+
+def test_repeat_delivery_is_dropped(deduplicator):
+    assert deduplicator.is_first_delivery(make_event(1))
+    assert not deduplicator.is_first_delivery(make_event(1))
+
+def test_distinct_aspects_are_kept(deduplicator):
+    assert deduplicator.is_first_delivery(make_event(1, aspect_type='create'))
+    assert deduplicator.is_first_delivery(make_event(1, aspect_type='update'))
+    assert deduplicator.is_first_delivery(make_event(1, event_time=1700000001))
+
+def test_store_is_bounded(deduplicator):
+    for object_id in range(10):
+        deduplicator.is_first_delivery(make_event(object_id))
+    assert len(deduplicator.store) == 3
+    # the oldest events have been evicted
+    assert deduplicator.is_first_delivery(make_event(0))
+
+def test_memory_store_expiry(mocker):
+    clock = mocker.patch('app.stores.time.monotonic', return_value=100.0)
+    store = MemoryStore()
+    assert store.add('key', 1, ttl=10)
+    assert not store.add('key', 1, ttl=10)
+    clock.return_value = 111.0
+    assert store.get('key') is None
+    assert store.add('key', 1, ttl=10)
+
+def test_event_is_forgotten_when_the_broker_fails(app, mocker):
+    from kombu.exceptions import OperationalError
+    event = {'object_type': 'activity', 'object_id': 1001, 'aspect_type': 'create', 'owner_id': 42,
+             'subscription_id': 1, 'event_time': 1700000000, 'updates': {}}
+    apply_async = mocker.patch('app.gear.helpers.process_new_event.apply_async',
+                               side_effect=OperationalError('Connection refused'))
+    client = app.test_client()
+    # the webhook fails, and Strava delivers the event again
+    with pytest.raises(OperationalError):
+        client.post('/webhook', json=event)
+    # the retry is queued rather than dropped as a repeat
+    apply_async.side_effect = None
+    assert client.post('/webhook', json=event).status_code == 200
+    assert apply_async.call_count == 2
@@ -0,0 +1,125 @@
+"""Unit tests for the event log."""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from app import crud, db, event_log
+from app.gear import helpers, replay
+from app.gear.eventref import event_ref
+from app.model import LoggedEvent
+
+def make_event(object_id=1001, aspect_type='delete'):
+    return {'object_type': 'activity', 'object_id': object_id, 'aspect_type': aspect_type, 'owner_id': 42,
+            'subscription_id': 1, 'event_time': 1700000000, 'updates': {}}
+
+def test_webhook_logs_events_before_queueing(app, mocker):
+    apply_async = mocker.patch('app.gear.helpers.process_new_event.apply_async')
+    app.test_client().post('/webhook', json=make_event())
+    event = db.session.scalars(db.select(LoggedEvent)).one()
+    assert event.payload == make_event()
+    assert event.processed_at is None
+    assert apply_async.call_args.args[0][2] == event.id
+
+def test_concurrent_appends_share_commits(app, mocker):
+    log_events = crud.log_events
+
+    def slow_log_events(events):
+        time.sleep(0.05)
+        return log_events(events)
+
+    mocker.patch('app.crud.log_events', side_effect=slow_log_events)
+    commits = event_log.commits
+    event_ids = {}
+
+    def append(n):
+        with app.app_context():
+            event_ids[n] = event_log.append(make_event(n), time.time())
+
+    threads = [threading.Thread(target=append, args=(n,)) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(event_ids) == 20
+    assert event_log.commits - commits < 20
+    # each append gets back the ID of its own event
+    logged = {event.id: event.object_id for event in db.session.scalars(db.select(LoggedEvent))}
+    assert {logged[event_id]: event_id for event_id in event_ids.values()} == event_ids
+
+def test_logged_event_is_processed_once(app):
+    [event_id] = crud.log_events([(make_event(), time.time())])
+    helpers.process_new_event.apply(args=(make_event(),), kwargs={'event_id': event_id}, task_id='first')
+    assert db.session.get(LoggedEvent, event_id).processed_at is not None
+    # a redelivered copy finds it processed
+    assert not crud.claim_event(event_id, 'first', 600)
+    assert not crud.claim_event(event_id, 'second', 600)
+
+def test_stalled_events_are_requeued(app, mocker):
+    apply_async = mocker.patch('app.gear.helpers.process_new_event.apply_async')
+    stalled, recent = crud.log_events([(make_event(1), time.time() - 3600), (make_event(2), time.time())])
+    assert replay.requeue_stalled_events() == 1
+    args, kwargs = apply_async.call_args
+    assert args == ((event_ref(make_event(1)), args[0][1], stalled),)
+    assert crud.claim_event(stalled, kwargs['task_id'], 600)
+    # claimed now, so the next sweep leaves it be
+    assert replay.requeue_stalled_events() == 0
+
+def test_stalled_events_wait_out_deep_queues(app, mocker):
+    from app import admission
+    apply_async = mocker.patch('app.gear.helpers.process_new_event.apply_async')
+    admission.enabled = True
+    depth = mocker.patch.object(admission, 'depth', return_value=admission.defer_watermark)
+    crud.log_events([(make_event(1), time.time() - 3600)])
+    # most likely still behind the backlog, so left queued
+    assert replay.requeue_stalled_events() == 0
+    depth.return_value = 0
+    assert replay.requeue_stalled_events() == 1
+    assert apply_async.call_count == 1
+
+def test_replay_includes_processed_events_on_request(app, mocker):
+    apply_async = mocker.patch('app.gear.helpers.process_new_event.apply_async')
+    first, second = crud.log_events([(make_event(1), time.time()), (make_event(2), time.time())])
+    crud.finish_event(first)
+    since, until = datetime.now() - timedelta(hours=1), datetime.now() + timedelta(hours=1)
+    assert replay.replay_events(since, until) == 1
+    assert replay.replay_events(since, until, include_processed=True, batch_size=1) == 2
+    assert db.session.get(LoggedEvent, first).processed_at is None
+    assert apply_async.call_count == 3
+
+def test_deep_queues_defer_instead_of_spill_without_event_log(app, mocker):
+    from app import admission
+    apply_async = mocker.patch('app.gear.helpers.process_new_event.apply_async')
+    admission.enabled = True
+    mocker.patch.object(admission, 'depth', return_value=admission.spill_watermark)
+    mocker.patch.object(event_log, 'enabled', False)
+    response = app.test_client().post('/webhook', json=make_event(1, 'create'))
+    assert response.status_code == 200
+    assert apply_async.call_args.kwargs['priority'] == admission.low_priority
+
+def test_deep_queues_defer_then_spill_events(app, mocker):
+    from app import admission
+    apply_async = mocker.patch('app.gear.helpers.process_new_event.apply_async')
+    admission.enabled = True
+    depth = mocker.patch.object(admission, 'depth', return_value=admission.defer_watermark)
+    client = app.test_client()
+    # past the defer watermark new activities still go first, the rest at low priority
+    client.post('/webhook', json=make_event(1, 'create'))
+    client.post('/webhook', json=make_event(2, 'update'))
+    assert [call.kwargs.get('priority') for call in apply_async.call_args_list] == [None, admission.low_priority]
+
+    depth.return_value = admission.spill_watermark
+    response = client.post('/webhook', json=make_event(3, 'create'))
+    assert response.status_code == 200
+    assert apply_async.call_count == 2
+    spilled = db.session.scalars(db.select(LoggedEvent).where(LoggedEvent.spilled)).one()
+    assert spilled.object_id == 3
+    # neither stalled nor drained while the queues are still deep
+    spilled.received_at = datetime.now() - timedelta(hours=1)
+    db.session.commit()
+    assert replay.requeue_stalled_events() == 0
+    assert replay.drain_spilled_events() == 0
+
+    depth.return_value = 0
+    assert replay.drain_spilled_events() == 1
+    assert apply_async.call_args.args[0][2] == spilled.id
+    assert not db.session.get(LoggedEvent, spilled.id).spilled
@@ -0,0 +1,253 @@
+"""Unit tests for processing webhook events."""
+
+import pytest
+from datetime import datetime, timedelta
+from app import activity_cache, crud, db
+from app.gear import helpers
+
+@pytest.fixture
+def athlete(app):
+    user = crud.create_user(strava_id=42)
+    user.email = 'runner@example.com'
+    db.session.add(user)
+    db.session.commit()
+    shoe = crud.create_shoe('g1', 'Daily Trainer', None, False, user.id)
+    trail_shoe = crud.create_shoe('g3', 'Trail Shoe', None, False, user.id)
+    db.session.add_all([shoe, trail_shoe, crud.create_shoe('g2', 'Racer', None, False, user.id),
+                        crud.create_access_token('access', True, True, datetime.now() + timedelta(hours=6), user.id),
+                        crud.create_refresh_token('refresh', True, True, user.id)])
+    db.session.commit()
+    crud.set_default_shoe(user, shoe.id, {'Run', 'Walk'})
+    crud.set_default_shoe(user, trail_shoe.id, {'TrailRun'})
+    return user.id
+
+def make_event(aspect_type='create', object_id=1001, updates=None):
+    return {'object_type': 'activity', 'object_id': object_id, 'aspect_type': aspect_type, 'owner_id': 42,
+            'subscription_id': 1, 'event_time': 1700000000, 'updates': updates or {}}
+
+def count_queries(callable_):
+    from sqlalchemy import event
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        result = callable_()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return result, len(statements)
+
+def mock_activity(mocker, gear_id, sport_type='Run', distance=10000.0, start_date_local='2024-02-16T07:00:00Z'):
+    activity = {'gear_id': gear_id, 'sport_type': sport_type, 'start_date_local': start_date_local,
+                'distance': distance, 'moving_time': 3000}
+    return mocker.patch('app.gear.helpers.strava.get_activity', return_value=mocker.Mock(json=lambda: activity))
+
+def test_event_context_is_one_query(athlete):
+    context, queries = count_queries(lambda: crud.get_event_context(42))
+    assert queries == 1
+    assert context.user_id == athlete
+    assert context.email == 'runner@example.com'
+    assert context.access_token_code == 'access'
+    assert context.default_gear == {'Run': ('g1', 'Daily Trainer'), 'Walk': ('g1', 'Daily Trainer'),
+                                    'TrailRun': ('g3', 'Trail Shoe')}
+    assert crud.get_event_context(43) is None
+
+def test_athlete_without_access_token_has_no_context(athlete):
+    from app.model import AccessToken
+    AccessToken.query.filter_by(user_id = athlete).delete()
+    db.session.commit()
+    assert crud.get_event_context(42) is None
+
+def test_reminder_sent_for_default_gear(athlete, mocker):
+    mock_activity(mocker, 'g1')
+    send_email = mocker.patch('app.gear.helpers.send_email')
+    helpers.process_new_event(make_event())
+    send_email.assert_called_once_with('runner@example.com', 'run', 'Daily Trainer', '02/16')
+
+def test_no_reminder_for_other_gear_or_sport(athlete, mocker):
+    send_email = mocker.patch('app.gear.helpers.send_email')
+    mock_activity(mocker, 'g2')
+    helpers.process_new_event(make_event())
+    mock_activity(mocker, 'g1', sport_type='Ride')
+    helpers.process_new_event(make_event(object_id=1002))
+    send_email.assert_not_called()
+
+def test_non_create_events_are_ignored(athlete, mocker):
+    get_activity = mock_activity(mocker, 'g1')
+    helpers.process_new_event(make_event(aspect_type='delete'))
+    get_activity.assert_not_called()
+
+def test_steady_state_event_needs_no_database_reads(athlete, mocker):
+    from sqlalchemy import event
+    mock_activity(mocker, 'g1')
+    mocker.patch('app.gear.helpers.send_email')
+    helpers.process_new_event(make_event())
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        helpers.process_new_event(make_event())
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert statements == []
+
+def test_email_consent_change_invalidates_cache(athlete):
+    from app import athlete_cache
+    crud.get_event_context(42)
+    assert athlete_cache.get(42) is not None
+    user = crud.get_user_by_id(athlete)
+    crud.set_email_consent(user, 'new@example.com', True)
+    assert athlete_cache.get(42) is None
+    assert crud.get_event_context(42).email == 'new@example.com'
+
+def test_stored_activity_is_not_refetched(athlete, mocker):
+    get_activity = mock_activity(mocker, 'g1')
+    mocker.patch('app.gear.helpers.send_email')
+    helpers.process_new_event(make_event())
+    activity_cache.delete('1001')
+    helpers.process_new_event(make_event())
+    get_activity.assert_called_once()
+
+def test_update_and_delete_events_patch_the_store(athlete, mocker):
+    get_activity = mock_activity(mocker, 'g1')
+    mocker.patch('app.gear.helpers.send_email')
+    helpers.process_new_event(make_event())
+    helpers.process_new_event(make_event(aspect_type='update', updates={'type': 'Walk', 'title': 'Stroll'}))
+    activity_cache.delete('1001')
+    assert crud.get_activity(1001).sport_type == 'Walk'
+    helpers.process_new_event(make_event(aspect_type='delete'))
+    assert crud.get_activity(1001) is None
+    get_activity.assert_called_once()
+
+def test_default_gear_is_matched_per_sport(athlete, mocker):
+    send_email = mocker.patch('app.gear.helpers.send_email')
+    mock_activity(mocker, 'g3', sport_type='TrailRun')
+    helpers.process_new_event(make_event(object_id=2001))
+    mock_activity(mocker, 'g1', sport_type='TrailRun')
+    helpers.process_new_event(make_event(object_id=2002))
+    send_email.assert_called_once_with('runner@example.com', 'trail run', 'Trail Shoe', '02/16')
+
+def test_set_default_shoe_moves_and_removes_sports(athlete):
+    user = crud.get_user_by_id(athlete)
+    trail_shoe = crud.get_shoe_by_strava_id('g3')
+    shoe = crud.get_shoe_by_strava_id('g1')
+    added, deleted = crud.set_default_shoe(user, trail_shoe.id, {'Walk'})
+    assert added == {trail_shoe.id: ['Walk']}
+    assert deleted == {shoe.id: ['Walk'], trail_shoe.id: ['TrailRun']}
+    assert crud.get_event_context(42).default_gear == {'Run': ('g1', 'Daily Trainer'), 'Walk': ('g3', 'Trail Shoe')}
+
+def shoe_totals(user_id):
+    return {shoe.strava_gear_id: (shoe.distance, shoe.activity_count) for shoe in crud.get_user_shoe_stats(user_id)}
+
+def test_shoe_totals_follow_gear_changes_and_deletes(athlete, mocker):
+    from datetime import date
+    mocker.patch('app.gear.helpers.send_email')
+    mock_activity(mocker, 'g1')
+    helpers.process_new_event(make_event(object_id=3001))
+    mock_activity(mocker, 'g1', start_date_local='2024-02-20T07:00:00Z')
+    helpers.process_new_event(make_event(object_id=3002))
+    assert shoe_totals(athlete)['g1'] == (20000.0, 2)
+
+    # an update that names no field we can patch is refetched in case the gear changed
+    mock_activity(mocker, 'g2', start_date_local='2024-02-20T07:00:00Z')
+    helpers.process_new_event(make_event(aspect_type='update', object_id=3002))
+    assert shoe_totals(athlete)['g1'] == (10000.0, 1)
+    assert shoe_totals(athlete)['g2'] == (10000.0, 1)
+    assert crud.get_user_weekly_distances(athlete, date(2024, 2, 1)) == {
+        ('g1', date(2024, 2, 12)): 10000.0, ('g1', date(2024, 2, 19)): 0.0, ('g2', date(2024, 2, 19)): 10000.0}
+
+    helpers.process_new_event(make_event(aspect_type='delete', object_id=3001))
+    assert shoe_totals(athlete)['g1'] == (0.0, 0)
+    assert shoe_totals(athlete)['g3'] == (None, None)
+
+def test_shoe_totals_include_athletes_without_a_default(athlete, mocker):
+    from app.model import ShoeDefault
+    ShoeDefault.query.filter_by(user_id = athlete).delete()
+    db.session.commit()
+    send_email = mocker.patch('app.gear.helpers.send_email')
+    mock_activity(mocker, 'g2')
+    helpers.process_new_event(make_event(object_id=3003))
+    assert shoe_totals(athlete)['g2'] == (10000.0, 1)
+    send_email.assert_not_called()
+
+def test_new_activity_saved_twice_at_once_is_counted_once(athlete, mocker):
+    details = {'gear_id': 'g2', 'sport_type': 'Run', 'start_date_local': '2024-02-16T07:00:00Z', 'distance': 10000.0,
+               'moving_time': 3000}
+    crud.save_activity(5001, athlete, details)
+    # the second save looked before the first was stored, as a backfill racing a webhook event would
+    lock_activities = crud.lock_activities
+    stale = [{}]
+    mocker.patch('app.crud.lock_activities', side_effect=lambda ids: stale.pop() if stale else lock_activities(ids))
+    crud.save_activity(5001, athlete, details)
+    assert shoe_totals(athlete)['g2'] == (10000.0, 1)
+
+def test_replacement_alert_is_sent_once(athlete, mocker, app):
+    mocker.patch('app.gear.helpers.send_email')
+    send_replacement_email = mocker.patch('app.gear.helpers.send_replacement_email')
+    app.config['SHOE_REPLACEMENT_DISTANCE'] = 25000
+    for object_id in (4001, 4002, 4003, 4004):
+        mock_activity(mocker, 'g2')
+        helpers.process_new_event(make_event(object_id=object_id))
+    send_replacement_email.assert_called_once_with('runner@example.com', 'Racer', 25)
+
+def test_replacement_alert_that_fails_to_send_is_sent_later(athlete, mocker, app):
+    from app.mailer import MailDeferred
+    mocker.patch('app.gear.helpers.send_email')
+    send_replacement_email = mocker.patch('app.gear.helpers.send_replacement_email',
+                                          side_effect=[MailDeferred('451 try later'), None])
+    app.config['SHOE_REPLACEMENT_DISTANCE'] = 15000
+    mock_activity(mocker, 'g2')
+    helpers.process_new_event(make_event(object_id=4001))
+    with pytest.raises(MailDeferred):
+        helpers.process_new_event(make_event(object_id=4002))
+    helpers.process_new_event(make_event(object_id=4003))
+    helpers.process_new_event(make_event(object_id=4004))
+    assert send_replacement_email.call_count == 2
+
+def test_reminders_the_mail_server_defers_are_retried(athlete, mocker):
+    from app.mailer import MailDeferred
+    mock_activity(mocker, 'g1')
+    send_email = mocker.patch('app.gear.helpers.send_email', side_effect=[MailDeferred('451 try later'), None])
+    helpers.process_new_event.apply(args=(make_event(),))
+    assert send_email.call_count == 2
+
+def test_deferred_check_absorbs_updates(athlete, app, mocker):
+    from app import pending_checks
+    get_activity = mock_activity(mocker, 'g1')
+    send_email = mocker.patch('app.gear.helpers.send_email')
+    apply_async = mocker.patch('app.gear.helpers.check_deferred_gear.apply_async')
+    pending_checks.delay = 600
+    helpers.process_new_event(make_event())
+    helpers.process_new_event(make_event())
+    helpers.process_new_event(make_event(aspect_type='update', updates={'title': 'Morning Run'}))
+    apply_async.assert_called_once_with((42, 1001), countdown=600)
+    get_activity.assert_not_called()
+    # the check runs once the delay is over, and only once
+    helpers.check_deferred_gear(42, 1001)
+    helpers.check_deferred_gear(42, 1001)
+    get_activity.assert_called_once()
+    send_email.assert_called_once()
+
+def test_delete_cancels_deferred_check(athlete, mocker):
+    from app import pending_checks
+    get_activity = mock_activity(mocker, 'g1')
+    mocker.patch('app.gear.helpers.check_deferred_gear.apply_async')
+    pending_checks.delay = 600
+    helpers.process_new_event(make_event())
+    helpers.process_new_event(make_event(aspect_type='delete'))
+    helpers.check_deferred_gear(42, 1001)
+    get_activity.assert_not_called()
+
+def test_event_references_keep_what_processing_needs(athlete, mocker):
+    from app.gear.eventref import event_from_ref, event_ref
+    update = make_event(aspect_type='update', updates={'title': 'Long morning run with friends', 'sport_type': 'Walk'})
+    ref = event_ref(update)
+    assert ref == [1001, 42, 0, 1, {'title': None, 'sport_type': 'Walk'}]
+    assert event_ref(make_event()) == [1001, 42, 0, 0]
+    assert event_from_ref(event_ref(make_event())) == {key: make_event()[key] for key in
+                                                        ('object_type', 'object_id', 'aspect_type', 'owner_id', 'updates')}
+    # processed as the whole payload would be
+    mock_activity(mocker, 'g1')
+    send_email = mocker.patch('app.gear.helpers.send_email')
+    helpers.process_new_event(event_ref(make_event()))
+    send_email.assert_called_once_with('runner@example.com', 'run', 'Daily Trainer', '02/16')
@@ -0,0 +1,115 @@
+"""Unit tests for syncing a user's shoes from Strava."""
+
+from sqlalchemy import event
+from app import crud, db
+
+def strava_shoe(n, name=None, retired=False):
+    return {'id': f'g{n}', 'name': name or f'shoe {n}', 'nickname': None, 'retired': retired}
+
+def count_queries(callable_):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        result = callable_()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return result, len(statements)
+
+def test_sync_inserts_and_updates_in_fixed_queries(app):
+    user = crud.create_user(strava_id=42)
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+
+    shoes, queries = count_queries(lambda: crud.sync_user_shoes(user_id, [strava_shoe(n) for n in range(20)]))
+    assert len(shoes) == 20
+    assert queries <= 3
+
+    updated = [strava_shoe(n, name='renamed' if n < 10 else None, retired=n == 19) for n in range(20)]
+    shoes, queries = count_queries(lambda: crud.sync_user_shoes(user_id, updated))
+    assert queries <= 3
+    by_gear_id = {shoe.strava_gear_id: shoe for shoe in shoes}
+    assert by_gear_id['g0'].name == 'renamed'
+    assert by_gear_id['g19'].retired
+
+def test_sync_without_changes_is_one_query(app):
+    user = crud.create_user(strava_id=42)
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    crud.sync_user_shoes(user_id, [strava_shoe(n) for n in range(5)])
+    _, queries = count_queries(lambda: crud.sync_user_shoes(user_id, [strava_shoe(n) for n in range(5)]))
+    assert queries == 1
+
+def make_athlete(mocker, shoes):
+    user = crud.create_user(strava_id=42)
+    db.session.add(user)
+    db.session.commit()
+    mocker.patch('app.gear.gearsync.tokens.retrieve_valid_access_code', return_value='access')
+    get_athlete = mocker.patch('app.gear.gearsync.strava.get_athlete',
+                               return_value=mocker.Mock(json=lambda: {'shoes': shoes}))
+    return user.id, get_athlete
+
+def test_cached_gear_is_served_without_calling_strava(app, mocker):
+    from app.gear import gearsync
+    user_id, get_athlete = make_athlete(mocker, [strava_shoe(1), strava_shoe(2)])
+    delay = mocker.patch('app.gear.gearsync.refresh_user_gear.delay')
+    assert gearsync.current_gear_ids(user_id, 42) == ['g1', 'g2']
+    assert gearsync.current_gear_ids(user_id, 42) == ['g1', 'g2']
+    get_athlete.assert_called_once()
+    delay.assert_not_called()
+    # refreshing on request fetches again
+    gearsync.current_gear_ids(user_id, 42, refresh=True)
+    assert get_athlete.call_count == 2
+
+def test_stale_gear_is_served_and_refreshed_in_background(app, mocker):
+    from app import gear_cache
+    from app.gear import gearsync
+    user_id, get_athlete = make_athlete(mocker, [strava_shoe(1)])
+    delay = mocker.patch('app.gear.gearsync.refresh_user_gear.delay')
+    gear_cache.set(user_id, ['g0'])
+    gear_cache.max_age = 0
+    assert gearsync.current_gear_ids(user_id, 42) == ['g0']
+    assert gearsync.current_gear_ids(user_id, 42) == ['g0']
+    # one background refresh however many views
+    delay.assert_called_once_with(user_id, 42)
+    get_athlete.assert_not_called()
+
+def test_refresh_job_stops_when_rate_budget_runs_out(app, mocker):
+    from datetime import datetime
+    from app.gear import gearsync
+    from app.ratelimit import RateLimitDeferred
+    for strava_id in (42, 43):
+        user = crud.create_user(strava_id=strava_id)
+        db.session.add(user)
+        db.session.commit()
+        crud.save_activity(1000 + strava_id, user.id, {'gear_id': 'g1', 'sport_type': 'Run', 'distance': 1000.0,
+                           'moving_time': 300, 'start_date_local': datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')})
+    mocker.patch('app.gear.gearsync.tokens.retrieve_valid_access_code', return_value='access')
+    get_athlete = mocker.patch('app.gear.gearsync.strava.get_athlete', side_effect=RateLimitDeferred(60))
+    assert gearsync.refresh_active_gear() == 0
+    get_athlete.assert_called_once()
+
+def test_refresh_job_goes_round_every_active_user(app, mocker):
+    from datetime import datetime
+    from app import gear_cache
+    from app.gear import gearsync
+    user_ids = []
+    for strava_id in (42, 43, 44):
+        user = crud.create_user(strava_id=strava_id)
+        db.session.add(user)
+        db.session.commit()
+        user_ids.append(user.id)
+        crud.save_activity(1000 + strava_id, user.id, {'gear_id': 'g1', 'sport_type': 'Run', 'distance': 1000.0,
+                           'moving_time': 300, 'start_date_local': datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')})
+    mocker.patch('app.gear.gearsync.tokens.retrieve_valid_access_code', return_value='access')
+    mocker.patch('app.gear.gearsync.strava.get_athlete', return_value=mocker.Mock(json=lambda: {'shoes': []}))
+    refresh_gear = mocker.spy(gearsync, 'refresh_gear')
+    app.config['GEAR_REFRESH_BATCH_SIZE'] = 1
+    gear_cache.set(user_ids[0], [])
+    stats = gear_cache.stats()
+    assert [gearsync.refresh_active_gear() for _ in range(4)] == [1, 1, 0, 0]
+    assert [call.args[0] for call in refresh_gear.call_args_list] == user_ids[1:]
+    # checking entries isn't counted as the gear pages' hits and misses
+    assert gear_cache.stats() == stats
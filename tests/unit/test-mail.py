@@ -0,0 +1,52 @@
+"""Unit tests for sending email over a persistent connection."""
+
+import socket
+import pytest
+from flask_mail import Message
+from app import mail_dispatcher
+from app.mailer import MailDeferred
+from benchmarks.standins.smtp import SMTPSink
+
+@pytest.fixture
+def sink(app):
+    sink = SMTPSink().start()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=sink.port, MAIL_USE_SSL=False, MAIL_SUPPRESS_SEND=False)
+    from app import mail
+    mail.init_app(app)
+    mail_dispatcher.init_app(app)
+    yield sink
+    mail_dispatcher.close()
+    sink.stop()
+
+def make_message(n):
+    return Message(f'Reminder {n}', sender='sender@example.com', recipients=[f'runner{n}@example.com'], body='hi')
+
+def test_messages_share_one_connection(sink):
+    for n in range(5):
+        assert mail_dispatcher.send(make_message(n)) == 1
+    assert len(sink.messages) == 5
+    assert sink.connections == 1
+
+def test_reconnects_after_dropped_connection(sink):
+    mail_dispatcher.send(make_message(0))
+    # simulate the server closing an idle connection
+    mail_dispatcher._connection.host.sock.shutdown(socket.SHUT_RDWR)
+    mail_dispatcher.send(make_message(1))
+    assert len(sink.messages) == 2
+    assert sink.connections == 2
+
+def test_refused_message_is_dropped_without_failing_others(sink):
+    sink.refused.add('runner0@example.com')
+    assert mail_dispatcher.send(make_message(0)) == 0
+    assert mail_dispatcher.send(make_message(1)) == 1
+    assert [recipients for _, recipients, _ in sink.messages] == [['runner1@example.com']]
+
+def test_transient_failure_is_deferred(sink, mocker):
+    import smtplib
+    mail_dispatcher.send(make_message(0))
+    send = mocker.patch.object(mail_dispatcher, '_send', side_effect=smtplib.SMTPResponseException(451, b'try later'))
+    with pytest.raises(MailDeferred):
+        mail_dispatcher.send(make_message(1))
+    # the task's retry sends it once the server takes it
+    send.side_effect = None
+    assert mail_dispatcher.send(make_message(1)) == 1
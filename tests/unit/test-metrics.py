@@ -0,0 +1,65 @@
+"""Unit tests for hot path metrics."""
+
+from prometheus_client import REGISTRY
+from app import constants, strava
+from benchmarks.standins.strava import FakeStrava
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def make_event(object_id=1001):
+    return {'object_type': 'activity', 'object_id': object_id, 'aspect_type': 'create', 'owner_id': 42,
+            'subscription_id': 1, 'event_time': 1700000000, 'updates': {}}
+
+def test_webhook_acks_are_counted_by_outcome(app, mocker):
+    apply_async = mocker.patch('app.gear.helpers.process_new_event.apply_async')
+    client = app.test_client()
+    before = {outcome: sample('webhook_ack_seconds_count', outcome=outcome) for outcome in ('queued', 'duplicate', 'invalid')}
+    deliveries = {outcome: sample('webhook_deliveries_total', outcome=outcome) for outcome in ('first', 'duplicate')}
+    client.post('/webhook', json=make_event())
+    client.post('/webhook', json=make_event())
+    client.post('/webhook', json={'object_type': 'activity'})
+    assert sample('webhook_ack_seconds_count', outcome='queued') == before['queued'] + 1
+    assert sample('webhook_ack_seconds_count', outcome='duplicate') == before['duplicate'] + 1
+    assert sample('webhook_ack_seconds_count', outcome='invalid') == before['invalid'] + 1
+    assert sample('webhook_deliveries_total', outcome='first') == deliveries['first'] + 1
+    assert sample('webhook_deliveries_total', outcome='duplicate') == deliveries['duplicate'] + 1
+    assert apply_async.call_args.args[0][1] > 0
+
+def test_requests_count_their_queries(app):
+    client = app.test_client()
+    before = sample('sql_queries_per_unit_count', unit='gear.webhook')
+    client.post('/webhook', json={'object_type': 'activity'})
+    assert sample('sql_queries_per_unit_count', unit='gear.webhook') == before + 1
+
+def test_strava_calls_are_counted_by_endpoint_and_status(app, monkeypatch):
+    fake = FakeStrava().start()
+    monkeypatch.setattr(constants, 'BASE_URL', fake.base_url)
+    before = sample('strava_requests_total', endpoint='/api/v3/activities/{id}', status='200')
+    strava.get_activity('access', 1001)
+    strava.get_activity('access', 1002)
+    fake.stop()
+    assert sample('strava_requests_total', endpoint='/api/v3/activities/{id}', status='200') == before + 2
+    assert sample('strava_rate_limit_usage', window='short') == 2
+
+def test_athlete_cache_lookups_are_counted_by_tier(app):
+    from app import athlete_cache
+    before = {result: sample('athlete_cache_lookups_total', result=result) for result in ('local', 'miss')}
+    athlete_cache.get(42)
+    athlete_cache.set(42, [1, 'runner@example.com', True, {}])
+    athlete_cache.get(42)
+    assert sample('athlete_cache_lookups_total', result='miss') == before['miss'] + 1
+    assert sample('athlete_cache_lookups_total', result='local') == before['local'] + 1
+
+def test_event_stages_are_timed(app, mocker):
+    from app.gear import helpers
+    before = sample('event_stage_seconds_count', stage='context')
+    helpers.process_new_event(make_event(), received_at=1.0)
+    assert sample('event_stage_seconds_count', stage='context') == before + 1
+
+def test_metrics_are_served_locally_only(app):
+    client = app.test_client()
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert b'webhook_ack_seconds_bucket' in response.data
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 404
@@ -0,0 +1,90 @@
+"""Unit tests for partitioning events by athlete."""
+
+import pytest
+from datetime import datetime, timedelta
+from app import crud, db, event_queue, partitions, tokens
+from app.gear import intake
+
+def make_event(owner_id):
+    return {'object_type': 'activity', 'object_id': 1001, 'aspect_type': 'create', 'owner_id': owner_id,
+            'subscription_id': 1, 'event_time': 1700000000, 'updates': {}}
+
+def test_jump_hash_moves_few_keys_when_partitions_grow():
+    before = [partitions.jump_hash(key, 10) for key in range(10000)]
+    after = [partitions.jump_hash(key, 11) for key in range(10000)]
+    assert set(before) == set(range(10))
+    moved = [new for old, new in zip(before, after) if old != new]
+    # only keys moving to the new partition move, about 1/11 of them
+    assert set(moved) == {10}
+    assert 600 < len(moved) < 1200
+
+def test_events_are_queued_on_their_athletes_partition(app, mocker):
+    apply_async = mocker.patch('app.gear.helpers.process_new_event.apply_async')
+    app.config['EVENT_PARTITIONS'] = 8
+    intake.queue_event(make_event(42), 1.0)
+    intake.queue_event(make_event(42), 2.0)
+    queues = {call.kwargs['queue'] for call in apply_async.call_args_list}
+    assert queues == {f'events.{partitions.jump_hash(42, 8)}'}
+    assert partitions.is_partition_queue('events.3', app.config)
+    assert not partitions.is_partition_queue('celery', app.config)
+
+def test_refreshes_outside_the_partition_are_handed_to_it(app, mocker):
+    apply_async = mocker.patch('app.tokens.refresh_user_tokens.apply_async')
+    exchange = mocker.patch('app.tokens.strava.exchange_token')
+    app.config['EVENT_PARTITIONS'] = 8
+    user = crud.create_user(strava_id=42)
+    db.session.add(user)
+    db.session.commit()
+    db.session.add(crud.create_access_token('old-access', True, True, datetime.now() + timedelta(seconds=60), user.id))
+    db.session.commit()
+    assert tokens.refresh_expiring_tokens() == 1
+    apply_async.assert_called_once_with((user.id, app.config['TOKEN_SWEEP_WINDOW']),
+                                        queue=f'events.{partitions.jump_hash(42, 8)}')
+    exchange.assert_not_called()
+
+def test_asyncio_partition_workers_get_refreshes_on_their_event_queue(app, mocker):
+    push_token_refresh = mocker.patch.object(event_queue, 'push_token_refresh')
+    apply_async = mocker.patch('app.tokens.refresh_user_tokens.apply_async')
+    app.config.update(EVENT_PARTITIONS=8, WORKER_MODE='asyncio')
+    user = crud.create_user(strava_id=42)
+    db.session.add(user)
+    db.session.commit()
+    tokens.refresh_on_partition(user.id, 60, wait=False)
+    push_token_refresh.assert_called_once_with(42, user.id, 60, partitions.jump_hash(42, 8))
+    apply_async.assert_not_called()
+
+def test_waiting_on_a_partition_refresh_is_bounded(app, mocker):
+    mocker.patch('app.tokens.refresh_user_tokens.apply_async')
+    app.config.update(EVENT_PARTITIONS=8, TOKEN_PARTITION_WAIT=0.2)
+    user = crud.create_user(strava_id=42)
+    db.session.add(user)
+    db.session.commit()
+    db.session.add(crud.create_access_token('old-access', True, True, datetime.now() + timedelta(seconds=60), user.id))
+    db.session.commit()
+    with pytest.raises(TimeoutError):
+        tokens.retrieve_valid_access_code(user.id)
+
+def test_refreshes_for_missing_users_and_tokens_are_refused(app, mocker):
+    apply_async = mocker.patch('app.tokens.refresh_user_tokens.apply_async')
+    app.config['EVENT_PARTITIONS'] = 8
+    with pytest.raises(tokens.MissingTokens):
+        tokens.refresh_on_partition(12345)
+    user = crud.create_user(strava_id=42)
+    db.session.add(user)
+    db.session.commit()
+    with pytest.raises(tokens.MissingTokens):
+        tokens.retrieve_valid_access_code(user.id)
+    apply_async.assert_not_called()
+
+def test_deferred_checks_go_where_partition_workers_consume(app, mocker):
+    from app import pending_checks
+    from app.gear import helpers
+    apply_async = mocker.patch('app.gear.helpers.check_deferred_gear.apply_async')
+    app.config['EVENT_PARTITIONS'] = 8
+    pending_checks.delay = 600
+    helpers.defer_gear_check(42, 1001)
+    apply_async.assert_called_with((42, 1001), countdown=600, queue=f'events.{partitions.jump_hash(42, 8)}')
+    # asyncio partition workers only read their event queues
+    app.config['WORKER_MODE'] = 'asyncio'
+    helpers.defer_gear_check(42, 1002)
+    apply_async.assert_called_with((42, 1002), countdown=600)
@@ -0,0 +1,37 @@
+"""Unit tests for the Strava rate limit scheduler."""
+
+import pytest
+from flask import Flask
+from app.ratelimit import PRIORITY_HIGH, PRIORITY_LOW, RateLimitDeferred, StravaRateLimiter, parse_rate_limit_header
+
+@pytest.fixture
+def limiter(mocker):
+    mocker.patch('app.ratelimit.time.time', return_value=1_700_000_100.0)
+    app = Flask(__name__)
+    app.config.update(RATE_LIMIT_BACKEND='memory', STRAVA_SHORT_LIMIT=10, STRAVA_DAILY_LIMIT=1000,
+                      RATE_LIMIT_LOW_PRIORITY_SHARE=0.5)
+    return StravaRateLimiter(app)
+
+def test_parse_rate_limit_header():
+    assert parse_rate_limit_header('100,1000') == (100, 1000)
+    assert parse_rate_limit_header(None) is None
+    assert parse_rate_limit_header('garbage') is None
+
+def test_low_priority_leaves_reserve_for_high_priority(limiter):
+    for _ in range(5):
+        limiter.acquire(PRIORITY_LOW)
+    with pytest.raises(RateLimitDeferred):
+        limiter.acquire(PRIORITY_LOW)
+    for _ in range(5):
+        limiter.acquire(PRIORITY_HIGH)
+    with pytest.raises(RateLimitDeferred) as deferred:
+        limiter.acquire(PRIORITY_HIGH)
+    # deferred until the quarter hour window resets
+    assert 0 < deferred.value.retry_after <= 15 * 60 + 1
+
+def test_usage_headers_correct_counts(limiter):
+    limiter.update_from_headers({'X-RateLimit-Limit': '200,2000', 'X-RateLimit-Usage': '199,50'})
+    assert limiter.limits == (200, 2000)
+    limiter.acquire(PRIORITY_HIGH)
+    with pytest.raises(RateLimitDeferred):
+        limiter.acquire(PRIORITY_HIGH)
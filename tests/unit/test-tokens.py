@@ -0,0 +1,59 @@
+"""Unit tests for access token caching and refresh."""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from app import crud, db, token_cache, tokens
+
+def create_user_with_tokens(expires_in):
+    user = crud.create_user(strava_id=42)
+    db.session.add(user)
+    db.session.commit()
+    expires_at = datetime.now() + timedelta(seconds=expires_in)
+    db.session.add_all([crud.create_access_token('old-access', True, True, expires_at, user.id),
+                        crud.create_refresh_token('old-refresh', True, True, user.id)])
+    db.session.commit()
+    return user.id
+
+def test_valid_token_is_served_from_cache(app, mocker):
+    user_id = create_user_with_tokens(expires_in=3600)
+    exchange = mocker.patch('app.tokens.strava.exchange_token')
+    assert tokens.retrieve_valid_access_code(user_id) == 'old-access'
+    get_access_token = mocker.spy(crud, 'get_access_token')
+    assert tokens.retrieve_valid_access_code(user_id) == 'old-access'
+    get_access_token.assert_not_called()
+    exchange.assert_not_called()
+
+def test_concurrent_refreshes_are_single_flight(app, mocker):
+    user_id = create_user_with_tokens(expires_in=60)
+    token_cache.invalidate(user_id)
+
+    def exchange_token(data):
+        time.sleep(0.1)
+        return mocker.Mock(json=lambda: {'access_token': 'new-access', 'refresh_token': 'new-refresh', 'expires_in': 21600})
+
+    exchange = mocker.patch('app.tokens.strava.exchange_token', side_effect=exchange_token)
+    results = []
+
+    def retrieve():
+        with app.app_context():
+            results.append(tokens.retrieve_valid_access_code(user_id))
+            db.session.remove()
+
+    threads = [threading.Thread(target=retrieve) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['new-access'] * 4
+    exchange.assert_called_once()
+    assert crud.get_refresh_token(user_id).code == 'new-refresh'
+
+def test_sweeper_refreshes_tokens_expiring_soon(app, mocker):
+    user_id = create_user_with_tokens(expires_in=20 * 60)
+    mocker.patch('app.tokens.strava.exchange_token', return_value=mocker.Mock(
+        json=lambda: {'access_token': 'new-access', 'refresh_token': 'new-refresh', 'expires_in': 21600}))
+    assert tokens.refresh_expiring_tokens() == 1
+    db.session.expire_all()
+    assert crud.get_access_token(user_id).code == 'new-access'
@@ -1,7 +1,9 @@
 """Script for setup and maintenance of Strava webhook"""
 
-import requests 
 from app import constants
+from app.strava import StravaClient
+
+strava = StravaClient()
 
 def create_webhook_subscription():
     """Create a new webhook subscription"""
@@ -12,7 +14,7 @@ def create_webhook_subscription():
         'verify_token': constants.STRAVA_VERIFY_TOKEN
     }
 
-    response = requests.post(f'{constants.BASE_URL}/push_subscriptions', data=webhook_data)
+    response = strava.request('POST', '/push_subscriptions', data=webhook_data)
     subscription_data = response.json()
     print(subscription_data)
 
@@ -23,7 +25,7 @@ def view_webhook_subscription():
         'client_secret': constants.CLIENT_SECRET,
     }
 
-    response = requests.get(f'{constants.BASE_URL}/push_subscriptions/', params=params)
+    response = strava.request('GET', '/push_subscriptions/', params=params)
     subscription_data = response.json()
 
     print(subscription_data)
@@ -32,12 +34,12 @@ def delete_webhook_subscription():
     """Delete a webhook subscription"""
     subscription_id = input('Enter the subscription ID to delete (run view_webhook_subscription() to check as needed!): ')
 
-    url = f"{constants.BASE_URL}/push_subscriptions/{subscription_id}"
+    url = f"/push_subscriptions/{subscription_id}"
     params = {
         "client_id": constants.CLIENT_ID,
         "client_secret": constants.CLIENT_SECRET
     }
 
-    response = requests.delete(url, params=params)
+    response = strava.request('DELETE', url, params=params)
     print(response)
    
\ No newline at end of file
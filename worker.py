@@ -0,0 +1,22 @@
+"""Entry point for Celery workers: celery -A worker.celery worker"""
+
+from celery.signals import celeryd_after_setup, worker_process_init
+from app import create_app, celery, db, partitions
+
+app = create_app(role='worker')
+
+@celeryd_after_setup.connect
+def note_partition_consumer(sender, instance, **kwargs):
+    """Note whether this worker consumes partition queues, before its pool forks."""
+    queues = instance.app.amqp.queues.consume_from or {}
+    if any(partitions.is_partition_queue(name, app.config) for name in queues):
+        partitions.consumer = True
+        if instance.concurrency > 1:
+            app.logger.warning("partition workers should run with --concurrency 1 to keep each athlete's events in order")
+
+@worker_process_init.connect
+def reset_database_pool(**kwargs):
+    """Give each prefork child its own database connections, opening one before its first task."""
+    with app.app_context():
+        db.engine.dispose(close=False)
+        db.engine.connect().close()